@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+"""Load-test the relay with simulated phones and Cursor agents.
+
+Phones subscribe on ``/ws/{session_id}`` and post prompts to ``/prompt``, one
+outstanding prompt each. Agents subscribe to the same sessions and answer
+every prompt they receive, either over the WebSocket ``"response"`` path or
+through ``/response``. End-to-end latency runs from posting a prompt until the
+phone receives the matching ``"message"`` frame.
+
+Each combination of session count and response size gets a fresh relay, and
+the run reports latency percentiles, completed round trips and delivered
+frames per second, and the relay's peak RSS (summed over its workers).
+
+    python benchmarks/bench_load.py --phones 32 --agents 4 --sessions 1 16 64 \\
+        --payload-bytes 256 4096 32768 --duration 10
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+import uuid
+import zlib
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+
+import httpx
+import websockets
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from harness import run_relay  # noqa: E402
+
+RSS_SAMPLE_SECONDS = 0.25
+
+
+class Results:
+    def __init__(self) -> None:
+        self.latencies: List[float] = []
+        self.frames = 0
+        self.errors = 0
+
+
+def percentile(sorted_values: Sequence[float], fraction: float) -> float:
+    if not sorted_values:
+        return float("nan")
+    index = min(len(sorted_values) - 1, int(fraction * len(sorted_values)))
+    return sorted_values[index]
+
+
+def process_rss_bytes(pid: int) -> int:
+    """RSS of ``pid`` plus its direct children (uvicorn workers)."""
+    pids = [pid]
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                # The command name may contain spaces; fields resume after ')'.
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        if ppid == pid:
+            pids.append(int(entry))
+    total = 0
+    for member in pids:
+        try:
+            with open(f"/proc/{member}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1]) * 1024
+                        break
+        except OSError:
+            continue
+    return total
+
+
+async def sample_rss(pid: Optional[int], peak: List[int], stop: asyncio.Event) -> None:
+    if pid is None:
+        return
+    while not stop.is_set():
+        peak[0] = max(peak[0], process_rss_bytes(pid))
+        try:
+            await asyncio.wait_for(stop.wait(), RSS_SAMPLE_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+
+
+def session_owners(sessions: int, agents: int) -> List[List[int]]:
+    """Agents responsible for each session; every session gets at least one."""
+    return [
+        [agent for agent in range(agents) if agent % sessions == index] or [index % agents]
+        for index in range(sessions)
+    ]
+
+
+async def agent(
+    index: int,
+    base_url: str,
+    session_ids: List[str],
+    owners: List[List[int]],
+    mode: str,
+    response_text: str,
+    ready: asyncio.Event,
+    results: Results,
+) -> None:
+    ws_base = base_url.replace("http://", "ws://")
+    owned = [i for i, members in enumerate(owners) if index in members]
+    connected = 0
+
+    async def serve(session_index: int, client: httpx.AsyncClient) -> None:
+        nonlocal connected
+        session_id = session_ids[session_index]
+        members = owners[session_index]
+        async with websockets.connect(f"{ws_base}/ws/{session_id}", max_size=None) as ws:
+            connected += 1
+            if connected == len(owned):
+                ready.set()
+            async for raw in ws:
+                frame = json.loads(raw)
+                if frame.get("type") != "prompt":
+                    continue
+                client_msg_id = frame["client_msg_id"]
+                # Several agents may share a session; exactly one answers.
+                if members[zlib.crc32(client_msg_id.encode()) % len(members)] != index:
+                    continue
+                response = {
+                    "type": "response",
+                    "session_id": session_id,
+                    "client_msg_id": client_msg_id,
+                    "text": response_text,
+                }
+                try:
+                    if mode == "ws":
+                        await ws.send(json.dumps(response))
+                    else:
+                        del response["type"]
+                        (await client.post("/response", json=response)).raise_for_status()
+                except httpx.HTTPError:
+                    results.errors += 1
+
+    if not owned:
+        ready.set()
+        return
+    async with httpx.AsyncClient(base_url=base_url, timeout=30.0) as client:
+        await asyncio.gather(*(serve(i, client) for i in owned))
+
+
+async def phone(
+    base_url: str,
+    session_id: str,
+    deadline: float,
+    results: Results,
+) -> None:
+    ws_base = base_url.replace("http://", "ws://")
+    waiting: Dict[str, asyncio.Future] = {}
+
+    async def receive(ws: websockets.ClientConnection) -> None:
+        async for raw in ws:
+            frame = json.loads(raw)
+            if frame.get("type") != "message":
+                continue
+            results.frames += 1
+            future = waiting.pop(frame["data"]["client_msg_id"], None)
+            if future is not None and not future.done():
+                future.set_result(time.perf_counter())
+
+    async with websockets.connect(f"{ws_base}/ws/{session_id}", max_size=None) as ws:
+        receiver = asyncio.create_task(receive(ws))
+        async with httpx.AsyncClient(base_url=base_url, timeout=30.0) as client:
+            loop = asyncio.get_running_loop()
+            while time.monotonic() < deadline:
+                # The answer can arrive before /prompt returns, so pick the id
+                # and register the waiter first.
+                client_msg_id = str(uuid.uuid4())
+                future = waiting[client_msg_id] = loop.create_future()
+                started = time.perf_counter()
+                try:
+                    reply = await client.post(
+                        "/prompt",
+                        json={
+                            "session_id": session_id,
+                            "prompt": "benchmark prompt",
+                            "client_msg_id": client_msg_id,
+                        },
+                    )
+                    reply.raise_for_status()
+                except httpx.HTTPError:
+                    waiting.pop(client_msg_id, None)
+                    results.errors += 1
+                    continue
+                try:
+                    finished = await asyncio.wait_for(future, timeout=30.0)
+                except asyncio.TimeoutError:
+                    waiting.pop(client_msg_id, None)
+                    results.errors += 1
+                    continue
+                results.latencies.append(finished - started)
+        receiver.cancel()
+
+
+async def drive(
+    base_url: str,
+    pid: Optional[int],
+    phones: int,
+    agents: int,
+    sessions: int,
+    payload_bytes: int,
+    mode: str,
+    duration: float,
+) -> Dict[str, float]:
+    run_id = os.urandom(4).hex()
+    session_ids = [f"load-{run_id}-{i}" for i in range(sessions)]
+    owners = session_owners(sessions, agents)
+    response_text = "x" * payload_bytes
+    results = Results()
+    readies = [asyncio.Event() for _ in range(agents)]
+    agent_tasks = [
+        asyncio.create_task(
+            agent(i, base_url, session_ids, owners, mode, response_text, readies[i], results)
+        )
+        for i in range(agents)
+    ]
+    await asyncio.gather(*(ready.wait() for ready in readies))
+
+    peak = [0]
+    stop = asyncio.Event()
+    sampler = asyncio.create_task(sample_rss(pid, peak, stop))
+    started = time.monotonic()
+    await asyncio.gather(
+        *(
+            phone(base_url, session_ids[i % sessions], started + duration, results)
+            for i in range(phones)
+        )
+    )
+    elapsed = time.monotonic() - started
+    stop.set()
+    await sampler
+    for task in agent_tasks:
+        task.cancel()
+    await asyncio.gather(*agent_tasks, return_exceptions=True)
+
+    latencies = sorted(results.latencies)
+    return {
+        "p50": percentile(latencies, 0.50) * 1000,
+        "p95": percentile(latencies, 0.95) * 1000,
+        "p99": percentile(latencies, 0.99) * 1000,
+        "round_trips": len(latencies) / elapsed,
+        "frames": results.frames / elapsed,
+        "rss_mb": peak[0] / (1024 * 1024),
+        "errors": results.errors,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--phones", type=int, default=32, help="simulated phone clients")
+    parser.add_argument("--agents", type=int, default=4, help="simulated Cursor agents")
+    parser.add_argument("--sessions", type=int, nargs="+", default=[1, 16, 64])
+    parser.add_argument("--payload-bytes", type=int, nargs="+", default=[256, 4096, 32768],
+                        help="response text sizes")
+    parser.add_argument("--agent-mode", choices=["ws", "http"], default="ws",
+                        help="answer over the WebSocket or POST /response")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per run")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers per relay")
+    parser.add_argument("--url", help="drive an already running relay instead (no RSS)")
+    args = parser.parse_args()
+
+    print(
+        f"phones={args.phones} agents={args.agents} mode={args.agent_mode} "
+        f"workers={args.workers} duration={args.duration}s"
+    )
+    print(
+        f"{'sessions':>8} {'payload':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+        f"{'rt/s':>8} {'frames/s':>9} {'rss MB':>7} {'errors':>6}"
+    )
+    for sessions in args.sessions:
+        for payload_bytes in args.payload_bytes:
+            job = (args.phones, args.agents, sessions, payload_bytes, args.agent_mode, args.duration)
+            if args.url:
+                row = asyncio.run(drive(args.url, None, *job))
+            else:
+                with run_relay(workers=args.workers) as relay:
+                    row = asyncio.run(drive(relay.base_url, relay.pid, *job))
+            print(
+                f"{sessions:>8} {payload_bytes:>8} {row['p50']:>8.1f} {row['p95']:>8.1f} "
+                f"{row['p99']:>8.1f} {row['round_trips']:>8.0f} {row['frames']:>9.0f} "
+                f"{row['rss_mb']:>7.1f} {row['errors']:>6}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""Report bytes per stored message for the relay's in-memory session storage.
+
+Compares the original representation (a Pydantic model per message wrapped in
+a ``HistoryEntry`` dataclass) with the compact slotted records the relay
+stores today. Both are filled the way ``create_prompt``/``create_response``
+fill a session: every prompt is indexed in ``prompts`` and ``history``, every
+response in ``responses_by_client``, ``responses_by_assistant`` and
+``history``.
+
+Every response gets its own code block unless a row says ``repeated``; that
+row shows what the per-session blob store saves when responses repeat the
+same block, on top of the compact records.
+
+    python benchmarks/bench_memory.py --messages 20000
+"""
+
+import argparse
+import gc
+import sys
+import tracemalloc
+import uuid
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Literal, Union
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import server  # noqa: E402
+from server import AssistantMessage, PromptMessage, SessionState  # noqa: E402
+
+SESSION_ID = "bench-session"
+
+
+@dataclass
+class LegacyHistoryEntry:
+    type: Literal["prompt", "assistant"]
+    data: Union[PromptMessage, AssistantMessage]
+
+
+def make_metadata(i: int, code_bytes: int, repeat_code: bool) -> Dict[str, Any]:
+    if not code_bytes:
+        return {}
+    head = "# same\n" if repeat_code else f"# block {i}\n"
+    code = head + "x" * (code_bytes - len(head))
+    return {
+        "has_code_blocks": True,
+        "code_blocks": [{"type": "code", "filename": "app.py", "code": code}],
+    }
+
+
+def fill_legacy(pairs: int, text_bytes: int, code_bytes: int, repeat_code: bool) -> Dict[str, Any]:
+    store: Dict[str, Any] = {
+        "prompts": {},
+        "responses_by_client": {},
+        "responses_by_assistant": {},
+        "history": [],
+    }
+    for i in range(pairs):
+        client_msg_id = str(uuid.uuid4())
+        prompt = PromptMessage(
+            session_id=SESSION_ID,
+            client_msg_id=client_msg_id,
+            prompt=f"prompt {i} " + "p" * 64,
+            metadata={},
+            ts=i,
+        )
+        store["prompts"][client_msg_id] = prompt
+        store["history"].append(LegacyHistoryEntry(type="prompt", data=prompt))
+        assistant_msg_id = str(uuid.uuid4())
+        response = AssistantMessage(
+            session_id=SESSION_ID,
+            assistant_msg_id=assistant_msg_id,
+            client_msg_id=client_msg_id,
+            text=f"answer {i} " + "t" * text_bytes,
+            metadata=make_metadata(i, code_bytes, repeat_code),
+            ts=i,
+        )
+        store["responses_by_client"][client_msg_id] = response
+        store["responses_by_assistant"][assistant_msg_id] = response
+        store["history"].append(LegacyHistoryEntry(type="assistant", data=response))
+    return store
+
+
+def fill_compact(pairs: int, text_bytes: int, code_bytes: int, repeat_code: bool) -> SessionState:
+    session = SessionState(session_id=SESSION_ID)
+    for i in range(pairs):
+        client_msg_id = str(uuid.uuid4())
+        server.store_prompt_locked(session, client_msg_id, f"prompt {i} " + "p" * 64, {}, i)
+        server.store_response_locked(
+            session,
+            client_msg_id,
+            str(uuid.uuid4()),
+            f"answer {i} " + "t" * text_bytes,
+            make_metadata(i, code_bytes, repeat_code),
+            i,
+        )
+    return session
+
+
+def measure(
+    fill: Callable[[int, int, int, bool], Any],
+    pairs: int,
+    text_bytes: int,
+    code_bytes: int,
+    repeat_code: bool = False,
+) -> float:
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    store = fill(pairs, text_bytes, code_bytes, repeat_code)
+    gc.collect()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del store
+    return (after - before) / (pairs * 2)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=20000, help="stored messages per run")
+    args = parser.parse_args()
+    pairs = max(args.messages // 2, 1)
+    # Keep the budget and cap out of the way so nothing is trimmed or evicted.
+    server.session_manager.history_cap = sys.maxsize
+    server.session_manager.memory_budget_bytes = sys.maxsize
+
+    cases: List[Dict[str, Any]] = [
+        {"text_bytes": 64, "code_bytes": 0},
+        {"text_bytes": 1024, "code_bytes": 0},
+        {"text_bytes": 2048, "code_bytes": 2048},
+        {"text_bytes": 2048, "code_bytes": 2048, "repeat_code": True},
+    ]
+    print(f"{'response text':>14} {'code block':>20} {'before B/msg':>13} {'after B/msg':>12} {'saved':>7}")
+    for case in cases:
+        legacy = measure(fill_legacy, pairs, **case)
+        compact = measure(fill_compact, pairs, **case)
+        code = f"{case['code_bytes']}{' repeated' if case.get('repeat_code') else ''}"
+        print(
+            f"{case['text_bytes']:>14} {code:>20} {legacy:>13.0f} {compact:>12.0f}"
+            f" {1 - compact / legacy:>7.0%}"
+        )
+
+
+if __name__ == "__main__":
+    main()
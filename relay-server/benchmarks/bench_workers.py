@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""Measure relay throughput as the number of uvicorn workers grows.
+
+Each run starts ``uvicorn server:app --workers N`` (sharing state over the
+Unix-socket event bus when N > 1) and drives it from several load-generator
+processes. One operation is a prompt posted to ``/prompt`` followed by its
+response posted to ``/response``, spread over many sessions.
+
+    python benchmarks/bench_workers.py --workers 1 2 4 --duration 10
+"""
+
+import argparse
+import asyncio
+import multiprocessing
+import os
+import random
+import sys
+import time
+from pathlib import Path
+from typing import List, Tuple
+
+import httpx
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from harness import run_relay  # noqa: E402
+
+
+async def drive(base_url: str, concurrency: int, duration: float, sessions: int) -> Tuple[int, int]:
+    ops = 0
+    errors = 0
+    deadline = time.monotonic() + duration
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async def loop(client: httpx.AsyncClient) -> None:
+        nonlocal ops, errors
+        while time.monotonic() < deadline:
+            session_id = f"bench-{random.randrange(sessions)}"
+            try:
+                prompt = await client.post(
+                    "/prompt", json={"session_id": session_id, "prompt": "ping"}
+                )
+                client_msg_id = prompt.json()["client_msg_id"]
+                await client.post(
+                    "/response",
+                    json={"session_id": session_id, "client_msg_id": client_msg_id, "text": "pong"},
+                )
+                ops += 1
+            except httpx.HTTPError:
+                errors += 1
+
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=30.0) as client:
+        await asyncio.gather(*(loop(client) for _ in range(concurrency)))
+    return ops, errors
+
+
+def client_process(args: Tuple[str, int, float, int]) -> Tuple[int, int]:
+    return asyncio.run(drive(*args))
+
+
+def run(workers: int, clients: int, concurrency: int, duration: float, sessions: int) -> Tuple[float, int]:
+    with run_relay(workers=workers) as relay:
+        job = (relay.base_url, concurrency, duration, sessions)
+        with multiprocessing.Pool(clients) as pool:
+            results: List[Tuple[int, int]] = pool.map(client_process, [job] * clients)
+    ops = sum(r[0] for r in results)
+    errors = sum(r[1] for r in results)
+    # Two HTTP requests per operation.
+    return 2 * ops / duration, errors
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--clients", type=int, default=os.cpu_count() or 1,
+                        help="load-generator processes")
+    parser.add_argument("--concurrency", type=int, default=16,
+                        help="in-flight operations per load generator")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per run")
+    parser.add_argument("--sessions", type=int, default=64)
+    args = parser.parse_args()
+
+    print(f"cpus={os.cpu_count()} clients={args.clients} concurrency={args.concurrency}")
+    print(f"{'workers':>7} {'req/s':>9} {'speedup':>8} {'errors':>7}")
+    baseline = None
+    for workers in args.workers:
+        rate, errors = run(workers, args.clients, args.concurrency, args.duration, args.sessions)
+        baseline = baseline or rate
+        print(f"{workers:>7} {rate:>9.0f} {rate / baseline:>7.2f}x {errors:>7}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""Helpers shared by the relay benchmarks: run server.py as a local subprocess."""
+
+import contextlib
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, Iterator, Optional
+
+import httpx
+
+RELAY_DIR = Path(__file__).resolve().parent.parent
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_ready(base_url: str, timeout: float = 20.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(f"{base_url}/healthz", timeout=1.0).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.1)
+    raise RuntimeError(f"relay at {base_url} did not become ready")
+
+
+@contextlib.contextmanager
+def run_relay(
+    workers: int = 1,
+    port: Optional[int] = None,
+    env: Optional[Dict[str, str]] = None,
+) -> Iterator[subprocess.Popen]:
+    """Start ``uvicorn server:app`` and yield the process once it serves.
+
+    With more than one worker the processes share state through a Unix-socket
+    event bus in a temporary directory. The relay's base URL is exposed as
+    ``process.base_url``.
+    """
+    port = port or free_port()
+    with tempfile.TemporaryDirectory(prefix="relay-bench-") as tmp:
+        relay_env = {**os.environ, **(env or {})}
+        if workers > 1:
+            relay_env.setdefault("RELAY_EVENT_BUS", f"unix:{tmp}/bus.sock")
+        process = subprocess.Popen(
+            [
+                sys.executable,
+                "-m",
+                "uvicorn",
+                "server:app",
+                "--host",
+                "127.0.0.1",
+                "--port",
+                str(port),
+                "--workers",
+                str(workers),
+                "--log-level",
+                "warning",
+            ],
+            cwd=RELAY_DIR,
+            env=relay_env,
+            stdout=subprocess.DEVNULL,
+        )
+        process.base_url = f"http://127.0.0.1:{port}"  # type: ignore[attr-defined]
+        try:
+            wait_ready(process.base_url)  # type: ignore[attr-defined]
+            yield process
+        finally:
+            process.terminate()
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.wait()
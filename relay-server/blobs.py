@@ -0,0 +1,156 @@
+"""Content-addressed storage for code blocks in assistant responses.
+
+The Cursor payload sends each code block twice, once appended to ``text`` as
+``[CODE: <filename>]\\n<code>`` and once in ``metadata.code_blocks``, and
+re-sends whole messages whenever a bubble is re-extracted. The relay keeps one
+copy of each block body per session, keyed by its SHA-256, and stores
+responses in *reference form*:
+
+- each ``metadata.code_blocks`` entry loses ``code`` and gains ``blob`` (the
+  hex digest) and ``size`` (the body length in bytes);
+- the copy in ``text`` becomes ``[CODE: <filename>]\\n[BLOB: <digest>]``.
+
+Clients that opt in receive the reference form and fetch each body once from
+``GET /blobs/{session_id}/{digest}``; everyone else gets ``inline`` output,
+identical to what the payload originally sent.
+"""
+from __future__ import annotations
+
+import hashlib
+import re
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+# Bodies shorter than this stay inline; a reference would not save much.
+BLOB_MIN_BYTES = 256
+BLOB_OVERHEAD_BYTES = 96
+
+BLOB_PLACEHOLDER = "[BLOB: {digest}]"
+BLOB_PLACEHOLDER_RE = re.compile(r"\[BLOB: ([0-9a-f]{64})\]")
+# Finds references in an encoded record without decoding it.
+BLOB_REF_RE = re.compile(rb'"blob":"([0-9a-f]{64})"')
+
+
+def blob_digest(body: bytes) -> str:
+    return hashlib.sha256(body).hexdigest()
+
+
+def blob_refs(encoded: bytes) -> Tuple[str, ...]:
+    """Digests referenced by ``metadata.code_blocks`` in an encoded record."""
+    if b'"blob":"' not in encoded:
+        return ()
+    return tuple(match.decode("ascii") for match in BLOB_REF_RE.findall(encoded))
+
+
+def code_marker(filename: Any) -> str:
+    return f"[CODE: {filename}]\n"
+
+
+def dedupe_code_blocks(
+    text: str,
+    metadata: Optional[Dict[str, Any]],
+    min_bytes: int = BLOB_MIN_BYTES,
+) -> Tuple[str, Optional[Dict[str, Any]], Dict[str, bytes]]:
+    """Rewrite a response into reference form.
+
+    Returns the new text and metadata plus the bodies by digest. ``metadata``
+    is not modified; a shallow copy is returned when anything changed.
+    """
+    if not metadata or not isinstance(metadata.get("code_blocks"), list):
+        return text, metadata, {}
+    bodies: Dict[str, bytes] = {}
+    blocks: List[Any] = []
+    for block in metadata["code_blocks"]:
+        code = block.get("code") if isinstance(block, dict) else None
+        if not isinstance(code, str):
+            blocks.append(block)
+            continue
+        body = code.encode("utf-8")
+        if len(body) < min_bytes:
+            blocks.append(block)
+            continue
+        digest = blob_digest(body)
+        bodies[digest] = body
+        ref = {key: value for key, value in block.items() if key != "code"}
+        ref["blob"] = digest
+        ref["size"] = len(body)
+        blocks.append(ref)
+        marker = code_marker(block.get("filename"))
+        text = text.replace(marker + code, marker + BLOB_PLACEHOLDER.format(digest=digest))
+    if not bodies:
+        return text, metadata, {}
+    return text, {**metadata, "code_blocks": blocks}, bodies
+
+
+def inline_code_blocks(data: Dict[str, Any], lookup: Callable[[str], Optional[bytes]]) -> Dict[str, Any]:
+    """Undo ``dedupe_code_blocks`` on a decoded message, in place."""
+    metadata = data.get("metadata")
+    if not metadata or not isinstance(metadata.get("code_blocks"), list):
+        return data
+    blocks: List[Any] = []
+    for block in metadata["code_blocks"]:
+        digest = block.get("blob") if isinstance(block, dict) else None
+        body = lookup(digest) if digest else None
+        if body is None:
+            blocks.append(block)
+            continue
+        inline = {key: value for key, value in block.items() if key not in ("blob", "size")}
+        inline["code"] = body.decode("utf-8")
+        blocks.append(inline)
+    metadata["code_blocks"] = blocks
+
+    def replace(match: "re.Match[str]") -> str:
+        body = lookup(match.group(1))
+        return match.group(0) if body is None else body.decode("utf-8")
+
+    if isinstance(data.get("text"), str):
+        data["text"] = BLOB_PLACEHOLDER_RE.sub(replace, data["text"])
+    return data
+
+
+class BlobStore:
+    """Reference-counted blob bodies for one session."""
+
+    __slots__ = ("bodies", "refs")
+
+    def __init__(self) -> None:
+        self.bodies: Dict[str, bytes] = {}
+        self.refs: Dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return len(self.bodies)
+
+    def get(self, digest: str) -> Optional[bytes]:
+        return self.bodies.get(digest)
+
+    def retain(self, digests: Iterable[str], bodies: Dict[str, bytes]) -> Tuple[int, List[str]]:
+        """Take a reference on each digest.
+
+        Returns the bytes newly held and the digests whose bodies were added.
+        """
+        added = 0
+        new: List[str] = []
+        for digest in digests:
+            count = self.refs.get(digest, 0)
+            if count == 0 and digest not in self.bodies:
+                body = bodies.get(digest)
+                if body is None:
+                    continue
+                self.bodies[digest] = body
+                added += len(body) + BLOB_OVERHEAD_BYTES
+                new.append(digest)
+            self.refs[digest] = count + 1
+        return added, new
+
+    def release(self, digests: Iterable[str]) -> int:
+        """Drop a reference on each digest; returns the bytes freed."""
+        freed = 0
+        for digest in digests:
+            count = self.refs.get(digest, 0) - 1
+            if count > 0:
+                self.refs[digest] = count
+                continue
+            self.refs.pop(digest, None)
+            body = self.bodies.pop(digest, None)
+            if body is not None:
+                freed += len(body) + BLOB_OVERHEAD_BYTES
+        return freed
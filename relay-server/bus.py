@@ -0,0 +1,269 @@
+"""Session event bus for running the relay as several processes.
+
+Every state change (stored prompt, stored response, stream frame) is published
+as an event and applied by every relay process in the same order, so each
+process keeps an identical replica of session state and fans out to its own
+WebSocket subscribers and long-polls.
+
+``EventBus`` is the single-process default: events are applied immediately.
+``UnixSocketBus`` connects processes on one machine through a broker that
+listens on a Unix socket. The broker is whichever process holds an exclusive
+lock on ``<path>.lock``; it sequences every event, echoes it to all connected
+processes (including the publisher) and applies it locally in that same
+order. If the broker exits, the remaining processes elect a new one.
+Only the broker mirrors applied events to the session store.
+"""
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import fcntl
+import itertools
+import os
+import uuid
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+Event = Dict[str, Any]
+EventHandler = Callable[[Event], Awaitable[Any]]
+
+BUS_CONNECT_TIMEOUT_SECONDS = 5.0
+BUS_RETRY_SECONDS = 0.2
+# Events carry whole messages; allow lines well above MAX_MESSAGE_BYTES.
+BUS_LINE_LIMIT = 16 * 1024 * 1024
+
+
+class EventBus:
+    """In-process bus: this process owns all state, so events apply directly."""
+
+    name = "local"
+
+    def __init__(self) -> None:
+        self.handler: Optional[EventHandler] = None
+        self.published = 0
+
+    async def start(self, handler: EventHandler) -> None:
+        self.handler = handler
+
+    async def close(self) -> None:
+        return None
+
+    @property
+    def persists(self) -> bool:
+        """Whether this process writes applied events to the session store."""
+        return True
+
+    async def publish(self, event: Event) -> Any:
+        """Apply ``event`` everywhere and return this process's handler result."""
+        assert self.handler is not None, "event bus not started"
+        self.published += 1
+        return await self.handler(event)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": self.name, "published": self.published}
+
+
+class UnixSocketBus(EventBus):
+    """Totally ordered event broadcast between processes through a local broker.
+
+    Lines on the socket are ``<origin> <event id> <JSON event>``. The origin
+    and id let a publisher match the echo of its own event to the pending
+    ``publish`` call, which resolves once the event has been applied locally.
+    """
+
+    name = "unix"
+
+    def __init__(
+        self,
+        path: str,
+        encode: Callable[[Any], bytes],
+        decode: Callable[[bytes], Any],
+    ) -> None:
+        super().__init__()
+        self.path = path
+        self.encode = encode
+        self.decode = decode
+        self.origin = uuid.uuid4().hex[:12].encode()
+        self.ids = itertools.count(1)
+        self.waiters: Dict[bytes, asyncio.Future] = {}
+        self.connected = asyncio.Event()
+        self.is_broker = False
+        self.lock_fd: Optional[int] = None
+        self.server: Optional[asyncio.AbstractServer] = None
+        self.peers: List[asyncio.StreamWriter] = []
+        self.sequencer: Optional[asyncio.Queue] = None
+        self.writer: Optional[asyncio.StreamWriter] = None
+        self.tasks: List[asyncio.Task] = []
+        self.applied = 0
+        self.elections = 0
+
+    async def start(self, handler: EventHandler) -> None:
+        await super().start(handler)
+        self.tasks.append(asyncio.create_task(self._run()))
+
+    async def close(self) -> None:
+        for task in self.tasks:
+            task.cancel()
+        for task in self.tasks:
+            with contextlib.suppress(asyncio.CancelledError):
+                await task
+        self.tasks.clear()
+        await self._stop_broker()
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+    @property
+    def persists(self) -> bool:
+        # The broker applies every event, so it alone writes them to a shared
+        # store; the others would only repeat each row.
+        return self.is_broker
+
+    async def publish(self, event: Event) -> Any:
+        try:
+            await asyncio.wait_for(self.connected.wait(), BUS_CONNECT_TIMEOUT_SECONDS)
+        except asyncio.TimeoutError:
+            raise RuntimeError("event bus unavailable") from None
+        self.published += 1
+        event_id = str(next(self.ids)).encode()
+        line = b"%s %s %s\n" % (self.origin, event_id, self.encode(event))
+        future = asyncio.get_running_loop().create_future()
+        self.waiters[event_id] = future
+        try:
+            if self.is_broker:
+                assert self.sequencer is not None
+                self.sequencer.put_nowait(line)
+            else:
+                assert self.writer is not None
+                self.writer.write(line)
+            return await future
+        finally:
+            self.waiters.pop(event_id, None)
+
+    async def _run(self) -> None:
+        """Elect a broker or connect to one, forever."""
+        while True:
+            self.elections += 1
+            if self._try_lock():
+                await self._serve()
+                return
+            try:
+                reader, writer = await asyncio.open_unix_connection(
+                    self.path, limit=BUS_LINE_LIMIT
+                )
+            except OSError:
+                await asyncio.sleep(BUS_RETRY_SECONDS)
+                continue
+            self.writer = writer
+            self.connected.set()
+            try:
+                while True:
+                    line = await reader.readline()
+                    if not line:
+                        break
+                    await self._apply(line)
+            finally:
+                self.connected.clear()
+                self.writer = None
+                writer.close()
+                self._fail_waiters()
+
+    def _try_lock(self) -> bool:
+        fd = os.open(self.path + ".lock", os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        self.lock_fd = fd
+        return True
+
+    async def _serve(self) -> None:
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(self.path)
+        self.is_broker = True
+        self.sequencer = asyncio.Queue()
+        self.server = await asyncio.start_unix_server(
+            self._handle_peer, path=self.path, limit=BUS_LINE_LIMIT
+        )
+        self.connected.set()
+        print(f"🛰️  Event bus broker listening on {self.path}")
+        while True:
+            line = await self.sequencer.get()
+            for peer in list(self.peers):
+                if peer.is_closing():
+                    self.peers.remove(peer)
+                else:
+                    peer.write(line)
+            await self._apply(line)
+
+    async def _handle_peer(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.peers.append(writer)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                assert self.sequencer is not None
+                self.sequencer.put_nowait(line)
+        except (ConnectionError, asyncio.LimitOverrunError, ValueError):
+            pass
+        finally:
+            with contextlib.suppress(ValueError):
+                self.peers.remove(writer)
+            writer.close()
+
+    async def _stop_broker(self) -> None:
+        if self.server is not None:
+            self.server.close()
+            for peer in self.peers:
+                peer.close()
+            self.peers.clear()
+            self.server = None
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(self.path)
+        if self.lock_fd is not None:
+            os.close(self.lock_fd)
+            self.lock_fd = None
+        self.is_broker = False
+        self.connected.clear()
+
+    async def _apply(self, line: bytes) -> None:
+        origin, event_id, body = self._split(line)
+        assert self.handler is not None
+        try:
+            result = await self.handler(self.decode(body))
+        except Exception as exc:  # noqa: BLE001 - one bad event must not stop the bus
+            if origin == self.origin and event_id in self.waiters:
+                self.waiters[event_id].set_exception(exc)
+            else:
+                print(f"❌ Failed to apply bus event: {exc}")
+            return
+        self.applied += 1
+        if origin == self.origin:
+            future = self.waiters.get(event_id)
+            if future is not None and not future.done():
+                future.set_result(result)
+
+    @staticmethod
+    def _split(line: bytes) -> Tuple[bytes, bytes, bytes]:
+        origin, event_id, body = line.rstrip(b"\n").split(b" ", 2)
+        return origin, event_id, body
+
+    def _fail_waiters(self) -> None:
+        # Events in flight when the broker went away may or may not have been
+        # sequenced; let the callers surface the failure.
+        for future in self.waiters.values():
+            if not future.done():
+                future.set_exception(RuntimeError("event bus connection lost"))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": self.name,
+            "path": self.path,
+            "role": "broker" if self.is_broker else "client",
+            "connected": self.connected.is_set(),
+            "peers": len(self.peers),
+            "published": self.published,
+            "applied": self.applied,
+            "elections": self.elections,
+        }
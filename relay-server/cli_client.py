@@ -2,55 +2,91 @@
 """Simple CLI client to interact with Cursor via relay server."""
 
 import asyncio
+import contextlib
 import json
+import random
+import re
 import sys
+import time
+import uuid
 from typing import Optional
 
 import httpx
 import websockets
 
+import wire
+from render import DEFAULT_COLLAPSE_LINES, Renderer
 
-# ANSI color codes
-class Colors:
-    RED = '\033[91m'
-    GREEN = '\033[92m'
-    YELLOW = '\033[93m'
-    BLUE = '\033[94m'
-    MAGENTA = '\033[95m'
-    CYAN = '\033[96m'
-    WHITE = '\033[97m'
-    RESET = '\033[0m'
-    BOLD = '\033[1m'
-    DIM = '\033[2m'
+
+BLOB_PLACEHOLDER_RE = re.compile(r"\[BLOB: ([0-9a-f]{64})\]")
+RECONNECT_BASE_SECONDS = 0.5
+RECONNECT_MAX_SECONDS = 30.0
+CONNECT_TIMEOUT_SECONDS = 10.0
+RESPONSE_TIMEOUT_SECONDS = 120.0
+DEFAULT_BATCH_CONCURRENCY = 4
 
 
 class CursorClient:
-    def __init__(self, server_url: str = "http://localhost:8000", session_id: str = "cursor-desktop-session"):
+    def __init__(self, server_url: str = "http://localhost:8000", session_id: str = "cursor-desktop-session",
+                 binary: bool = True, collapse_lines: int = DEFAULT_COLLAPSE_LINES):
         self.server_url = server_url
         self.session_id = session_id
+        # Offer the binary subprotocols; the relay falls back to JSON text if it declines.
+        self.subprotocols = wire.supported_protocols() if binary else []
+        self.protocol = None
         self.client = httpx.AsyncClient(timeout=180.0)
         self.ws = None
         self.ws_url = server_url.replace("http://", "ws://").replace("https://", "wss://")
         self.message_queue = asyncio.Queue()
         self.pending_responses = {}  # client_msg_id -> asyncio.Future
+        self.blob_cache = {}  # digest -> code block body
+        self.last_seq = None  # highest history seq seen; resumes reconnects from here
+        self.connected = asyncio.Event()  # set while the WebSocket is up
+        self.echo = True  # print prompts and messages as they go by
+        self.renderer = Renderer(collapse_lines)
+    
+    async def fetch_last_seq(self) -> int:
+        """Current end of the session history, the starting point for resume."""
+        response = await self.client.get(
+            f"{self.server_url}/messages/{self.session_id}",
+            params={"order": "desc", "limit": 1}
+        )
+        if response.status_code == 404:
+            return 0
+        response.raise_for_status()
+        return response.json()["last_seq"]
     
-    async def connect_websocket(self):
-        """Connect to WebSocket and handle incoming messages."""
-        ws_url = f"{self.ws_url}/ws/{self.session_id}"
-        print(f"🔌 Connecting to WebSocket: {ws_url}")
+    async def connect_websocket(self) -> bool:
+        """Connect to WebSocket and handle incoming messages.
         
+        Returns whether a connection was established.
+        """
+        connected = False
         try:
-            async with websockets.connect(ws_url) as websocket:
+            if self.last_seq is None:
+                self.last_seq = await self.fetch_last_seq()
+            # Code blocks arrive as blob references and are fetched once each;
+            # last_seq makes the relay replay anything broadcast while we were away.
+            ws_url = f"{self.ws_url}/ws/{self.session_id}?blobs=ref&last_seq={self.last_seq}"
+            print(f"🔌 Connecting to WebSocket: {ws_url}")
+            
+            async with websockets.connect(ws_url, subprotocols=self.subprotocols or None) as websocket:
+                connected = True
                 self.ws = websocket
-                print(f"✅ WebSocket connected\n")
+                self.protocol = websocket.subprotocol
+                self.connected.set()
+                print(f"✅ WebSocket connected ({self.protocol or 'json'})\n")
                 
                 # Listen for messages
                 async for message in websocket:
                     try:
-                        data = json.loads(message)
+                        if isinstance(message, bytes):
+                            data = wire.decode(self.protocol, message)
+                        else:
+                            data = json.loads(message)
                         await self.handle_ws_message(data)
-                    except json.JSONDecodeError:
-                        print(f"⚠️  Invalid JSON from server: {message}")
+                    except ValueError:
+                        print(f"⚠️  Invalid frame from server: {message[:200]!r}")
                     except Exception as e:
                         print(f"❌ Error handling message: {e}")
         except websockets.exceptions.WebSocketException as e:
@@ -59,6 +95,17 @@ class CursorClient:
         except Exception as e:
             print(f"❌ Connection error: {e}")
             self.ws = None
+        finally:
+            self.connected.clear()
+        return connected
+    
+    async def wait_connected(self, ws_task: asyncio.Task, timeout: float = CONNECT_TIMEOUT_SECONDS):
+        """Wait until ``ws_task`` has the WebSocket up; raise ConnectionError if it can't."""
+        ready = asyncio.ensure_future(self.connected.wait())
+        done, _ = await asyncio.wait({ready, ws_task}, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+        if ready not in done:
+            ready.cancel()
+            raise ConnectionError(f"could not connect to {self.ws_url}")
     
     async def handle_ws_message(self, data: dict):
         """Handle incoming WebSocket messages."""
@@ -66,56 +113,40 @@ class CursorClient:
         
         if msg_type == "ping":
             # Respond to ping
-            await self.ws.send(json.dumps({"type": "pong", "ts": data.get("ts")}))
+            await self.send_ws({"type": "pong", "ts": data.get("ts")})
+            return
+        
+        seq = data.get("seq")
+        if seq is not None:
+            if self.last_seq is not None and seq <= self.last_seq:
+                return  # Already seen before a reconnect
+            self.last_seq = seq
+        
+        if msg_type == "resumed":
+            if data.get("replayed"):
+                print(f"🔁 Replayed {data['replayed']} missed message(s)")
+            return
+        
+        if msg_type == "resync":
+            await self.catch_up(data.get("after_seq", 0))
             return
         
         if msg_type == "message":
             # Incoming message from Cursor
             msg_data = data.get("data", {})
             client_msg_id = msg_data.get("client_msg_id")
-            text = msg_data.get("text", "")
-            metadata = msg_data.get("metadata", {})
-            
-            # Print the message text
-            print(f"\n🤖 Cursor: {text}")
-            
-            # Print code blocks if present
-            code_blocks = metadata.get("code_blocks", [])
-            if code_blocks:
-                print(f"\n{Colors.YELLOW}📄 Code Changes ({len(code_blocks)} file(s)):{Colors.RESET}")
-                for block in code_blocks:
-                    filename = block.get("filename", "untitled")
-                    code = block.get("code", "")
-                    
-                    print(f"\n{Colors.CYAN}{'='*60}{Colors.RESET}")
-                    print(f"{Colors.BOLD}{Colors.MAGENTA}📝 {filename}{Colors.RESET}")
-                    print(f"{Colors.CYAN}{'='*60}{Colors.RESET}")
-                    
-                    # Print code with line numbers for readability
-                    lines = code.split('\n')
-                    for i, line in enumerate(lines, 1):
-                        line_num = f"{Colors.DIM}{i:3d}{Colors.RESET}"
-                        
-                        # Detect diff markers and colorize
-                        if line.startswith('+') and not line.startswith('+++'):
-                            print(f"  {line_num} {Colors.GREEN}+{Colors.RESET} {line[1:]}")
-                        elif line.startswith('-') and not line.startswith('---'):
-                            print(f"  {line_num} {Colors.RED}-{Colors.RESET} {line[1:]}")
-                        elif line.startswith('@@'):
-                            print(f"  {line_num} {Colors.CYAN}@{Colors.RESET} {Colors.DIM}{line}{Colors.RESET}")
-                        elif line.strip() == '---' or line.strip().startswith('---'):
-                            # Separator between old and new in diffs
-                            print(f"  {line_num} {Colors.CYAN}|{Colors.RESET} {Colors.DIM}{line}{Colors.RESET}")
-                        else:
-                            print(f"  {line_num} {Colors.DIM}|{Colors.RESET} {line}")
-                    
-                    print(f"{Colors.CYAN}{'='*60}{Colors.RESET}")
+            future = self.pending_responses.pop(client_msg_id, None) if client_msg_id else None
+            if not self.echo and future is None:
+                return
+            # Blobs are fetched by a task of their own and the message is drawn
+            # by the renderer's task; this loop goes straight back to the socket
+            resolved = asyncio.ensure_future(self.resolve_blobs(msg_data))
+            if self.echo:
+                self.renderer.submit(resolved)
             
             # If this is a response to a pending prompt, resolve it
-            if client_msg_id and client_msg_id in self.pending_responses:
-                future = self.pending_responses.pop(client_msg_id)
-                if not future.done():
-                    future.set_result(msg_data)
+            if future is not None:
+                resolved.add_done_callback(lambda task: self.deliver_response(future, task))
             
             return
         
@@ -127,37 +158,191 @@ class CursorClient:
             print(f"❌ Server error: {data.get('error')} - {data.get('details')}")
             return
     
-    async def send_prompt(self, prompt: str, metadata: Optional[dict] = None) -> dict:
-        """Send a prompt to Cursor and wait for response via WebSocket."""
-        print(f"\n📤 You: {prompt}")
+    @staticmethod
+    def deliver_response(future: asyncio.Future, resolved: asyncio.Future):
+        """Pass a response whose blobs are fetched on to ``send_prompt``."""
+        if future.done():
+            return
+        if resolved.cancelled():
+            future.cancel()
+        elif resolved.exception() is not None:
+            future.set_exception(resolved.exception())
+        else:
+            future.set_result(resolved.result())
+    
+    async def catch_up(self, after_seq: int):
+        """Fetch history missed beyond the relay's replay window."""
+        self.last_seq = after_seq
+        print(f"🔁 Catching up on history after #{after_seq}")
+        while True:
+            response = await self.client.get(
+                f"{self.server_url}/messages/{self.session_id}",
+                params={"after_seq": self.last_seq, "limit": 100, "blobs": "ref"}
+            )
+            response.raise_for_status()
+            page = response.json()
+            for msg in page["messages"]:
+                msg_type = "message" if msg["type"] == "assistant" else msg["type"]
+                await self.handle_ws_message({"type": msg_type, "seq": msg["seq"], "data": msg["data"]})
+            if not page["has_more"] or not page["messages"]:
+                return
+    
+    async def send_ws(self, payload: dict):
+        """Send a frame in the negotiated encoding."""
+        if self.protocol:
+            await self.ws.send(wire.encode(self.protocol, payload))
+        else:
+            await self.ws.send(json.dumps(payload))
+    
+    async def fetch_blob(self, digest: str) -> str:
+        """Fetch a code block body by digest, at most once per client."""
+        if digest not in self.blob_cache:
+            response = await self.client.get(
+                f"{self.server_url}/blobs/{self.session_id}/{digest}"
+            )
+            response.raise_for_status()
+            self.blob_cache[digest] = response.text
+        return self.blob_cache[digest]
+    
+    async def resolve_blobs(self, msg_data: dict) -> dict:
+        """Replace blob references in a message with the code they point to."""
+        metadata = msg_data.get("metadata") or {}
+        for block in metadata.get("code_blocks", []):
+            if "blob" in block:
+                block["code"] = await self.fetch_blob(block.pop("blob"))
+                block.pop("size", None)
         
-        # Send prompt via HTTP
-        response = await self.client.post(
-            f"{self.server_url}/prompt",
-            json={
-                "session_id": self.session_id,
-                "prompt": prompt,
-                "metadata": metadata or {}
-            }
-        )
-        response.raise_for_status()
-        result = response.json()
-        client_msg_id = result["client_msg_id"]
+        text = msg_data.get("text") or ""
+        for digest in set(BLOB_PLACEHOLDER_RE.findall(text)):
+            text = text.replace(f"[BLOB: {digest}]", await self.fetch_blob(digest))
+        msg_data["text"] = text
+        return msg_data
+    
+    async def send_prompt(self, prompt: str, metadata: Optional[dict] = None,
+                          timeout: float = RESPONSE_TIMEOUT_SECONDS,
+                          client_msg_id: Optional[str] = None) -> dict:
+        """Send a prompt to Cursor and wait for response via WebSocket."""
+        if self.echo:
+            print(f"\n📤 You: {prompt}")
         
-        # Create a future to wait for the response
-        future = asyncio.Future()
+        # Wait for the response before sending, so a fast one can't slip past
+        client_msg_id = client_msg_id or str(uuid.uuid4())
+        future = asyncio.get_running_loop().create_future()
         self.pending_responses[client_msg_id] = future
         
         try:
+            # Send prompt via HTTP
+            response = await self.client.post(
+                f"{self.server_url}/prompt",
+                json={
+                    "session_id": self.session_id,
+                    "prompt": prompt,
+                    "client_msg_id": client_msg_id,
+                    "metadata": metadata or {}
+                }
+            )
+            response.raise_for_status()
+            
             # Wait for response with timeout
-            response_data = await asyncio.wait_for(future, timeout=120.0)
-            return response_data
+            return await asyncio.wait_for(future, timeout=timeout)
         except asyncio.TimeoutError:
+            if self.echo:
+                print(f"\n⏰ No response received after {timeout:g} seconds")
+            raise TimeoutError(f"No response received after {timeout:g} seconds")
+        finally:
             self.pending_responses.pop(client_msg_id, None)
-            print(f"\n⏰ No response received after 120 seconds")
-            raise TimeoutError(f"No response received after 120 seconds")
+    
+    async def batch_mode(self, source, output, concurrency: int = DEFAULT_BATCH_CONCURRENCY,
+                         timeout: float = RESPONSE_TIMEOUT_SECONDS) -> dict:
+        """Send prompts read as JSONL from ``source``, ``concurrency`` at a time.
+        
+        Each line is ``{"prompt": "...", "id": <optional>, "metadata": {...}}`` or
+        just a JSON string. One JSONL result per prompt is written to ``output``
+        as it completes, with ``line`` and ``id`` for matching it up; the summary
+        is printed and returned.
+        """
+        self.echo = False
+        ws_task = asyncio.create_task(self.connect_websocket_with_retry())
+        queue = asyncio.Queue(maxsize=concurrency)
+        latencies = []
+        failed = 0
+        
+        async def worker():
+            nonlocal failed
+            while True:
+                item = await queue.get()
+                if item is None:
+                    return
+                result = await self.run_batch_line(*item, timeout)
+                if result["ok"]:
+                    latencies.append(result["latency_ms"])
+                else:
+                    failed += 1
+                output.write(json.dumps(result, ensure_ascii=False) + "\n")
+                output.flush()
+        
+        try:
+            await self.wait_connected(ws_task)
+            started = time.perf_counter()
+            workers = [asyncio.create_task(worker()) for _ in range(concurrency)]
+            loop = asyncio.get_running_loop()
+            line_no = 0
+            while True:
+                line = await loop.run_in_executor(None, source.readline)
+                if not line:
+                    break
+                line_no += 1
+                if line.strip():
+                    await queue.put((line_no, line))
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+            elapsed = time.perf_counter() - started
+        finally:
+            ws_task.cancel()
+            try:
+                await ws_task
+            except asyncio.CancelledError:
+                pass
+        
+        summary = batch_summary(latencies, failed, elapsed)
+        print_batch_summary(summary)
+        return summary
+    
+    async def run_batch_line(self, line_no: int, line: str, timeout: float) -> dict:
+        """Send one batch prompt and describe the outcome as a result record."""
+        result = {"line": line_no}
+        try:
+            item = json.loads(line)
+        except ValueError as e:
+            return {**result, "ok": False, "error": f"invalid JSON: {e}"}
+        if isinstance(item, str):
+            item = {"prompt": item}
+        if not isinstance(item, dict) or not isinstance(item.get("prompt"), str) or not item["prompt"].strip():
+            return {**result, "ok": False, "error": "each line needs a non-empty prompt"}
+        if "id" in item:
+            result["id"] = item["id"]
+        result["client_msg_id"] = client_msg_id = str(uuid.uuid4())
+        started = time.perf_counter()
+        try:
+            data = await self.send_prompt(item["prompt"], item.get("metadata"), timeout, client_msg_id)
+        except (httpx.HTTPError, TimeoutError) as e:
+            result.update(ok=False, error=str(e) or type(e).__name__)
+        else:
+            result.update(
+                ok=True,
+                assistant_msg_id=data.get("assistant_msg_id"),
+                text=data.get("text"),
+                metadata=data.get("metadata"),
+            )
+            if data.get("body"):
+                # Only a preview is inline; the rest is at /bodies/{session}/{digest}
+                result["body"] = data["body"]
+        result["latency_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        return result
     
     async def close(self):
+        await self.renderer.close()
         await self.client.aclose()
     
     async def read_user_input(self):
@@ -179,6 +364,8 @@ class CursorClient:
         print("  - Type your prompt and press Enter to send")
         print("  - Type 'exit' or 'quit' to exit")
         print("  - Type 'history' to view message history")
+        print("  - Type 'search <words>' to search this session's history")
+        print("  - Type 'expand <n>' to view a collapsed code block in full")
         print("  - All Cursor messages will stream here in real-time")
         print("=" * 60)
         print()
@@ -204,6 +391,16 @@ class CursorClient:
                         await self.show_history()
                         continue
                     
+                    if prompt.lower().startswith("search "):
+                        await self.search_history(prompt[len("search "):].strip())
+                        continue
+                    
+                    expand = re.fullmatch(r"expand\s+(\d+)", prompt, re.IGNORECASE)
+                    if expand:
+                        if not await self.renderer.expand(int(expand.group(1))):
+                            print(f"❌ No collapsed code block {expand.group(1)}")
+                        continue
+                    
                     # Send prompt (response will come via WebSocket)
                     try:
                         await self.send_prompt(prompt)
@@ -223,16 +420,23 @@ class CursorClient:
                 pass
     
     async def connect_websocket_with_retry(self):
-        """Connect to WebSocket with auto-retry on disconnect."""
+        """Connect to WebSocket with auto-retry on disconnect.
+        
+        Retries back off exponentially with full jitter, so many clients
+        dropped at once don't reconnect in lockstep.
+        """
+        attempt = 0
         while True:
             try:
-                await self.connect_websocket()
+                connected = await self.connect_websocket()
             except Exception as e:
                 print(f"❌ WebSocket disconnected: {e}")
+                connected = False
             
-            # Reconnect after 5 seconds
-            print("🔄 Reconnecting in 5 seconds...")
-            await asyncio.sleep(5)
+            attempt = 0 if connected else attempt + 1
+            delay = random.uniform(0, min(RECONNECT_MAX_SECONDS, RECONNECT_BASE_SECONDS * 2 ** attempt))
+            print(f"🔄 Reconnecting in {delay:.1f} seconds...")
+            await asyncio.sleep(delay)
     
     async def show_history(self):
         """Show message history."""
@@ -260,6 +464,62 @@ class CursorClient:
         
         except httpx.HTTPError as e:
             print(f"❌ Error fetching history: {e}")
+    
+    async def search_history(self, query):
+        """Show the best history matches for ``query``."""
+        try:
+            response = await self.client.get(
+                f"{self.server_url}/search/{self.session_id}",
+                params={"q": query, "limit": 10}
+            )
+            response.raise_for_status()
+            data = response.json()
+            
+            print(f"\n🔎 Search '{query}' (showing {len(data['hits'])} of {data['total']})")
+            print("=" * 60)
+            
+            for hit in data["hits"]:
+                who = "💬 You" if hit["type"] == "prompt" else "🤖 Cursor"
+                print(f"\n#{hit['seq']} {who}: {hit['snippet']}")
+            
+            print("=" * 60)
+        
+        except httpx.HTTPError as e:
+            print(f"❌ Error searching history: {e}")
+
+
+def percentile(sorted_values, fraction: float) -> float:
+    if not sorted_values:
+        return float("nan")
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+def batch_summary(latencies, failed: int, elapsed: float) -> dict:
+    latencies = sorted(latencies)
+    completed = len(latencies)
+    return {
+        "prompts": completed + failed,
+        "ok": completed,
+        "failed": failed,
+        "seconds": round(elapsed, 3),
+        "throughput_per_second": round(completed / elapsed, 2) if elapsed > 0 else 0.0,
+        "latency_ms": {
+            "p50": percentile(latencies, 0.50),
+            "p95": percentile(latencies, 0.95),
+            "p99": percentile(latencies, 0.99),
+            "max": latencies[-1] if latencies else float("nan"),
+        },
+    }
+
+
+def print_batch_summary(summary: dict):
+    latency = summary["latency_ms"]
+    print("=" * 60)
+    print(f"📊 Batch: {summary['prompts']} prompt(s), {summary['ok']} ok, {summary['failed']} failed "
+          f"in {summary['seconds']:.1f}s ({summary['throughput_per_second']:.2f} responses/s)")
+    print(f"   Latency ms: p50 {latency['p50']:.0f}  p95 {latency['p95']:.0f}  "
+          f"p99 {latency['p99']:.0f}  max {latency['max']:.0f}")
+    print("=" * 60)
 
 
 async def main():
@@ -277,6 +537,40 @@ async def main():
         default="cursor-desktop-session",
         help="Session ID (default: cursor-desktop-session)"
     )
+    parser.add_argument(
+        "--text-frames",
+        action="store_true",
+        help="Use JSON text WebSocket frames instead of the binary subprotocol"
+    )
+    parser.add_argument(
+        "--collapse-lines",
+        type=int,
+        default=DEFAULT_COLLAPSE_LINES,
+        help=f"Collapse code blocks longer than this many lines; 0 shows them in full "
+             f"(default: {DEFAULT_COLLAPSE_LINES})"
+    )
+    parser.add_argument(
+        "--batch",
+        metavar="FILE",
+        help="Send JSONL prompts from FILE ('-' for stdin) and write JSONL results"
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=DEFAULT_BATCH_CONCURRENCY,
+        help=f"Batch prompts in flight at once (default: {DEFAULT_BATCH_CONCURRENCY})"
+    )
+    parser.add_argument(
+        "--output",
+        default="-",
+        help="Where batch results go (default: stdout; progress goes to stderr)"
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=RESPONSE_TIMEOUT_SECONDS,
+        help=f"Seconds to wait for each response (default: {RESPONSE_TIMEOUT_SECONDS:g})"
+    )
     parser.add_argument(
         "prompt",
         nargs="*",
@@ -284,26 +578,46 @@ async def main():
     )
     
     args = parser.parse_args()
+    if args.concurrency < 1:
+        parser.error("--concurrency must be at least 1")
     
-    client = CursorClient(server_url=args.server, session_id=args.session)
+    # Only interactive mode can expand a collapsed block later
+    collapse_lines = args.collapse_lines if not (args.prompt or args.batch) else 0
+    client = CursorClient(server_url=args.server, session_id=args.session, binary=not args.text_frames,
+                          collapse_lines=collapse_lines)
     
     try:
-        if args.prompt:
+        if args.batch:
+            source = sys.stdin if args.batch == "-" else open(args.batch, encoding="utf-8")
+            output = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8")
+            try:
+                # Keep stdout for results; everything else is progress
+                with contextlib.redirect_stdout(sys.stderr):
+                    summary = await client.batch_mode(source, output, args.concurrency, args.timeout)
+            except ConnectionError as e:
+                print(f"❌ Error: {e}", file=sys.stderr)
+                return 1
+            finally:
+                if source is not sys.stdin:
+                    source.close()
+                if output is not sys.stdout:
+                    output.close()
+            return 1 if summary["failed"] else 0
+        elif args.prompt:
             # One-shot mode with WebSocket
             prompt = " ".join(args.prompt)
             
             # Start WebSocket listener
             ws_task = asyncio.create_task(client.connect_websocket())
             
-            # Give WebSocket time to connect
-            await asyncio.sleep(1)
-            
             try:
+                await client.wait_connected(ws_task)
                 # Send prompt and wait for response
-                response = await client.send_prompt(prompt)
+                response = await client.send_prompt(prompt, timeout=args.timeout)
                 # Response already printed via WebSocket handler
             except Exception as e:
                 print(f"❌ Error: {e}")
+                return 1
             finally:
                 ws_task.cancel()
                 try:
@@ -315,11 +629,12 @@ async def main():
             await client.interactive_mode()
     finally:
         await client.close()
+    return 0
 
 
 if __name__ == "__main__":
     try:
-        asyncio.run(main())
+        sys.exit(asyncio.run(main()))
     except KeyboardInterrupt:
         print("\n👋 Goodbye!")
         sys.exit(0)
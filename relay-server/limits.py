@@ -0,0 +1,131 @@
+"""Token-bucket admission control for writes to the relay.
+
+Every prompt or response is charged against up to three buckets: one for the
+whole relay process, one for its session and one for the sending client's
+address. A bucket holds at most ``burst`` tokens and refills at ``rate``
+tokens per second; a rate of 0 disables that scope. A write is admitted only
+if every bucket can pay for it, so a rejection never spends tokens.
+
+Buckets live in each process, so with ``uvicorn --workers N`` the effective
+limits are N times the configured ones.
+"""
+from __future__ import annotations
+
+import time
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+# Per-session and per-client buckets kept before the least recently used is
+# forgotten (which refills it).
+MAX_TRACKED_KEYS = 10_000
+
+
+class TokenBucket:
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate: float, burst: float, now: float) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+
+    def refill(self, now: float) -> None:
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, cost: float) -> float:
+        """Seconds until ``cost`` tokens are available; 0 if they are now."""
+        missing = min(cost, self.burst) - self.tokens
+        return missing / self.rate if missing > 0 else 0.0
+
+    def take(self, cost: float) -> None:
+        # A full bucket pays for any single write, however large.
+        self.tokens -= min(cost, self.burst)
+
+
+class BucketMap:
+    """Token buckets by key, forgetting the least recently used."""
+
+    def __init__(self, rate: float, burst: float, max_keys: int = MAX_TRACKED_KEYS) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self.buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+
+    def get(self, key: str, now: float) -> TokenBucket:
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = TokenBucket(self.rate, self.burst, now)
+            if len(self.buckets) > self.max_keys:
+                self.buckets.popitem(last=False)
+        else:
+            self.buckets.move_to_end(key)
+        return bucket
+
+
+class RateLimiter:
+    def __init__(
+        self,
+        global_rate: float = 0,
+        global_burst: float = 0,
+        session_rate: float = 0,
+        session_burst: float = 0,
+        client_rate: float = 0,
+        client_burst: float = 0,
+    ) -> None:
+        now = time.monotonic()
+        self.global_bucket = (
+            TokenBucket(global_rate, burst_for(global_rate, global_burst), now)
+            if global_rate > 0
+            else None
+        )
+        self.sessions = (
+            BucketMap(session_rate, burst_for(session_rate, session_burst))
+            if session_rate > 0
+            else None
+        )
+        self.clients = (
+            BucketMap(client_rate, burst_for(client_rate, client_burst))
+            if client_rate > 0
+            else None
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return self.global_bucket is not None or self.sessions is not None or self.clients is not None
+
+    def check(
+        self, session_id: str, client: Optional[str], cost: float = 1
+    ) -> Optional[Tuple[str, float]]:
+        """Charge one write of ``cost`` tokens.
+
+        Returns ``None`` when admitted, otherwise the scope that refused it
+        ("global", "session" or "client") and the seconds until it would be
+        admitted.
+        """
+        if not self.enabled:
+            return None
+        now = time.monotonic()
+        buckets: List[Tuple[str, TokenBucket]] = []
+        if self.global_bucket is not None:
+            buckets.append(("global", self.global_bucket))
+        if self.sessions is not None:
+            buckets.append(("session", self.sessions.get(session_id, now)))
+        if self.clients is not None and client is not None:
+            buckets.append(("client", self.clients.get(client, now)))
+        refused: Optional[Tuple[str, float]] = None
+        for scope, bucket in buckets:
+            bucket.refill(now)
+            wait = bucket.wait_time(cost)
+            if wait > 0 and (refused is None or wait > refused[1]):
+                refused = (scope, wait)
+        if refused is not None:
+            return refused
+        for _, bucket in buckets:
+            bucket.take(cost)
+        return None
+
+
+def burst_for(rate: float, burst: float) -> float:
+    """Default the burst to two seconds' worth of tokens, and at least one."""
+    return max(burst if burst > 0 else 2 * rate, 1.0)
@@ -0,0 +1,144 @@
+"""Minimal Prometheus metrics for the relay server.
+
+Counters and histograms are plain attribute updates (a bisect for histogram
+buckets), cheap enough for every request and frame. Gauges are callbacks
+evaluated only when ``/metrics`` is scraped.
+"""
+from __future__ import annotations
+
+import bisect
+from typing import Callable, Iterable, List, Sequence, Union
+
+Number = Union[int, float]
+
+LATENCY_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+ROUND_TRIP_BUCKETS = (0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0)
+LONG_POLL_BUCKETS = (0.001, 0.01, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+SIZE_BUCKETS = (1, 4, 16, 64, 256, 1024, 4096, 16384, 65536)
+BYTE_BUCKETS = (1024, 16384, 131072, 1048576, 8388608, 67108864, 536870912)
+
+
+def format_value(value: Number) -> str:
+    if isinstance(value, float) and value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    __slots__ = ("name", "help", "value")
+
+    def __init__(self, name: str, help: str) -> None:
+        self.name = name
+        self.help = help
+        self.value: Number = 0
+
+    def inc(self, amount: Number = 1) -> None:
+        self.value += amount
+
+    def render(self) -> List[str]:
+        return [
+            f"# HELP {self.name} {self.help}",
+            f"# TYPE {self.name} counter",
+            f"{self.name} {format_value(self.value)}",
+        ]
+
+
+class Histogram:
+    __slots__ = ("name", "help", "buckets", "counts", "sum", "count")
+
+    def __init__(self, name: str, help: str, buckets: Sequence[float]) -> None:
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum: float = 0.0
+        self.count = 0
+
+    def observe(self, value: Number) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            lines.append(f'{self.name}_bucket{{le="{format_value(float(bound))}"}} {cumulative}')
+        lines.append(f'{self.name}_bucket{{le="+Inf"}} {self.count}')
+        lines.append(f"{self.name}_sum {format_value(self.sum)}")
+        lines.append(f"{self.name}_count {self.count}")
+        return lines
+
+
+class Gauge:
+    """A value computed at scrape time."""
+
+    __slots__ = ("name", "help", "kind", "fn")
+
+    def __init__(self, name: str, help: str, fn: Callable[[], Number], kind: str = "gauge") -> None:
+        self.name = name
+        self.help = help
+        self.kind = kind
+        self.fn = fn
+
+    def render(self) -> List[str]:
+        return [
+            f"# HELP {self.name} {self.help}",
+            f"# TYPE {self.name} {self.kind}",
+            f"{self.name} {format_value(self.fn())}",
+        ]
+
+
+class Distribution:
+    """A histogram rebuilt from current values at scrape time."""
+
+    __slots__ = ("name", "help", "buckets", "fn")
+
+    def __init__(
+        self, name: str, help: str, buckets: Sequence[float], fn: Callable[[], Iterable[Number]]
+    ) -> None:
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self.fn = fn
+
+    def render(self) -> List[str]:
+        histogram = Histogram(self.name, self.help, self.buckets)
+        for value in self.fn():
+            histogram.observe(value)
+        return histogram.render()
+
+
+Metric = Union[Counter, Histogram, Gauge, Distribution]
+
+
+class Registry:
+    def __init__(self) -> None:
+        self.metrics: List[Metric] = []
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help: str) -> Counter:
+        return self.register(Counter(name, help))  # type: ignore[return-value]
+
+    def histogram(self, name: str, help: str, buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, buckets))  # type: ignore[return-value]
+
+    def gauge(self, name: str, help: str, fn: Callable[[], Number], kind: str = "gauge") -> Gauge:
+        return self.register(Gauge(name, help, fn, kind))  # type: ignore[return-value]
+
+    def distribution(
+        self, name: str, help: str, buckets: Sequence[float], fn: Callable[[], Iterable[Number]]
+    ) -> Distribution:
+        return self.register(Distribution(name, help, buckets, fn))  # type: ignore[return-value]
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,208 @@
+"""Terminal rendering for the CLI client.
+
+Messages are formatted into one string and written with a single call,
+from a background task that does the work in a thread, so the WebSocket
+receive loop only queues them and a slow terminal never holds up pings or
+other frames. A message may be queued while its blobs are still being
+fetched; it is drawn, in order, once they arrive. Code blocks longer than
+``collapse_lines`` show their first few lines and a hint; ``expand N``
+renders the whole block on demand, through ``$PAGER`` when it is taller
+than the terminal. Block numbers are handed out on the event loop, the
+only place ``expand`` reads them.
+"""
+from __future__ import annotations
+
+import asyncio
+import inspect
+import os
+import shutil
+import subprocess
+import sys
+from collections import OrderedDict
+from typing import Awaitable, List, Optional, Tuple, Union
+
+DEFAULT_COLLAPSE_LINES = 40
+COLLAPSED_PREVIEW_LINES = 12
+# Collapsed blocks kept around for ``expand``, oldest dropped first.
+MAX_COLLAPSED_BLOCKS = 100
+
+
+# ANSI color codes
+class Colors:
+    RED = '\033[91m'
+    GREEN = '\033[92m'
+    YELLOW = '\033[93m'
+    BLUE = '\033[94m'
+    MAGENTA = '\033[95m'
+    CYAN = '\033[96m'
+    WHITE = '\033[97m'
+    RESET = '\033[0m'
+    BOLD = '\033[1m'
+    DIM = '\033[2m'
+
+
+RULE = f"{Colors.CYAN}{'=' * 60}{Colors.RESET}"
+ADDED = f" {Colors.GREEN}+{Colors.RESET} "
+REMOVED = f" {Colors.RED}-{Colors.RESET} "
+HUNK = f" {Colors.CYAN}@{Colors.RESET} {Colors.DIM}"
+SEPARATOR = f" {Colors.CYAN}|{Colors.RESET} {Colors.DIM}"
+CONTEXT = f" {Colors.DIM}|{Colors.RESET} "
+
+
+def format_code_lines(code: str, limit: Optional[int] = None) -> List[str]:
+    """Numbered, diff-colored lines of ``code``, at most ``limit`` of them."""
+    lines = code.split('\n')
+    if limit is not None:
+        lines = lines[:limit]
+    dim, reset = Colors.DIM, Colors.RESET
+    out = []
+    append = out.append
+    for i, line in enumerate(lines, 1):
+        number = f"  {dim}{i:3d}{reset}"
+        if line.startswith('+') and not line.startswith('+++'):
+            append(f"{number}{ADDED}{line[1:]}")
+        elif line.startswith('-') and not line.startswith('---'):
+            append(f"{number}{REMOVED}{line[1:]}")
+        elif line.startswith('@@'):
+            append(f"{number}{HUNK}{line}{reset}")
+        elif line.lstrip().startswith('---'):
+            # Separator between old and new in diffs
+            append(f"{number}{SEPARATOR}{line}{reset}")
+        else:
+            append(f"{number}{CONTEXT}{line}")
+    return out
+
+
+def format_code_block(filename: str, code: str, limit: Optional[int] = None,
+                      hint: str = "") -> List[str]:
+    out = ["", RULE, f"{Colors.BOLD}{Colors.MAGENTA}📝 {filename}{Colors.RESET}", RULE]
+    out += format_code_lines(code, limit)
+    if hint:
+        out.append(hint)
+    out.append(RULE)
+    return out
+
+
+class Renderer:
+    """Formats and writes Cursor messages off the event loop."""
+
+    def __init__(self, collapse_lines: int = DEFAULT_COLLAPSE_LINES, pager: Optional[str] = None):
+        self.collapse_lines = collapse_lines  # 0 prints every block in full
+        self.pager = pager if pager is not None else os.environ.get("PAGER", "less")
+        self.queue: "asyncio.Queue[Union[dict, Awaitable[dict]]]" = asyncio.Queue()
+        self.task: Optional[asyncio.Task] = None
+        # Held while writing, so a pager and a message never share the screen.
+        self.lock = asyncio.Lock()
+        self.collapsed: "OrderedDict[int, Tuple[str, str]]" = OrderedDict()
+        self.next_block = 1
+
+    def submit(self, message: Union[dict, Awaitable[dict]]):
+        """Queue a message (``text`` and ``metadata``), or an awaitable that
+        yields one, for display; never waits."""
+        if self.task is None:
+            self.task = asyncio.create_task(self.run())
+        self.queue.put_nowait(message)
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            message = await self.queue.get()
+            try:
+                if inspect.isawaitable(message):
+                    message = await message
+                text = message.get("text", "")
+                metadata = message.get("metadata") or {}
+                numbers = self.number_blocks(metadata)
+                async with self.lock:
+                    await loop.run_in_executor(None, self.show, text, metadata, numbers)
+            except Exception as e:
+                print(f"❌ Error rendering message: {e}")
+            finally:
+                self.queue.task_done()
+
+    async def flush(self):
+        """Wait until everything submitted so far is on the terminal."""
+        if self.task is not None:
+            await self.queue.join()
+
+    async def close(self):
+        if self.task is None:
+            return
+        await self.flush()
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+        self.task = None
+
+    def show(self, text: str, metadata: dict, numbers: List[Optional[int]]):
+        self.write(self.format_message(text, metadata, numbers))
+
+    def number_blocks(self, metadata: dict) -> List[Optional[int]]:
+        """The ``expand`` number of each code block, None for those shown in full."""
+        numbers: List[Optional[int]] = []
+        for block in metadata.get("code_blocks") or []:
+            code = block.get("code", "")
+            if self.collapse_lines and code.count('\n') + 1 > self.collapse_lines:
+                numbers.append(self.remember(block.get("filename", "untitled"), code))
+            else:
+                numbers.append(None)
+        return numbers
+
+    def format_message(self, text: str, metadata: dict, numbers: List[Optional[int]]) -> str:
+        out = ["", f"🤖 Cursor: {text}"]
+        code_blocks = metadata.get("code_blocks") or []
+        if code_blocks:
+            out += ["", f"{Colors.YELLOW}📄 Code Changes ({len(code_blocks)} file(s)):{Colors.RESET}"]
+        for block, number in zip(code_blocks, numbers):
+            filename = block.get("filename", "untitled")
+            code = block.get("code", "")
+            if number is not None:
+                total = code.count('\n') + 1
+                hint = (f"  {Colors.DIM}… {total - COLLAPSED_PREVIEW_LINES} more line(s); "
+                        f"type 'expand {number}' to view all {total}{Colors.RESET}")
+                out += format_code_block(filename, code, COLLAPSED_PREVIEW_LINES, hint)
+            else:
+                out += format_code_block(filename, code)
+        out.append("")
+        return "\n".join(out)
+
+    def remember(self, filename: str, code: str) -> int:
+        number = self.next_block
+        self.next_block += 1
+        self.collapsed[number] = (filename, code)
+        while len(self.collapsed) > MAX_COLLAPSED_BLOCKS:
+            self.collapsed.popitem(last=False)
+        return number
+
+    async def expand(self, number: int) -> bool:
+        """Show collapsed block ``number`` in full; False if there is no such block."""
+        # Messages still queued may hold the block
+        await self.flush()
+        block = self.collapsed.get(number)
+        if block is None:
+            return False
+        loop = asyncio.get_running_loop()
+        async with self.lock:
+            await loop.run_in_executor(None, self.page, *block)
+        return True
+
+    def page(self, filename: str, code: str):
+        """Write a whole block, through the pager if it won't fit on screen."""
+        output = "\n".join(format_code_block(filename, code)) + "\n"
+        height = shutil.get_terminal_size().lines
+        if not (self.pager and sys.stdout.isatty() and output.count('\n') >= height):
+            self.write(output)
+            return
+        env = dict(os.environ)
+        env.setdefault("LESS", "-R")  # pass the colors through
+        try:
+            subprocess.run(self.pager, shell=True, input=output.encode("utf-8"), env=env)
+        except OSError:
+            self.write(output)
+
+    @staticmethod
+    def write(output: str):
+        sys.stdout.write(output)
+        sys.stdout.flush()
@@ -0,0 +1,128 @@
+"""Full-text search over a session's history.
+
+``SearchIndex`` is an inverted index from lower-cased word tokens to the
+history seqs that contain them, with term counts for BM25 ranking. Prompts
+index their text; responses index their text and code block filenames (blob
+placeholders are skipped). Entries are added as history is appended, and
+trimmed entries are dropped lazily: postings for seqs before the oldest live
+one are skipped by queries and purged once they make up half the index.
+"""
+from __future__ import annotations
+
+import heapq
+import math
+import re
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Tuple
+
+from blobs import BLOB_PLACEHOLDER_RE
+
+TOKEN_RE = re.compile(r"\w+")
+# Longer tokens (hashes, base64, minified code) are not worth indexing.
+MAX_TOKEN_CHARS = 64
+BM25_K1 = 1.2
+BM25_B = 0.75
+SNIPPET_CHARS = 160
+
+
+def tokenize(text: str) -> List[str]:
+    return [token for token in TOKEN_RE.findall(text.lower()) if len(token) <= MAX_TOKEN_CHARS]
+
+
+def document_text(text: Any, metadata: Any = None) -> str:
+    """The searchable text of a prompt or response."""
+    parts = [BLOB_PLACEHOLDER_RE.sub("", text) if isinstance(text, str) else ""]
+    blocks = metadata.get("code_blocks") if isinstance(metadata, dict) else None
+    if isinstance(blocks, list):
+        for block in blocks:
+            if isinstance(block, dict) and isinstance(block.get("filename"), str):
+                parts.append(block["filename"])
+    return "\n".join(parts)
+
+
+def snippet(text: str, terms: Iterable[str], width: int = SNIPPET_CHARS) -> str:
+    """About ``width`` characters of ``text`` around the first query term."""
+    text = BLOB_PLACEHOLDER_RE.sub("", text)
+    lowered = text.lower()
+    hits = [index for index in (lowered.find(term) for term in terms) if index >= 0]
+    start = max(min(hits) - width // 4, 0) if hits else 0
+    end = min(start + width, len(text))
+    start = max(end - width, 0)
+    excerpt = " ".join(text[start:end].split())
+    return ("…" if start > 0 else "") + excerpt + ("…" if end < len(text) else "")
+
+
+class SearchIndex:
+    def __init__(self) -> None:
+        # term -> {seq: occurrences}
+        self.postings: Dict[str, Dict[int, int]] = {}
+        # seq -> document length in tokens, in seq order
+        self.lengths: Dict[int, int] = {}
+        self.total_length = 0
+        self.stale = 0
+
+    def __len__(self) -> int:
+        return len(self.lengths)
+
+    def add(self, seq: int, text: str) -> None:
+        counts = Counter(tokenize(text))
+        length = sum(counts.values())
+        self.lengths[seq] = length
+        self.total_length += length
+        for term, count in counts.items():
+            postings = self.postings.get(term)
+            if postings is None:
+                postings = self.postings[term] = {}
+            postings[seq] = count
+
+    def discard_before(self, seq: int) -> None:
+        """Forget every document older than ``seq``."""
+        dropped = []
+        for old in self.lengths:
+            if old >= seq:
+                break
+            dropped.append(old)
+        for old in dropped:
+            self.total_length -= self.lengths.pop(old)
+        self.stale += len(dropped)
+        if self.stale > len(self.lengths):
+            self._purge()
+
+    def _purge(self) -> None:
+        lengths = self.lengths
+        for term in list(self.postings):
+            live = {seq: count for seq, count in self.postings[term].items() if seq in lengths}
+            if live:
+                self.postings[term] = live
+            else:
+                del self.postings[term]
+        self.stale = 0
+
+    def search(
+        self, query: str, limit: int, offset: int = 0
+    ) -> Tuple[int, List[Tuple[int, float]]]:
+        """Rank documents for ``query`` with BM25.
+
+        Returns the number of matching documents and the requested page of
+        ``(seq, score)``, best first; ties go to the newer entry.
+        """
+        terms = set(tokenize(query))
+        documents = len(self.lengths)
+        if not terms or not documents:
+            return 0, []
+        average = self.total_length / documents or 1.0
+        scores: Dict[int, float] = {}
+        for term in terms:
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            live = [(seq, count) for seq, count in postings.items() if seq in self.lengths]
+            if not live:
+                continue
+            idf = math.log(1 + (documents - len(live) + 0.5) / (len(live) + 0.5))
+            for seq, count in live:
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self.lengths[seq] / average)
+                scores[seq] = scores.get(seq, 0.0) + idf * count * (BM25_K1 + 1) / (count + norm)
+        ranked = heapq.nlargest(offset + limit, scores.items(), key=lambda item: (item[1], item[0]))
+        return len(scores), ranked[offset:]
+
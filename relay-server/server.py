@@ -2,15 +2,37 @@
 from __future__ import annotations
 
 import asyncio
+import bisect
 import contextlib
+import hmac
 import json
+import math
+import os
+import sys
+import tempfile
 import time
 import uuid
+from array import array
+from collections import OrderedDict, deque
+from itertools import chain
 from dataclasses import dataclass, field
-from typing import Any, Dict, List, Literal, Optional, Set, Union
+from typing import (
+    Any,
+    AsyncIterator,
+    Deque,
+    Dict,
+    Iterator,
+    List,
+    Literal,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+)
 
 from fastapi import (
     FastAPI,
+    Header,
     HTTPException,
     Query,
     Request,
@@ -20,11 +42,72 @@ from fastapi import (
 )
 from fastapi.exceptions import RequestValidationError
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-from pydantic import BaseModel, Field, FieldValidationInfo, field_validator
+from starlette.requests import HTTPConnection
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+from pydantic import BaseModel, Field, FieldValidationInfo, ValidationError, field_validator
+
+from blobs import BLOB_MIN_BYTES as DEFAULT_BLOB_MIN_BYTES
+from blobs import BlobStore, blob_refs, dedupe_code_blocks, inline_code_blocks
+from bus import Event, EventBus, UnixSocketBus
+from limits import RateLimiter
+from search import SearchIndex, document_text, snippet, tokenize
+from snapshot import (
+    SnapshotReader,
+    claim_snapshot,
+    encode_session,
+    release_snapshot,
+    write_snapshot,
+)
+from spill import (
+    PartFile,
+    SpillStore,
+    UploadOffsetMismatch,
+    UploadTooLarge,
+    body_ref,
+)
+from metrics import (
+    BYTE_BUCKETS,
+    LONG_POLL_BUCKETS,
+    ROUND_TRIP_BUCKETS,
+    SIZE_BUCKETS,
+    Registry,
+)
+from storage import SessionStore, SQLiteStore, StoredRow
+import wire
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional speedup
+    orjson = None
+
+
+PROCESS_STARTED = time.perf_counter()
 
 
-app = FastAPI(title="Relay Server", version="0.1.0")
+@contextlib.asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+    restoring = claim_snapshot(SNAPSHOT_PATH) if SNAPSHOT_PATH else None
+    if restoring:
+        session_manager.open_snapshot(restoring)
+    await session_manager.store.start()
+    await event_bus.start(apply_event)
+    gc_task = asyncio.create_task(session_gc_loop())
+    lifecycle_stats["startup_seconds"] = round(time.perf_counter() - PROCESS_STARTED, 4)
+    print(f"🚀 Relay ready in {lifecycle_stats['startup_seconds'] * 1000:.0f} ms")
+    try:
+        yield
+    finally:
+        await drain()
+        gc_task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await gc_task
+        await event_bus.close()
+        if SNAPSHOT_PATH:
+            await session_manager.save_snapshot(SNAPSHOT_PATH)
+        await session_manager.store.close()
+
+
+app = FastAPI(title="Relay Server", version="0.1.0", lifespan=lifespan)
 
 # Enable CORS for all origins (including vscode-file://)
 app.add_middleware(
@@ -39,20 +122,187 @@ MAX_MESSAGE_BYTES = 128 * 1024
 DEFAULT_PROMPT_TIMEOUT = 30
 MAX_PROMPT_TIMEOUT = 300
 PING_INTERVAL_SECONDS = 30
+# Idle time before an event stream gets a keep-alive comment; proxies tend to
+# close quiet HTTP responses sooner than quiet WebSockets.
+EVENT_STREAM_HEARTBEAT_SECONDS = float(os.environ.get("RELAY_SSE_HEARTBEAT_SECONDS", "15"))
+EVENT_STREAM_RETRY_MS = 2000
 MAX_HISTORY_LIMIT = 1000
+MAX_BATCH_ITEMS = 500
+MAX_LEASE_SECONDS = 3600
+DEFAULT_SEARCH_LIMIT = 20
+MAX_SEARCH_QUERY_CHARS = 256
 DEFAULT_HISTORY_LIMIT = 100
+# Streamed responses are coalesced before fan-out: buffered deltas are flushed
+# once they reach STREAM_FLUSH_BYTES or have waited STREAM_FLUSH_INTERVAL_MS.
+STREAM_FLUSH_INTERVAL_MS = 50
+STREAM_FLUSH_BYTES = 4 * 1024
+# Session garbage collection. Sessions with no subscribers are evicted after
+# SESSION_IDLE_TTL_SECONDS of inactivity, or least-recently-used first while the
+# relay holds more than SESSION_MEMORY_BUDGET_BYTES of messages. History beyond
+# SESSION_HISTORY_CAP entries is trimmed oldest-first.
+SESSION_IDLE_TTL_SECONDS = int(os.environ.get("RELAY_SESSION_IDLE_TTL_SECONDS", 24 * 60 * 60))
+SESSION_MEMORY_BUDGET_BYTES = int(
+    os.environ.get("RELAY_SESSION_MEMORY_BUDGET_BYTES", 256 * 1024 * 1024)
+)
+SESSION_HISTORY_CAP = int(os.environ.get("RELAY_SESSION_HISTORY_CAP", 10_000))
+SESSION_GC_INTERVAL_SECONDS = 60
+RECENT_EVICTIONS_LIMIT = 20
+# client_msg_ids of answered prompts trimmed from a session's history that are
+# still remembered, so a late retry of one is not stored again as new.
+TRIMMED_PROMPT_IDS_LIMIT = 1000
+# Set RELAY_SQLITE_PATH to persist history in SQLite; sessions are then
+# reloaded lazily on first access after a restart or eviction.
+SQLITE_PATH = os.environ.get("RELAY_SQLITE_PATH")
+# "local" keeps all state in this process. "unix:<path>" shares state between
+# relay processes on this machine (uvicorn --workers N) through a broker on a
+# Unix socket; see bus.py.
+EVENT_BUS_URL = os.environ.get("RELAY_EVENT_BUS", "local")
+# Code blocks at least this large are stored once per session and referenced
+# by digest; see blobs.py. 0 stores every code block as a blob.
+BLOB_MIN_BYTES = int(os.environ.get("RELAY_BLOB_MIN_BYTES", str(DEFAULT_BLOB_MIN_BYTES)))
+# Binary subprotocol frames (see wire.py) at least this large are zlib-compressed.
+WS_COMPRESS_MIN_BYTES = int(
+    os.environ.get("RELAY_WS_COMPRESS_MIN_BYTES", str(wire.WIRE_COMPRESS_MIN_BYTES))
+)
+# Responses larger than MAX_MESSAGE_BYTES are streamed to files under
+# RELAY_SPILL_DIR (see spill.py), up to RELAY_MAX_UPLOAD_BYTES each; the stored
+# message keeps the first RELAY_PREVIEW_BYTES as its text. Uploads left
+# unfinished for UPLOAD_TTL_SECONDS are deleted.
+SPILL_DIR = os.environ.get("RELAY_SPILL_DIR") or os.path.join(tempfile.gettempdir(), "relay-spill")
+MAX_UPLOAD_BYTES = int(os.environ.get("RELAY_MAX_UPLOAD_BYTES", 64 * 1024 * 1024))
+PREVIEW_BYTES = min(int(os.environ.get("RELAY_PREVIEW_BYTES", 8 * 1024)), MAX_MESSAGE_BYTES)
+UPLOAD_TTL_SECONDS = 60 * 60
+# Rough fixed cost of a stored message (record, history columns, dict slots);
+# see benchmarks/bench_memory.py.
+MESSAGE_OVERHEAD_BYTES = 256
+# Each subscriber gets a bounded outbound queue drained by its own writer task.
+# When a slow consumer fills it, the overflow policy decides what happens:
+# "coalesce" merges queued stream deltas and otherwise drops the oldest one,
+# "drop_oldest" only drops, and "disconnect" closes the slow consumer. Only
+# stream and partial frames are ever dropped; a subscriber that would lose a
+# prompt or message (anything with a seq) is closed instead, and resumes from
+# its last seq when it reconnects.
+SUBSCRIBER_QUEUE_SIZE = int(os.environ.get("RELAY_SUBSCRIBER_QUEUE_SIZE", 256))
+SUBSCRIBER_OVERFLOW_POLICY = os.environ.get("RELAY_SUBSCRIBER_OVERFLOW_POLICY", "coalesce")
+OVERFLOW_POLICIES = ("coalesce", "drop_oldest", "disconnect")
+# Close code sent to consumers disconnected for falling behind ("try again later").
+SLOW_CONSUMER_CLOSE_CODE = 1013
+# A WebSocket that reconnects with ?last_seq=N is sent the history entries it
+# missed, up to this many; beyond that it is told to resync via /messages.
+# Capped at half the subscriber queue so a replay never overflows it.
+REPLAY_LIMIT = min(
+    int(os.environ.get("RELAY_REPLAY_LIMIT", 128)), max(SUBSCRIBER_QUEUE_SIZE // 2, 1)
+)
+# Admission control; see limits.py. Prompts and responses are charged one
+# token each (batches one per item) against the global, session and client
+# buckets. Rates are per second, 0 disables a scope; bursts default to twice
+# the rate.
+RATE_LIMIT_GLOBAL = float(os.environ.get("RELAY_RATE_LIMIT_GLOBAL", 0))
+RATE_LIMIT_GLOBAL_BURST = float(os.environ.get("RELAY_RATE_LIMIT_GLOBAL_BURST", 0))
+RATE_LIMIT_SESSION = float(os.environ.get("RELAY_RATE_LIMIT_SESSION", 0))
+RATE_LIMIT_SESSION_BURST = float(os.environ.get("RELAY_RATE_LIMIT_SESSION_BURST", 0))
+RATE_LIMIT_CLIENT = float(os.environ.get("RELAY_RATE_LIMIT_CLIENT", 0))
+RATE_LIMIT_CLIENT_BURST = float(os.environ.get("RELAY_RATE_LIMIT_CLIENT_BURST", 0))
+# Concurrent waiting /prompts long-polls, and WebSocket plus event stream
+# subscribers, allowed per session.
+MAX_POLLERS_PER_SESSION = int(os.environ.get("RELAY_MAX_POLLERS_PER_SESSION", 32))
+MAX_SUBSCRIBERS_PER_SESSION = int(os.environ.get("RELAY_MAX_SUBSCRIBERS_PER_SESSION", 256))
+# Sessions one multiplexed /ws connection may subscribe to.
+MAX_MULTIPLEXED_SESSIONS = int(os.environ.get("RELAY_MAX_MULTIPLEXED_SESSIONS", 256))
+# Close code for WebSockets refused by admission control.
+ADMISSION_CLOSE_CODE = 1013
+# Restarts. With RELAY_SNAPSHOT_PATH set, every session is written there at
+# shutdown and restored from it, lazily, after the restart (see snapshot.py).
+# A drain (POST /admin/drain, enabled by RELAY_ADMIN_TOKEN, and shutdown)
+# refuses new subscribers and long-polls, gives queued frames and open
+# response streams up to RELAY_DRAIN_TIMEOUT_SECONDS to go out, then closes
+# subscribers with DRAIN_CLOSE_CODE ("service restart") so they reconnect.
+SNAPSHOT_PATH = os.environ.get("RELAY_SNAPSHOT_PATH")
+ADMIN_TOKEN = os.environ.get("RELAY_ADMIN_TOKEN")
+DRAIN_TIMEOUT_SECONDS = float(os.environ.get("RELAY_DRAIN_TIMEOUT_SECONDS", 10))
+DRAIN_POLL_SECONDS = 0.05
+DRAIN_RETRY_AFTER_SECONDS = 1
+DRAIN_CLOSE_CODE = 1012
 
 
 def current_timestamp_ms() -> int:
     return int(time.time() * 1000)
 
 
+def dumps_bytes(value: Any) -> bytes:
+    """Encode ``value`` as compact UTF-8 JSON, using orjson when installed."""
+    if orjson is not None:
+        try:
+            return orjson.dumps(value)
+        except (TypeError, orjson.JSONEncodeError):
+            pass
+    return json.dumps(value, separators=(",", ":"), ensure_ascii=False, default=str).encode(
+        "utf-8"
+    )
+
+
+def dumps_compact(value: Any) -> bytes:
+    """Like ``dumps_bytes`` but for encodings kept for the life of a message.
+
+    orjson returns bytes that keep its over-allocated output buffer (up to
+    twice the payload), so long-lived encodings are copied to their exact size.
+    """
+    encoded = dumps_bytes(value)
+    if orjson is not None:
+        encoded = bytes(memoryview(encoded))
+    return encoded
+
+
+def loads(data: Union[str, bytes]) -> Any:
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def json_bytes_response(body: bytes, etag: Optional[str] = None) -> Response:
+    headers = {"ETag": etag} if etag is not None else None
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """``If-None-Match`` comparison (weak, as RFC 9110 prescribes for it)."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+
+
+def exceeds_bytes(value: str, limit: int) -> bool:
+    """Whether ``value`` is over ``limit`` bytes of UTF-8.
+
+    A character encodes to 1-4 bytes, so only strings between ``limit / 4``
+    and ``limit`` characters long need encoding to tell.
+    """
+    length = len(value)
+    if length > limit:
+        return True
+    if length * 4 <= limit:
+        return False
+    return len(value.encode("utf-8")) > limit
+
+
 def ensure_message_size(value: str, field_name: str) -> None:
-    if len(value.encode("utf-8")) > MAX_MESSAGE_BYTES:
+    if exceeds_bytes(value, MAX_MESSAGE_BYTES):
         raise_http_error(
             status.HTTP_400_BAD_REQUEST,
             "Message exceeds size limit",
-            f"{field_name} exceeds {MAX_MESSAGE_BYTES} bytes",
+            f"{field_name} exceeds {MAX_MESSAGE_BYTES} bytes; send larger bodies to /uploads",
         )
 
 
@@ -73,6 +323,50 @@ def raise_http_error(code: int, message: str, details: Optional[str] = None) ->
     raise HTTPException(status_code=code, detail={"error": message, "details": details})
 
 
+def client_address(connection: HTTPConnection) -> Optional[str]:
+    return connection.client.host if connection.client else None
+
+
+def admit(session_id: str, client: Optional[str], cost: int = 1) -> None:
+    """Charge a write to the rate limiter; raise 429 if it is refused."""
+    refused = rate_limiter.check(session_id, client, cost)
+    if refused is None:
+        return
+    scope, retry_after = refused
+    ADMISSION_REJECTED[scope].inc()
+    raise HTTPException(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        detail={
+            "error": "Rate limit exceeded",
+            "details": f"{scope} limit exceeded, retry in {retry_after:.1f}s",
+        },
+        headers={"Retry-After": str(math.ceil(retry_after))},
+    )
+
+
+def ensure_capacity(scope: str, in_use: int, limit: int, session_id: str) -> None:
+    """Raise 429 when a session already has ``limit`` concurrent ``scope``."""
+    if in_use < limit:
+        return
+    ADMISSION_REJECTED[scope].inc()
+    raise_http_error(
+        status.HTTP_429_TOO_MANY_REQUESTS,
+        "Too many connections",
+        f"session {session_id} already has {in_use} {scope}",
+    )
+
+
+def ensure_accepting() -> None:
+    """Raise 503 for new subscribers and long-polls while draining."""
+    if not lifecycle_stats["draining"]:
+        return
+    raise HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail={"error": "Relay is restarting", "details": "draining; reconnect shortly"},
+        headers={"Retry-After": str(DRAIN_RETRY_AFTER_SECONDS)},
+    )
+
+
 class PromptPayload(BaseModel):
     session_id: str = Field(..., description="Session identifier")
     prompt: str = Field(..., description="Prompt text")
@@ -126,6 +420,88 @@ class ResponsePayload(BaseModel):
         return value
 
 
+class PromptBatchItem(BaseModel):
+    prompt: str = Field(..., description="Prompt text")
+    client_msg_id: Optional[str] = Field(None, description="Client message identifier")
+    metadata: Optional[Dict[str, Any]] = Field(default=None)
+
+    @field_validator("prompt")
+    @classmethod
+    def validate_prompt(cls, value: str) -> str:
+        if not value or not value.strip():
+            raise ValueError("prompt cannot be empty")
+        return value
+
+    @field_validator("client_msg_id")
+    @classmethod
+    def validate_client_msg_id(cls, value: Optional[str]) -> Optional[str]:
+        if value is None:
+            return value
+        if not value.strip():
+            raise ValueError("client_msg_id cannot be empty")
+        return value.strip()
+
+
+class PromptBatchPayload(BaseModel):
+    session_id: str = Field(..., description="Session identifier")
+    prompts: List[PromptBatchItem] = Field(..., min_length=1, max_length=MAX_BATCH_ITEMS)
+
+    @field_validator("session_id")
+    @classmethod
+    def validate_session_id(cls, value: str) -> str:
+        if not value or not value.strip():
+            raise ValueError("session_id cannot be empty")
+        return value.strip()
+
+
+class ResponseBatchItem(BaseModel):
+    client_msg_id: str = Field(..., description="Client message identifier")
+    assistant_msg_id: Optional[str] = Field(None, description="Assistant message identifier")
+    text: str = Field(..., description="Assistant response text")
+    metadata: Optional[Dict[str, Any]] = Field(default=None)
+    ts: Optional[int] = Field(default=None, ge=0)
+
+    @field_validator("client_msg_id")
+    @classmethod
+    def validate_client_msg_id(cls, value: str) -> str:
+        if not value or not value.strip():
+            raise ValueError("client_msg_id cannot be empty")
+        return value.strip()
+
+    @field_validator("text")
+    @classmethod
+    def validate_text(cls, value: str) -> str:
+        if not value:
+            raise ValueError("text cannot be empty")
+        return value
+
+
+class ResponseBatchPayload(BaseModel):
+    session_id: str = Field(..., description="Session identifier")
+    responses: List[ResponseBatchItem] = Field(..., min_length=1, max_length=MAX_BATCH_ITEMS)
+
+    @field_validator("session_id")
+    @classmethod
+    def validate_session_id(cls, value: str) -> str:
+        if not value or not value.strip():
+            raise ValueError("session_id cannot be empty")
+        return value.strip()
+
+
+class UploadCompletePayload(BaseModel):
+    client_msg_id: str = Field(..., description="Client message identifier")
+    assistant_msg_id: Optional[str] = Field(None, description="Assistant message identifier")
+    metadata: Optional[Dict[str, Any]] = Field(default=None)
+    ts: Optional[int] = Field(default=None, ge=0)
+
+    @field_validator("client_msg_id")
+    @classmethod
+    def validate_client_msg_id(cls, value: str) -> str:
+        if not value or not value.strip():
+            raise ValueError("client_msg_id cannot be empty")
+        return value.strip()
+
+
 class PromptMessage(BaseModel):
     session_id: str
     client_msg_id: str
@@ -140,303 +516,2441 @@ class AssistantMessage(BaseModel):
     client_msg_id: str
     text: str
     metadata: Optional[Dict[str, Any]] = None
+    # Set when ``text`` is only a preview; see spill.py.
+    body: Optional[Dict[str, Any]] = None
     ts: int
 
 
-@dataclass
-class HistoryEntry:
-    type: Literal["prompt", "assistant"]
-    data: Union[PromptMessage, AssistantMessage]
+class PromptRecord:
+    """A stored prompt: the fields the relay indexes on plus its encoded JSON.
 
+    The message body lives only in the cached encoding, which every delivery
+    path splices directly; ``to_model`` materialises a ``PromptMessage`` when
+    one is actually needed.
+    """
 
-@dataclass
-class SessionState:
-    session_id: str
-    prompts: Dict[str, PromptMessage] = field(default_factory=dict)
-    responses_by_client: Dict[str, AssistantMessage] = field(default_factory=dict)
-    responses_by_assistant: Dict[str, AssistantMessage] = field(default_factory=dict)
-    subscribers: Set[WebSocket] = field(default_factory=set)
-    history: List[HistoryEntry] = field(default_factory=list)
-    lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+    __slots__ = ("client_msg_id", "ts", "encoded", "seq")
+    kind = "prompt"
+    blobs: Tuple[str, ...] = ()
+    spilled: Optional[str] = None
 
-    def __post_init__(self) -> None:
-        self.condition = asyncio.Condition(self.lock)
+    def __init__(self, client_msg_id: str, ts: int, encoded: bytes) -> None:
+        self.client_msg_id = client_msg_id
+        self.ts = ts
+        self.encoded = encoded
+        # Assigned by SessionHistory.append.
+        self.seq = 0
 
+    @classmethod
+    def create(
+        cls,
+        session_id: str,
+        client_msg_id: str,
+        prompt: str,
+        metadata: Optional[Dict[str, Any]],
+        ts: int,
+    ) -> "PromptRecord":
+        encoded = dumps_compact(
+            {
+                "session_id": session_id,
+                "client_msg_id": client_msg_id,
+                "prompt": prompt,
+                "metadata": metadata,
+                "ts": ts,
+            }
+        )
+        return cls(client_msg_id, ts, encoded)
 
-sessions: Dict[str, SessionState] = {}
-sessions_lock = asyncio.Lock()
+    def to_model(self) -> PromptMessage:
+        return PromptMessage(**loads(self.encoded))
 
 
-async def get_session(session_id: str, create: bool = False) -> SessionState:
-    session = sessions.get(session_id)
-    if session:
-        return session
-    if not create:
-        raise_http_error(status.HTTP_404_NOT_FOUND, "Session not found", session_id)
-    async with sessions_lock:
-        session = sessions.get(session_id)
-        if session:
-            return session
-        session = SessionState(session_id=session_id)
-        sessions[session_id] = session
-        return session
+class AssistantRecord:
+    """A stored assistant message; see ``PromptRecord``.
 
+    Large code blocks are kept in reference form (see ``blobs.py``); ``blobs``
+    lists the digests the encoding refers to. Responses too large to store
+    inline keep a preview as ``text`` and refer to the full body on disk by
+    ``spilled`` (see ``spill.py``).
+    """
 
-def pending_prompts_locked(session: SessionState) -> List[PromptMessage]:
-    return [
-        prompt
-        for prompt in session.prompts.values()
-        if prompt.client_msg_id not in session.responses_by_client
-    ]
+    __slots__ = (
+        "client_msg_id",
+        "assistant_msg_id",
+        "ts",
+        "encoded",
+        "blobs",
+        "spilled",
+        "seq",
+    )
+    kind = "assistant"
 
+    def __init__(self, client_msg_id: str, assistant_msg_id: str, ts: int, encoded: bytes) -> None:
+        self.client_msg_id = client_msg_id
+        self.assistant_msg_id = assistant_msg_id
+        self.ts = ts
+        self.encoded = encoded
+        self.blobs = blob_refs(encoded)
+        self.spilled = body_ref(encoded)
+        self.seq = 0
 
-async def broadcast_response(session: SessionState, message: AssistantMessage) -> None:
-    # Copy subscribers while the lock is held to avoid race conditions.
-    async with session.lock:
-        subscribers = list(session.subscribers)
-    message_payload = {"type": "message", "data": message.dict()}
-    stale: List[WebSocket] = []
-    for ws in subscribers:
-        try:
-            await ws.send_json(message_payload)
-        except RuntimeError:
-            stale.append(ws)
-        except WebSocketDisconnect:
-            stale.append(ws)
-    if stale:
-        async with session.lock:
-            for ws in stale:
-                session.subscribers.discard(ws)
+    @classmethod
+    def create(
+        cls,
+        session_id: str,
+        client_msg_id: str,
+        assistant_msg_id: str,
+        text: str,
+        metadata: Optional[Dict[str, Any]],
+        ts: int,
+        body: Optional[Dict[str, Any]] = None,
+    ) -> "AssistantRecord":
+        message = {
+            "session_id": session_id,
+            "assistant_msg_id": assistant_msg_id,
+            "client_msg_id": client_msg_id,
+            "text": text,
+            "metadata": metadata,
+            "ts": ts,
+        }
+        if body is not None:
+            message["body"] = {"digest": body["digest"], "size": body["size"]}
+        encoded = dumps_compact(message)
+        return cls(client_msg_id, assistant_msg_id, ts, encoded)
 
+    def to_model(self) -> AssistantMessage:
+        return AssistantMessage(**loads(self.encoded))
 
-@app.exception_handler(HTTPException)
-async def custom_http_exception_handler(
-    request: Request, exc: HTTPException
-) -> JSONResponse:
-    detail = exc.detail
-    if isinstance(detail, dict):
-        error = detail.get("error") or "Error"
-        details = detail.get("details")
-    else:
-        error = detail or "Error"
-        details = None
-    return JSONResponse(status_code=exc.status_code, content={"error": error, "details": details})
 
+StoredRecord = Union[PromptRecord, AssistantRecord]
 
-@app.exception_handler(RequestValidationError)
-async def validation_exception_handler(
-    request: Request, exc: RequestValidationError
-) -> JSONResponse:
-    return JSONResponse(
-        status_code=status.HTTP_400_BAD_REQUEST,
-        content={"error": "Invalid request body", "details": exc.errors()},
-    )
 
-@app.get("/")
-async def root() -> Dict[str, Any]:
-    return {"message": "Hello, World!"}
+class SessionHistory:
+    """Append-only session history indexed by sequence number and timestamp.
 
-@app.post("/prompt")
-async def create_prompt(payload: PromptPayload) -> Dict[str, Any]:
-    session_id = payload.session_id
-    ensure_message_size(payload.prompt, "prompt")
-    client_msg_id = normalize_optional_id(payload.client_msg_id, "client_msg_id") or str(
-        uuid.uuid4()
-    )
-    session = await get_session(session_id, create=True)
-    async with session.lock:
-        if client_msg_id in session.prompts:
-            return {"stored": True, "client_msg_id": client_msg_id}
-        ts = current_timestamp_ms()
-        prompt_message = PromptMessage(
-            session_id=session_id,
-            client_msg_id=client_msg_id,
-            prompt=payload.prompt,
-            metadata=payload.metadata,
-            ts=ts,
-        )
-        session.prompts[client_msg_id] = prompt_message
-        session.history.append(HistoryEntry(type="prompt", data=prompt_message))
-        
-        # Send to all WebSocket subscribers immediately
-        subscribers = list(session.subscribers)
-        session.condition.notify_all()
-    
-    # Send prompt to WebSocket connections outside the lock
-    prompt_payload = {
-        "type": "prompt",
-        "session_id": session_id,
-        "client_msg_id": client_msg_id,
-        "prompt": payload.prompt,
-        "metadata": payload.metadata,
-        "ts": ts
-    }
-    stale: List[WebSocket] = []
-    for ws in subscribers:
-        try:
-            await ws.send_json(prompt_payload)
-            print(f"📤 Sent prompt to WebSocket subscriber: {client_msg_id}")
-        except (RuntimeError, WebSocketDisconnect):
-            stale.append(ws)
-    
-    if stale:
-        async with session.lock:
-            for ws in stale:
-                session.subscribers.discard(ws)
-    
-    return {"stored": True, "client_msg_id": client_msg_id}
+    Every record gets a monotonic per-session ``seq``. Seqs and timestamps are
+    kept in parallel ``array`` columns: lookups by seq bisect ``seqs``; lookups
+    by timestamp bisect the running maximum of ``ts``, which stays sorted even
+    when agents supply their own, out-of-order ``ts``. Everything before that
+    point is at or before the timestamp; once a record has arrived out of
+    order, the records after it are filtered on their own ``ts`` as well.
+    """
 
+    def __init__(self) -> None:
+        self.records: List[StoredRecord] = []
+        self.seqs = array("q")
+        self.max_ts = array("q")
+        # False once a record arrived with a ts older than an earlier one's,
+        # after which ``max_ts`` alone no longer answers "ts > since".
+        self.ts_ordered = True
+        self.next_seq = 1
+        # Timestamp of the first record this history held. With ``last_seq``
+        # it identifies a version of the history, even across relay restarts
+        # that start the seqs over (see ``etag``).
+        self.epoch = 0
 
-@app.get("/prompts/{session_id}")
-async def fetch_prompts(
-    session_id: str,
-    timeout: int = Query(DEFAULT_PROMPT_TIMEOUT, ge=0, le=MAX_PROMPT_TIMEOUT),
-    wait: bool = Query(True),
-) -> List[Dict[str, Any]]:
-    session = sessions.get(session_id)
-    if not session:
-        raise_http_error(status.HTTP_404_NOT_FOUND, "Session not found", session_id)
-    loop = asyncio.get_running_loop()
-    async with session.condition:
-        pending = pending_prompts_locked(session)
-        if pending or not wait or timeout == 0:
-            return [prompt.dict() for prompt in sorted(pending, key=lambda p: p.ts)]
-        deadline = loop.time() + timeout
-        while True:
-            remaining = deadline - loop.time()
-            if remaining <= 0:
-                return []
-            try:
-                await asyncio.wait_for(session.condition.wait(), timeout=remaining)
-            except asyncio.TimeoutError:
-                return []
-            pending = pending_prompts_locked(session)
-            if pending:
-                return [prompt.dict() for prompt in sorted(pending, key=lambda p: p.ts)]
+    def __len__(self) -> int:
+        return len(self.records)
 
+    @property
+    def last_seq(self) -> int:
+        return self.next_seq - 1
 
-@app.post("/response")
-async def create_response(payload: ResponsePayload) -> Dict[str, Any]:
-    print(f"\n{'='*60}")
-    print(f"📨 RECEIVED MESSAGE")
-    print(f"{'='*60}")
-    print(f"Session ID: {payload.session_id}")
-    print(f"Client Msg ID: {payload.client_msg_id}")
-    print(f"Text: {payload.text[:200]}{'...' if len(payload.text) > 200 else ''}")
-    if payload.metadata:
-        print(f"Metadata: {payload.metadata}")
-    print(f"{'='*60}\n")
-    
-    ensure_message_size(payload.text, "text")
-    assistant_msg_id = normalize_optional_id(
-        payload.assistant_msg_id, "assistant_msg_id"
-    ) or str(uuid.uuid4())
-    
-    # Auto-create session if it doesn't exist (for standalone messages)
-    session = await get_session(payload.session_id, create=True)
-    
-    async with session.lock:
-        prompt = session.prompts.get(payload.client_msg_id)
-        # Allow messages without prompts (for monitoring/connection messages)
-        if not prompt:
-            print(f"⚠️  No matching prompt found for client_msg_id: {payload.client_msg_id}")
-            print(f"   Creating standalone message entry...")
-            # Store it anyway as a standalone response
-            pass
-        if assistant_msg_id in session.responses_by_assistant:
-            return {"ok": True, "assistant_msg_id": assistant_msg_id, "delivered": True}
-        
-        # Allow duplicate client_msg_id if no prompt exists (for monitoring messages)
-        if payload.client_msg_id in session.responses_by_client and prompt:
-            raise_http_error(
-                status.HTTP_409_CONFLICT,
-                "Response already exists for client_msg_id",
-                payload.client_msg_id,
-            )
-        ts = payload.ts or current_timestamp_ms()
-        assistant_message = AssistantMessage(
-            session_id=payload.session_id,
-            assistant_msg_id=assistant_msg_id,
-            client_msg_id=payload.client_msg_id,
-            text=payload.text,
-            metadata=payload.metadata,
-            ts=ts,
-        )
-        session.responses_by_client[payload.client_msg_id] = assistant_message
-        session.responses_by_assistant[assistant_msg_id] = assistant_message
-        session.history.append(HistoryEntry(type="assistant", data=assistant_message))
-    await broadcast_response(session, assistant_message)
-    return {"ok": True, "assistant_msg_id": assistant_msg_id, "delivered": True}
+    @property
+    def etag(self) -> str:
+        """Strong ETag for views of the history and pending prompts.
 
+        Entries are immutable and every change (including trims and prompts
+        being answered) comes with an append, so ``last_seq`` serves as the
+        version counter.
+        """
+        return f'"{self.epoch:x}.{self.last_seq}"'
 
-async def websocket_pinger(websocket: WebSocket) -> None:
-    try:
-        while True:
-            await asyncio.sleep(PING_INTERVAL_SECONDS)
-            await websocket.send_json({"type": "ping", "ts": current_timestamp_ms()})
-    except (RuntimeError, WebSocketDisconnect):
-        return
+    def append(self, record: StoredRecord, seq: Optional[int] = None) -> int:
+        if not self.epoch:
+            self.epoch = record.ts
+        if seq is None:
+            seq = self.next_seq
+        self.next_seq = seq + 1
+        record.seq = seq
+        self.records.append(record)
+        self.seqs.append(seq)
+        if self.max_ts and record.ts < self.max_ts[-1]:
+            self.ts_ordered = False
+            self.max_ts.append(self.max_ts[-1])
+        else:
+            self.max_ts.append(record.ts)
+        return seq
 
+    def index_after_seq(self, seq: int) -> int:
+        return bisect.bisect_right(self.seqs, seq)
 
-async def send_prompts_to_websocket(session: SessionState, websocket: WebSocket) -> None:
-    """Send pending prompts to the WebSocket connection."""
-    async with session.lock:
-        pending = pending_prompts_locked(session)
-        for prompt in pending:
-            try:
-                await websocket.send_json({
-                    "type": "prompt",
-                    "session_id": prompt.session_id,
-                    "client_msg_id": prompt.client_msg_id,
-                    "prompt": prompt.prompt,
-                    "metadata": prompt.metadata,
-                    "ts": prompt.ts
-                })
-                print(f"📤 Sent prompt to WebSocket: {prompt.client_msg_id}")
-            except (RuntimeError, WebSocketDisconnect):
-                break
+    def index_before_seq(self, seq: int) -> int:
+        return bisect.bisect_left(self.seqs, seq)
 
+    def index_after_ts(self, ts: int) -> int:
+        return bisect.bisect_right(self.max_ts, ts)
 
-@app.websocket("/ws/{session_id}")
-async def session_websocket(websocket: WebSocket, session_id: str) -> None:
-    # Auto-create session if it doesn't exist
-    session = await get_session(session_id, create=True)
-    
-    await websocket.accept()
-    print(f"\n🔌 WebSocket connected for session: {session_id}")
-    
-    async with session.lock:
-        session.subscribers.add(websocket)
-    
-    # Send any pending prompts immediately
-    await send_prompts_to_websocket(session, websocket)
-    
-    ping_task = asyncio.create_task(websocket_pinger(websocket))
-    try:
-        while True:
-            try:
-                message = await websocket.receive_text()
-            except WebSocketDisconnect:
-                break
-            if not message:
-                continue
-            try:
-                payload = json.loads(message)
-            except json.JSONDecodeError:
-                await websocket.send_json(
-                    {
-                        "type": "error",
-                        "error": "Invalid JSON",
-                        "details": "WebSocket payload must be valid JSON",
-                    }
-                )
-                continue
-            
+    def page(
+        self,
+        after_seq: Optional[int] = None,
+        before_seq: Optional[int] = None,
+        since: Optional[int] = None,
+        offset: int = 0,
+        limit: int = DEFAULT_HISTORY_LIMIT,
+        newest_first: bool = False,
+    ) -> Tuple[List[Tuple[int, StoredRecord]], int]:
+        """Return one page of ``(seq, record)`` pairs and the size of the filtered range."""
+        lo = 0
+        if after_seq is not None:
+            lo = self.index_after_seq(after_seq)
+        if since is not None:
+            lo = max(lo, self.index_after_ts(since))
+        hi = len(self.records)
+        if before_seq is not None:
+            hi = self.index_before_seq(before_seq)
+        if since is not None and not self.ts_ordered:
+            return self._filtered_page(lo, hi, since, offset, limit, newest_first)
+        total = max(hi - lo, 0)
+        if newest_first:
+            stop = hi - offset
+            start = max(lo, stop - limit)
+        else:
+            start = lo + offset
+            stop = min(start + limit, hi)
+        if stop <= start:
+            return [], total
+        page = list(zip(self.seqs[start:stop], self.records[start:stop]))
+        if newest_first:
+            page.reverse()
+        return page, total
+
+    def _filtered_page(
+        self, lo: int, hi: int, since: int, offset: int, limit: int, newest_first: bool
+    ) -> Tuple[List[Tuple[int, StoredRecord]], int]:
+        records = self.records
+        kept = [i for i in range(lo, hi) if records[i].ts > since]
+        total = len(kept)
+        if newest_first:
+            kept.reverse()
+        kept = kept[offset:offset + limit]
+        return [(self.seqs[i], records[i]) for i in kept], total
+
+    def get(self, seq: int) -> Optional[StoredRecord]:
+        index = self.index_before_seq(seq)
+        if index < len(self.seqs) and self.seqs[index] == seq:
+            return self.records[index]
+        return None
+
+    def trim(self, count: int) -> List[StoredRecord]:
+        """Drop the ``count`` oldest records and return them."""
+        dropped = self.records[:count]
+        del self.records[:count]
+        del self.seqs[:count]
+        del self.max_ts[:count]
+        return dropped
+
+
+fanout_stats: Dict[str, int] = {
+    "frames_enqueued": 0,
+    "frames_sent": 0,
+    "frames_dropped": 0,
+    "frames_coalesced": 0,
+    "slow_consumer_disconnects": 0,
+}
+
+lifecycle_stats: Dict[str, Any] = {
+    "startup_seconds": None,
+    "draining": False,
+    "last_drain": None,
+    "snapshot_opened": None,
+    "snapshot_saved": None,
+    "restored_sessions": 0,
+}
+
+
+metrics = Registry()
+PROMPTS_STORED = metrics.counter("relay_prompts_stored_total", "Prompts stored.")
+RESPONSES_STORED = metrics.counter("relay_responses_stored_total", "Responses stored.")
+PROMPT_ROUND_TRIP = metrics.histogram(
+    "relay_prompt_round_trip_seconds",
+    "Time from a prompt being stored to its response being stored, by client_msg_id.",
+    ROUND_TRIP_BUCKETS,
+)
+FANOUT_DURATION = metrics.histogram(
+    "relay_fanout_duration_seconds", "Time to enqueue one broadcast for every subscriber."
+)
+LONG_POLL_WAIT = metrics.histogram(
+    "relay_long_poll_wait_seconds",
+    "Time /prompts long-polls spent waiting for a prompt.",
+    LONG_POLL_BUCKETS,
+)
+WEBSOCKET_SENT_BYTES = metrics.counter(
+    "relay_websocket_sent_bytes_total", "Bytes sent to WebSocket subscribers."
+)
+EVENT_STREAM_SENT_BYTES = metrics.counter(
+    "relay_event_stream_sent_bytes_total", "Bytes sent to Server-Sent Events subscribers."
+)
+ADMISSION_REJECTED = {
+    scope: metrics.counter(
+        f"relay_admission_rejected_{scope}_total", f"Requests refused by the {scope} limit."
+    )
+    for scope in ("global", "session", "client", "pollers", "subscribers")
+}
+SPILLED_BYTES = metrics.counter(
+    "relay_spilled_bytes_total", "Bytes of oversized responses written to the spill directory."
+)
+SESSION_RESTORE = metrics.histogram(
+    "relay_session_restore_seconds",
+    "Time to rebuild a session from the store or a startup snapshot.",
+)
+WEBSOCKET_CONNECTION_BYTES = metrics.histogram(
+    "relay_websocket_connection_sent_bytes",
+    "Bytes sent over each WebSocket connection, observed at disconnect.",
+    BYTE_BUCKETS,
+)
+
+
+class Frame:
+    """An outbound WebSocket frame, encoded at most once for all subscribers."""
+
+    __slots__ = ("payload", "seq", "_text", "_size", "_binary", "_event", "_tagged")
+
+    def __init__(
+        self,
+        payload: Optional[Dict[str, Any]] = None,
+        text: Optional[str] = None,
+        size: Optional[int] = None,
+        seq: Optional[int] = None,
+    ) -> None:
+        self.payload = payload
+        # History sequence number of the prompt or message carried, if any.
+        self.seq = seq
+        self._text = text
+        self._size = size
+        self._binary: Optional[Dict[str, bytes]] = None
+        self._event: Optional[bytes] = None
+        self._tagged: Optional[Frame] = None
+
+    @property
+    def text(self) -> str:
+        if self._text is None:
+            encoded = dumps_bytes(self.payload)
+            self._size = len(encoded)
+            self._text = encoded.decode("utf-8")
+        return self._text
+
+    @property
+    def size(self) -> int:
+        """Encoded size in bytes."""
+        if self._size is None:
+            self._size = len(self.text.encode("utf-8"))
+        return self._size
+
+    def binary(self, protocol: str) -> bytes:
+        """The frame as a binary subprotocol message, encoded once per protocol."""
+        if self._binary is None:
+            self._binary = {}
+        data = self._binary.get(protocol)
+        if data is None:
+            if protocol == wire.JSON_PROTOCOL:
+                body = self.text.encode("utf-8")
+            else:
+                value = self.payload if self.payload is not None else loads(self.text)
+                body = wire.encode_body(protocol, value)
+            data = self._binary[protocol] = wire.pack(body, WS_COMPRESS_MIN_BYTES)
+        return data
+
+    def event(self) -> bytes:
+        """The frame as one Server-Sent Events message, ``id`` being its seq."""
+        if self._event is None:
+            # Encoded JSON never contains a raw newline, so one data line will do.
+            data = b"data: " + self.text.encode("utf-8") + b"\n\n"
+            if self.seq is not None:
+                data = b"id: %d\n" % self.seq + data
+            self._event = data
+        return self._event
+
+    def tagged(self, session_id: str) -> "Frame":
+        """``{"type":"event","session_id":...,"event":<frame>}`` for ``/ws``.
+
+        A frame belongs to one session, so the tagged copy is built once.
+        """
+        if self._tagged is None:
+            if self.payload is not None:
+                tagged = Frame({"type": "event", "session_id": session_id, "event": self.payload})
+            else:
+                head = b'{"type":"event","session_id":' + dumps_bytes(session_id) + b',"event":'
+                tagged = Frame.from_bytes(head + self.text.encode("utf-8") + b"}")
+            tagged.seq = self.seq
+            self._tagged = tagged
+        return self._tagged
+
+    @classmethod
+    def from_bytes(cls, encoded: bytes, seq: Optional[int] = None) -> "Frame":
+        return cls(text=encoded.decode("utf-8"), size=len(encoded), seq=seq)
+
+    @classmethod
+    def splice(cls, head: bytes, body: bytes, seq: Optional[int] = None) -> "Frame":
+        """Build ``{<head>,"data":<body>}`` from already-encoded JSON."""
+        return cls.from_bytes(b"{" + head + b',"data":' + body + b"}", seq)
+
+
+class Subscriber:
+    """A WebSocket subscriber with a bounded outbound queue.
+
+    ``send`` never blocks: it enqueues the frame and a dedicated writer task
+    drains the queue, so a slow link only delays its own deliveries.
+    """
+
+    def __init__(
+        self,
+        websocket: Optional[WebSocket],
+        max_queue: int = SUBSCRIBER_QUEUE_SIZE,
+        overflow_policy: str = SUBSCRIBER_OVERFLOW_POLICY,
+        protocol: Optional[str] = None,
+    ) -> None:
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy: {overflow_policy}")
+        self.websocket = websocket
+        # Negotiated binary subprotocol, or None for JSON text frames.
+        self.protocol = protocol
+        self.max_queue = max_queue
+        self.overflow_policy = overflow_policy
+        # Items are [coalesce_key, frame] so coalescing can update in place.
+        self.queue: Deque[List[Any]] = deque()
+        self.keyed: Dict[Tuple[str, ...], List[Any]] = {}
+        self.ready = asyncio.Event()
+        self.closed = False
+        self.max_depth = 0
+        self.bytes_sent = 0
+        # Opted in to code blocks as blob references (see blobs.py).
+        self.blob_refs = False
+        self.writer_task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        self.writer_task = asyncio.create_task(self._writer())
+
+    @property
+    def depth(self) -> int:
+        return len(self.queue)
+
+    def send(
+        self,
+        frame: Union[Frame, Dict[str, Any]],
+        coalesce_key: Optional[Tuple[str, ...]] = None,
+    ) -> bool:
+        """Enqueue ``frame``; return False once the subscriber is closed."""
+        if self.closed:
+            return False
+        if not isinstance(frame, Frame):
+            frame = Frame(frame)
+        if coalesce_key is not None and self.overflow_policy == "coalesce":
+            queued = self.keyed.get(coalesce_key)
+            if queued is not None:
+                queued[1] = Frame(merge_frames(queued[1].payload, frame.payload))
+                fanout_stats["frames_coalesced"] += 1
+                return True
+        if len(self.queue) >= self.max_queue:
+            if self.overflow_policy == "disconnect" or not self._drop_oldest_keyed():
+                if coalesce_key is not None and self.overflow_policy != "disconnect":
+                    # Nothing older to give up; lose this delta instead.
+                    fanout_stats["frames_dropped"] += 1
+                    return True
+                fanout_stats["slow_consumer_disconnects"] += 1
+                self.close(SLOW_CONSUMER_CLOSE_CODE)
+                return False
+        item = [coalesce_key, frame]
+        self.queue.append(item)
+        if coalesce_key is not None:
+            self.keyed[coalesce_key] = item
+        self.max_depth = max(self.max_depth, len(self.queue))
+        fanout_stats["frames_enqueued"] += 1
+        self.ready.set()
+        return True
+
+    def send_many(self, frames: List[Frame]) -> bool:
+        """Enqueue several frames; the writer drains them in one wakeup."""
+        for frame in frames:
+            if not self.send(frame):
+                return False
+        return True
+
+    def _drop_oldest_keyed(self) -> bool:
+        """Drop the oldest stream or partial frame; False if none is queued."""
+        if not self.keyed:
+            return False
+        for index, item in enumerate(self.queue):
+            if item[0] is not None:
+                del self.queue[index]
+                if self.keyed.get(item[0]) is item:
+                    del self.keyed[item[0]]
+                fanout_stats["frames_dropped"] += 1
+                return True
+        return False
+
+    def _pop(self) -> Frame:
+        item = self.queue.popleft()
+        if item[0] is not None and self.keyed.get(item[0]) is item:
+            del self.keyed[item[0]]
+        return item[1]
+
+    async def _writer(self) -> None:
+        try:
+            while True:
+                while not self.queue:
+                    self.ready.clear()
+                    await self.ready.wait()
+                frame = self._pop()
+                if self.protocol is None:
+                    await self.websocket.send_text(frame.text)
+                    size = frame.size
+                else:
+                    data = frame.binary(self.protocol)
+                    await self.websocket.send_bytes(data)
+                    size = len(data)
+                fanout_stats["frames_sent"] += 1
+                self.bytes_sent += size
+                WEBSOCKET_SENT_BYTES.inc(size)
+        except (RuntimeError, WebSocketDisconnect, OSError):
+            self.closed = True
+
+    def close(self, code: Optional[int] = None) -> None:
+        if self.closed:
+            return
+        self.closed = True
+        self.queue.clear()
+        self.keyed.clear()
+        if self.writer_task is not None:
+            self.writer_task.cancel()
+        if code is not None:
+            asyncio.create_task(self._close_websocket(code))
+
+    async def _close_websocket(self, code: int) -> None:
+        with contextlib.suppress(RuntimeError, WebSocketDisconnect, OSError):
+            await self.websocket.close(code=code)
+
+    async def aclose(self) -> None:
+        self.close()
+        if self.writer_task is not None:
+            with contextlib.suppress(asyncio.CancelledError):
+                await self.writer_task
+        WEBSOCKET_CONNECTION_BYTES.observe(self.bytes_sent)
+
+
+class EventStreamSubscriber(Subscriber):
+    """A Server-Sent Events subscriber.
+
+    Shares the queueing and overflow handling of ``Subscriber``, but instead
+    of a writer task the response body iterates ``events()``, which drains the
+    queue and emits a comment line after every idle heartbeat interval.
+    """
+
+    def __init__(self) -> None:
+        super().__init__(None)
+
+    def start(self) -> None:
+        pass
+
+    async def events(self) -> AsyncIterator[bytes]:
+        yield b"retry: %d\n\n" % EVENT_STREAM_RETRY_MS
+        while not self.closed:
+            if not self.queue:
+                self.ready.clear()
+                try:
+                    await asyncio.wait_for(self.ready.wait(), EVENT_STREAM_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield b": keep-alive\n\n"
+                continue
+            # Hand the server everything queued as one chunk.
+            frames = [self._pop() for _ in range(len(self.queue))]
+            chunk = b"".join(frame.event() for frame in frames)
+            fanout_stats["frames_sent"] += len(frames)
+            self.bytes_sent += len(chunk)
+            EVENT_STREAM_SENT_BYTES.inc(len(chunk))
+            yield chunk
+
+    def close(self, code: Optional[int] = None) -> None:
+        # There is no close handshake: ending the body is all we can do.
+        super().close()
+        self.ready.set()
+
+    async def aclose(self) -> None:
+        self.close()
+
+
+def merge_frames(queued: Dict[str, Any], newer: Dict[str, Any]) -> Dict[str, Any]:
+    """Collapse two frames with the same coalesce key into one."""
+    if queued.get("type") == "event" and newer.get("type") == "event":
+        return {**newer, "event": merge_frames(queued["event"], newer["event"])}
+    if queued.get("type") == "message_delta" and newer.get("type") == "message_delta":
+        return {**queued, "delta": queued["delta"] + newer["delta"]}
+    return newer
+
+
+class SessionChannel:
+    """One session's share of a multiplexed ``/ws`` connection.
+
+    It sits in ``session.subscribers`` like any subscriber, tags each frame
+    with the session and queues it on the connection's ``Subscriber``, so one
+    queue, writer task and heartbeat serve every session on the connection.
+    """
+
+    __slots__ = ("session_id", "connection", "closed")
+
+    def __init__(self, session_id: str, connection: Subscriber) -> None:
+        self.session_id = session_id
+        self.connection = connection
+        self.closed = False
+
+    @property
+    def blob_refs(self) -> bool:
+        return self.connection.blob_refs
+
+    @property
+    def depth(self) -> int:
+        # The connection's queue, shared with its other sessions.
+        return self.connection.depth
+
+    def send(
+        self,
+        frame: Union[Frame, Dict[str, Any]],
+        coalesce_key: Optional[Tuple[str, ...]] = None,
+    ) -> bool:
+        if self.closed:
+            return False
+        if not isinstance(frame, Frame):
+            frame = Frame(frame)
+        if coalesce_key is not None:
+            coalesce_key = (self.session_id, *coalesce_key)
+        return self.connection.send(frame.tagged(self.session_id), coalesce_key)
+
+    def send_many(self, frames: List[Frame]) -> bool:
+        for frame in frames:
+            if not self.send(frame):
+                return False
+        return True
+
+
+@dataclass
+class ResponseStream:
+    """A streamed assistant response being assembled from delta frames."""
+
+    client_msg_id: str
+    assistant_msg_id: str
+    owner: Subscriber
+    metadata: Optional[Dict[str, Any]] = None
+    chunks: List[str] = field(default_factory=list)
+    size_bytes: int = 0
+    # Once past MAX_MESSAGE_BYTES the response goes to disk (see spill.py)
+    # instead of ``chunks``, and deltas are no longer broadcast.
+    upload_id: Optional[str] = None
+    part: Optional[PartFile] = None
+    flushed_chars: int = 0
+    pending: List[str] = field(default_factory=list)
+    pending_bytes: int = 0
+    flush_task: Optional[asyncio.Task] = None
+
+
+@dataclass
+class SessionState:
+    session_id: str
+    prompts: Dict[str, PromptRecord] = field(default_factory=dict)
+    # Prompts still awaiting a response, in arrival (and therefore ts) order.
+    pending: Dict[str, PromptRecord] = field(default_factory=dict)
+    responses_by_client: Dict[str, AssistantRecord] = field(default_factory=dict)
+    responses_by_assistant: Dict[str, AssistantRecord] = field(default_factory=dict)
+    subscribers: Set[Union[Subscriber, SessionChannel]] = field(default_factory=set)
+    history: SessionHistory = field(default_factory=SessionHistory)
+    streams: Dict[str, ResponseStream] = field(default_factory=dict)
+    blobs: BlobStore = field(default_factory=BlobStore)
+    # References to spilled bodies held by history: digest -> count.
+    spilled: Dict[str, int] = field(default_factory=dict)
+    # Prompt leases held by lease-mode pollers: client_msg_id -> expiry (ms).
+    leases: Dict[str, int] = field(default_factory=dict)
+    # Most recent client_msg_ids of answered prompts dropped by trimming.
+    trimmed_prompts: "OrderedDict[str, None]" = field(default_factory=OrderedDict)
+    claim_waiters: Deque[asyncio.Future] = field(default_factory=deque)
+    lease_timer: Optional[asyncio.TimerHandle] = None
+    # Built on the first search, then kept up to date as history is appended.
+    search: Optional[SearchIndex] = None
+    bytes_used: int = 0
+    active_pollers: int = 0
+    last_active: float = field(default_factory=time.monotonic)
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+
+    def __post_init__(self) -> None:
+        self.condition = asyncio.Condition(self.lock)
+
+
+def estimate_message_bytes(record: StoredRecord) -> int:
+    return MESSAGE_OVERHEAD_BYTES + len(record.encoded)
+
+
+def snapshot_rows(session: SessionState) -> Iterator[StoredRow]:
+    """A session's history as store rows, led by pending prompts it trimmed."""
+    history = session.history
+    oldest = history.seqs[0] if len(history) else history.next_seq
+    trimmed = sorted(
+        (prompt for prompt in session.pending.values() if prompt.seq < oldest),
+        key=lambda prompt: prompt.seq,
+    )
+    for record in chain(trimmed, history.records):
+        assistant_msg_id = getattr(record, "assistant_msg_id", None)
+        yield (
+            record.seq,
+            record.kind,
+            record.client_msg_id,
+            assistant_msg_id,
+            record.ts,
+            record.encoded,
+        )
+
+
+class SessionManager:
+    """Owns all sessions and evicts them by idle TTL and global memory budget.
+
+    Sessions are kept in least-recently-used order. Only sessions nobody is
+    attached to (no WebSocket subscribers, long-polls or open streams) are
+    eligible for eviction, and with the in-memory store only those with no
+    unanswered prompts. Appended history is mirrored to ``store``, from
+    which sessions that are not in memory are reloaded on first access.
+    """
+
+    def __init__(
+        self,
+        store: Optional[SessionStore] = None,
+        idle_ttl_seconds: int = SESSION_IDLE_TTL_SECONDS,
+        memory_budget_bytes: int = SESSION_MEMORY_BUDGET_BYTES,
+        history_cap: int = SESSION_HISTORY_CAP,
+        spill: Optional[SpillStore] = None,
+    ) -> None:
+        self.store = store or SessionStore()
+        self.spill = spill or SpillStore(SPILL_DIR, MAX_UPLOAD_BYTES, PREVIEW_BYTES)
+        self.idle_ttl_seconds = idle_ttl_seconds
+        self.memory_budget_bytes = memory_budget_bytes
+        self.history_cap = history_cap
+        self.sessions: "OrderedDict[str, SessionState]" = OrderedDict()
+        self.lock = asyncio.Lock()
+        self.total_bytes = 0
+        self.evictions: Dict[str, int] = {"idle": 0, "memory": 0}
+        self.trimmed_entries = 0
+        self.recent_evictions: Deque[Dict[str, Any]] = deque(maxlen=RECENT_EVICTIONS_LIMIT)
+        self.snapshot: Optional[SnapshotReader] = None
+        self._collect_task: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self.sessions)
+
+    def get(self, session_id: str) -> Optional[SessionState]:
+        session = self.sessions.get(session_id)
+        if session is not None:
+            self.touch(session)
+        return session
+
+    async def get_or_load(self, session_id: str) -> Optional[SessionState]:
+        session = self.get(session_id)
+        if session is not None:
+            return session
+        async with self.lock:
+            return await self._load_locked(session_id)
+
+    async def get_or_create(self, session_id: str) -> SessionState:
+        session = self.get(session_id)
+        if session is not None:
+            return session
+        async with self.lock:
+            session = await self._load_locked(session_id)
+            if session is None:
+                session = SessionState(session_id=sys.intern(session_id))
+                self.sessions[session.session_id] = session
+            return session
+
+    async def _load_locked(self, session_id: str) -> Optional[SessionState]:
+        session = self.get(session_id)
+        if session is not None:
+            return session
+        started = time.perf_counter()
+        source = self.store.name
+        rows = await self.store.load(session_id)
+        if rows is not None:
+            blobs = await self.store.load_blobs(session_id)
+        else:
+            restored = self.snapshot.pop(session_id) if self.snapshot is not None else None
+            if restored is None:
+                return None
+            rows, blobs = restored
+            source = "snapshot"
+            lifecycle_stats["restored_sessions"] += 1
+        session = self._restore(session_id, rows, blobs)
+        self.sessions[session.session_id] = session
+        elapsed = time.perf_counter() - started
+        SESSION_RESTORE.observe(elapsed)
+        print(
+            f"💾 Loaded session {session_id} from {source}"
+            f" ({len(rows)} entries, {elapsed * 1000:.1f} ms)"
+        )
+        return session
+
+    def open_snapshot(self, path: str) -> None:
+        """Map a startup snapshot; its sessions are restored on first access."""
+        started = time.perf_counter()
+        try:
+            self.snapshot = SnapshotReader(path)
+        except (OSError, ValueError) as exc:
+            print(f"⚠️  Ignoring snapshot {path}: {exc}")
+            return
+        lifecycle_stats["snapshot_opened"] = {
+            "path": path,
+            "sessions": len(self.snapshot),
+            "bytes": self.snapshot.size,
+            "seconds": round(time.perf_counter() - started, 4),
+        }
+        print(f"💾 Mapped snapshot {path} ({len(self.snapshot)} sessions)")
+
+    async def save_snapshot(self, path: str) -> None:
+        """Write every session, loaded or still waiting in the startup
+        snapshot, to ``path``. Call once nothing can change them any more."""
+        started = time.perf_counter()
+        blocks = chain(
+            (
+                (session.session_id, encode_session(snapshot_rows(session), session.blobs.bodies))
+                for session in list(self.sessions.values())
+                if len(session.history) or session.pending
+            ),
+            self.snapshot.remaining(set(self.sessions)) if self.snapshot is not None else (),
+        )
+        restored_from = self.snapshot.path if self.snapshot is not None else None
+        try:
+            count, size = await asyncio.to_thread(write_snapshot, path, blocks)
+        except OSError as exc:
+            print(f"❌ Failed to write snapshot {path}: {exc}")
+            return
+        finally:
+            if self.snapshot is not None:
+                self.snapshot.close()
+                self.snapshot = None
+        if restored_from is not None:
+            # Its sessions are all in the new snapshot now.
+            release_snapshot(restored_from)
+        lifecycle_stats["snapshot_saved"] = {
+            "path": path,
+            "sessions": count,
+            "bytes": size,
+            "seconds": round(time.perf_counter() - started, 4),
+        }
+        print(f"💾 Wrote snapshot {path} ({count} sessions, {size} bytes)")
+
+    def _restore(
+        self, session_id: str, rows: List[StoredRow], blobs: Dict[str, bytes]
+    ) -> SessionState:
+        session = SessionState(session_id=sys.intern(session_id))
+        for seq, kind, client_msg_id, assistant_msg_id, ts, body in rows:
+            record: StoredRecord
+            if kind == "prompt":
+                record = PromptRecord(client_msg_id, ts, body)
+                session.prompts[record.client_msg_id] = record
+                if record.client_msg_id not in session.responses_by_client:
+                    session.pending[record.client_msg_id] = record
+            else:
+                record = AssistantRecord(client_msg_id, assistant_msg_id or "", ts, body)
+                session.responses_by_client[record.client_msg_id] = record
+                session.responses_by_assistant[record.assistant_msg_id] = record
+                session.pending.pop(record.client_msg_id, None)
+                if record.blobs:
+                    self._account(session, session.blobs.retain(record.blobs, blobs)[0])
+                if record.spilled:
+                    self._retain_spilled(session, record.spilled)
+            session.history.append(record, seq=seq)
+            self._account(session, estimate_message_bytes(record))
+        overflow = len(session.history) - self.history_cap
+        if overflow > 0:
+            self._trim_history_locked(session, overflow, event_bus.persists)
+        return session
+
+    def touch(self, session: SessionState) -> None:
+        session.last_active = time.monotonic()
+        if session.session_id in self.sessions:
+            self.sessions.move_to_end(session.session_id)
+
+    def append_history_locked(
+        self,
+        session: SessionState,
+        record: StoredRecord,
+        blobs: Optional[Dict[str, bytes]] = None,
+        persist: bool = True,
+    ) -> int:
+        """Append ``record`` to the session's history; return its seq.
+
+        ``persist`` mirrors the append to the store. Only one process should
+        do that for a bus event; replicas update memory only.
+        """
+        if record.blobs:
+            added, new = session.blobs.retain(record.blobs, blobs or {})
+            if persist:
+                for digest in new:
+                    self.store.put_blob(session.session_id, digest, session.blobs.bodies[digest])
+            self._account(session, added)
+        if record.spilled:
+            self._retain_spilled(session, record.spilled)
+        seq = session.history.append(record)
+        if persist:
+            self.store.append(session.session_id, seq, record)
+        self._account(session, estimate_message_bytes(record))
+        # Trim in batches of 10% so the list shift is amortised.
+        overflow = len(session.history) - self.history_cap
+        if overflow > 0 and overflow >= max(self.history_cap // 10, 1):
+            self._trim_history_locked(session, overflow, persist)
+        if self.total_bytes > self.memory_budget_bytes:
+            self._schedule_collect()
+        return seq
+
+    def _trim_history_locked(self, session: SessionState, count: int, persist: bool = True) -> None:
+        freed = 0
+        for record in session.history.trim(count):
+            freed += estimate_message_bytes(record)
+            if record.blobs:
+                freed += session.blobs.release(record.blobs)
+            if record.spilled:
+                self._release_spilled(session, record.spilled)
+            if isinstance(record, PromptRecord):
+                if record.client_msg_id not in session.pending:
+                    session.prompts.pop(record.client_msg_id, None)
+                    session.trimmed_prompts[record.client_msg_id] = None
+                    if len(session.trimmed_prompts) > TRIMMED_PROMPT_IDS_LIMIT:
+                        session.trimmed_prompts.popitem(last=False)
+            else:
+                session.responses_by_assistant.pop(record.assistant_msg_id, None)
+                if session.responses_by_client.get(record.client_msg_id) is record:
+                    del session.responses_by_client[record.client_msg_id]
+        self.trimmed_entries += count
+        self._account(session, -freed)
+        history = session.history
+        if session.search is not None:
+            session.search.discard_before(history.seqs[0] if len(history) else history.next_seq)
+        if persist:
+            self.store.trim(session.session_id, history.seqs[0] if len(history) else history.next_seq)
+
+    @staticmethod
+    def _retain_spilled(session: SessionState, digest: str) -> None:
+        session.spilled[digest] = session.spilled.get(digest, 0) + 1
+
+    def _release_spilled(self, session: SessionState, digest: str) -> None:
+        count = session.spilled.get(digest, 0) - 1
+        if count > 0:
+            session.spilled[digest] = count
+            return
+        session.spilled.pop(digest, None)
+        self.spill.delete(session.session_id, digest)
+
+    def _account(self, session: SessionState, delta: int) -> None:
+        session.bytes_used += delta
+        self.total_bytes += delta
+
+    def _is_evictable(self, session: SessionState) -> bool:
+        if session.pending and self.store.name == "memory":
+            # Nothing could reload the prompts still waiting for the agent.
+            return False
+        return not (
+            session.subscribers
+            or session.active_pollers
+            or session.streams
+            or session.lock.locked()
+        )
+
+    def _evict(self, session: SessionState, reason: str) -> None:
+        del self.sessions[session.session_id]
+        if session.lease_timer is not None:
+            session.lease_timer.cancel()
+        self.total_bytes -= session.bytes_used
+        # Spilled bodies outlive eviction when the history can be reloaded
+        # from the store, or is still held by other relay processes.
+        if self.store.name == "memory" and event_bus.name == "local":
+            for digest in session.spilled:
+                self.spill.delete(session.session_id, digest)
+        self.evictions[reason] += 1
+        self.recent_evictions.append(
+            {
+                "session_id": session.session_id,
+                "reason": reason,
+                "bytes": session.bytes_used,
+                "entries": len(session.history),
+                "ts": current_timestamp_ms(),
+            }
+        )
+        print(f"🧹 Evicted session {session.session_id} ({reason}, {session.bytes_used} bytes)")
+
+    def collect(self) -> int:
+        """Evict idle sessions, then LRU sessions while over budget."""
+        if event_bus.name != "local" and (self.store.name == "memory" or not event_bus.persists):
+            # Workers evict on their own LRU; a session dropped by one would
+            # be recreated there by the next event, empty, or from a store
+            # the broker may not have flushed yet, and its seqs would diverge.
+            return 0
+        evicted = 0
+        cutoff = time.monotonic() - self.idle_ttl_seconds
+        for session in list(self.sessions.values()):
+            if session.last_active > cutoff:
+                # LRU order: everything after this was used more recently.
+                break
+            if self._is_evictable(session):
+                self._evict(session, "idle")
+                evicted += 1
+        if self.total_bytes > self.memory_budget_bytes:
+            for session in list(self.sessions.values()):
+                if self.total_bytes <= self.memory_budget_bytes:
+                    break
+                if self._is_evictable(session):
+                    self._evict(session, "memory")
+                    evicted += 1
+        return evicted
+
+    def _schedule_collect(self) -> None:
+        if self._collect_task is None or self._collect_task.done():
+            self._collect_task = asyncio.get_running_loop().create_task(self._collect_soon())
+
+    async def _collect_soon(self) -> None:
+        # Run after the caller has released the session lock.
+        await asyncio.sleep(0)
+        self.collect()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "active": len(self.sessions),
+            "memory_bytes": self.total_bytes,
+            "memory_budget_bytes": self.memory_budget_bytes,
+            "idle_ttl_seconds": self.idle_ttl_seconds,
+            "history_cap": self.history_cap,
+            "evictions": dict(self.evictions),
+            "history_entries_trimmed": self.trimmed_entries,
+            "blobs": sum(len(session.blobs) for session in self.sessions.values()),
+            "spilled_bodies": sum(len(session.spilled) for session in self.sessions.values()),
+            "recent_evictions": list(self.recent_evictions),
+            "storage": self.store.stats(),
+        }
+
+
+session_manager = SessionManager(store=SQLiteStore(SQLITE_PATH) if SQLITE_PATH else None)
+rate_limiter = RateLimiter(
+    RATE_LIMIT_GLOBAL,
+    RATE_LIMIT_GLOBAL_BURST,
+    RATE_LIMIT_SESSION,
+    RATE_LIMIT_SESSION_BURST,
+    RATE_LIMIT_CLIENT,
+    RATE_LIMIT_CLIENT_BURST,
+)
+
+
+async def get_session(session_id: str, create: bool = False) -> SessionState:
+    if create:
+        return await session_manager.get_or_create(session_id)
+    session = await session_manager.get_or_load(session_id)
+    if not session:
+        raise_http_error(status.HTTP_404_NOT_FOUND, "Session not found", session_id)
+    return session
+
+
+async def session_gc_loop() -> None:
+    while True:
+        await asyncio.sleep(SESSION_GC_INTERVAL_SECONDS)
+        session_manager.collect()
+        await asyncio.to_thread(session_manager.spill.sweep_uploads, UPLOAD_TTL_SECONDS)
+
+
+def pending_prompts_locked(session: SessionState) -> List[PromptRecord]:
+    return list(session.pending.values())
+
+
+def has_claimable_locked(session: SessionState, now_ms: int) -> bool:
+    leases = session.leases
+    return any(leases.get(client_msg_id, 0) <= now_ms for client_msg_id in session.pending)
+
+
+def claim_prompts_locked(
+    session: SessionState, now_ms: int, lease_ms: int, limit: Optional[int]
+) -> List[Tuple[PromptRecord, int]]:
+    """Lease up to ``limit`` pending prompts that nobody holds a live lease on.
+
+    Driven only by the claim event's timestamp, so every relay process grants
+    the same leases.
+    """
+    claimed: List[Tuple[PromptRecord, int]] = []
+    expires = now_ms + lease_ms
+    for client_msg_id, record in session.pending.items():
+        if session.leases.get(client_msg_id, 0) > now_ms:
+            continue
+        session.leases[client_msg_id] = expires
+        claimed.append((record, expires))
+        if limit is not None and len(claimed) >= limit:
+            break
+    if claimed:
+        schedule_lease_expiry(session)
+        # Anything left over goes to the next waiting poller.
+        if has_claimable_locked(session, now_ms):
+            wake_claimer(session)
+    return claimed
+
+
+def wake_claimer(session: SessionState) -> None:
+    """Wake the longest-waiting lease poller, if any."""
+    while session.claim_waiters:
+        waiter = session.claim_waiters.popleft()
+        if not waiter.done():
+            waiter.set_result(None)
+            return
+
+
+def schedule_lease_expiry(session: SessionState) -> None:
+    """Arrange to wake a poller when the next live lease runs out."""
+    now_ms = current_timestamp_ms()
+    upcoming = [expires for expires in session.leases.values() if expires > now_ms]
+    if not upcoming:
+        return
+    loop = asyncio.get_running_loop()
+    when = loop.time() + (min(upcoming) - now_ms) / 1000
+    if session.lease_timer is not None:
+        if session.lease_timer.when() <= when:
+            return
+        session.lease_timer.cancel()
+    session.lease_timer = loop.call_at(when, on_lease_expiry, session)
+
+
+def on_lease_expiry(session: SessionState) -> None:
+    session.lease_timer = None
+    wake_claimer(session)
+    schedule_lease_expiry(session)
+
+
+def store_prompt_locked(
+    session: SessionState,
+    client_msg_id: str,
+    prompt: str,
+    metadata: Optional[Dict[str, Any]],
+    ts: int,
+    persist: bool = True,
+) -> PromptRecord:
+    record = PromptRecord.create(session.session_id, client_msg_id, prompt, metadata, ts)
+    session.prompts[record.client_msg_id] = record
+    if record.client_msg_id not in session.responses_by_client:
+        session.pending[record.client_msg_id] = record
+    session_manager.append_history_locked(session, record, persist=persist)
+    if session.search is not None:
+        session.search.add(record.seq, document_text(prompt))
+    return record
+
+
+def store_response_locked(
+    session: SessionState,
+    client_msg_id: str,
+    assistant_msg_id: str,
+    text: str,
+    metadata: Optional[Dict[str, Any]],
+    ts: int,
+    body: Optional[Dict[str, Any]] = None,
+    persist: bool = True,
+) -> AssistantRecord:
+    text, metadata, blobs = dedupe_code_blocks(text, metadata, BLOB_MIN_BYTES)
+    record = AssistantRecord.create(
+        session.session_id, client_msg_id, assistant_msg_id, text, metadata, ts, body
+    )
+    session.responses_by_client[record.client_msg_id] = record
+    session.responses_by_assistant[record.assistant_msg_id] = record
+    session.pending.pop(record.client_msg_id, None)
+    session.leases.pop(record.client_msg_id, None)
+    session_manager.append_history_locked(session, record, blobs, persist)
+    if session.search is not None:
+        session.search.add(record.seq, document_text(text, metadata))
+    return record
+
+
+def inline_encoded(session: SessionState, record: StoredRecord) -> bytes:
+    """``record.encoded`` with blob references replaced by their bodies."""
+    if not record.blobs:
+        return record.encoded
+    return dumps_bytes(inline_code_blocks(loads(record.encoded), session.blobs.get))
+
+
+def broadcast_responses(session: SessionState, messages: List[AssistantRecord]) -> int:
+    frames = [message_frame(message) for message in messages]
+    inline = None
+    if any(message.blobs for message in messages) and any(
+        not sub.blob_refs for sub in session.subscribers
+    ):
+        inline = [
+            message_frame(message, inline_encoded(session, message)) if message.blobs else frame
+            for message, frame in zip(messages, frames)
+        ]
+    return broadcast_frames(session, frames, inline)
+
+
+def broadcast_response(session: SessionState, message: AssistantRecord) -> None:
+    broadcast_responses(session, [message])
+
+
+def broadcast_payload(
+    session: SessionState,
+    payload: Union[Frame, Dict[str, Any]],
+    coalesce_key: Optional[Tuple[str, ...]] = None,
+) -> int:
+    """Enqueue ``payload`` for every subscriber and return how many took it."""
+    started = time.perf_counter()
+    frame = payload if isinstance(payload, Frame) else Frame(payload)
+    delivered = 0
+    for subscriber in list(session.subscribers):
+        if subscriber.send(frame, coalesce_key):
+            delivered += 1
+        else:
+            session.subscribers.discard(subscriber)
+    FANOUT_DURATION.observe(time.perf_counter() - started)
+    return delivered
+
+
+def broadcast_frames(
+    session: SessionState,
+    frames: List[Frame],
+    inline: Optional[List[Frame]] = None,
+) -> int:
+    """Enqueue ``frames`` in order for every subscriber, one pass per subscriber.
+
+    Subscribers that did not opt in to blob references get ``inline`` instead,
+    when given.
+    """
+    if not frames:
+        return 0
+    started = time.perf_counter()
+    delivered = 0
+    for subscriber in list(session.subscribers):
+        chosen = inline if inline is not None and not subscriber.blob_refs else frames
+        if subscriber.send_many(chosen):
+            delivered += 1
+        else:
+            session.subscribers.discard(subscriber)
+    FANOUT_DURATION.observe(time.perf_counter() - started)
+    return delivered
+
+
+async def publish_event(event: Event) -> Any:
+    """Publish a state change to every relay process and apply it here."""
+    try:
+        return await event_bus.publish(event)
+    except RuntimeError as exc:
+        raise_http_error(status.HTTP_503_SERVICE_UNAVAILABLE, "Event bus unavailable", str(exc))
+
+
+async def publish_frame(
+    session: SessionState,
+    payload: Dict[str, Any],
+    coalesce_key: Optional[Tuple[str, ...]] = None,
+) -> None:
+    await publish_event(
+        {
+            "type": "frame",
+            "session_id": session.session_id,
+            "frame": payload,
+            "coalesce_key": coalesce_key,
+        }
+    )
+
+
+def apply_prompt_locked(
+    session: SessionState, item: Dict[str, Any], persist: bool = True
+) -> Optional[PromptRecord]:
+    """Store one prompt event item; None if its client_msg_id was already stored."""
+    client_msg_id = item["client_msg_id"]
+    if client_msg_id in session.prompts or client_msg_id in session.trimmed_prompts:
+        return None
+    return store_prompt_locked(
+        session, client_msg_id, item["prompt"], item["metadata"], item["ts"], persist
+    )
+
+
+def apply_response_locked(
+    session: SessionState, item: Dict[str, Any], strict: bool, persist: bool = True
+) -> Tuple[str, Optional[AssistantRecord]]:
+    """Store one response event item; return its outcome and the stored record."""
+    client_msg_id = item["client_msg_id"]
+    if item["assistant_msg_id"] in session.responses_by_assistant:
+        return "duplicate", None
+    # Allow duplicate client_msg_id if no prompt exists (for monitoring messages)
+    if strict and client_msg_id in session.responses_by_client and client_msg_id in session.prompts:
+        return "conflict", None
+    prompt = session.pending.get(client_msg_id)
+    record = store_response_locked(
+        session,
+        client_msg_id,
+        item["assistant_msg_id"],
+        item["text"],
+        item["metadata"],
+        item["ts"],
+        item.get("body"),
+        persist,
+    )
+    # Conditional /prompts polls wait for any change to the pending set.
+    session.condition.notify_all()
+    RESPONSES_STORED.inc()
+    if prompt is not None:
+        PROMPT_ROUND_TRIP.observe(max(current_timestamp_ms() - prompt.ts, 0) / 1000)
+    return "stored", record
+
+
+async def apply_prompt_event(event: Event) -> bool:
+    """Store a prompt; return False if its client_msg_id was already stored."""
+    session = await session_manager.get_or_create(event["session_id"])
+    async with session.lock:
+        prompt_message = apply_prompt_locked(session, event, event_bus.persists)
+        if prompt_message is None:
+            return False
+        session.condition.notify_all()
+        wake_claimer(session)
+    PROMPTS_STORED.inc()
+    
+    delivered = broadcast_payload(session, prompt_frame(prompt_message))
+    if delivered:
+        print(f"📤 Queued prompt for {delivered} WebSocket subscriber(s): {event['client_msg_id']}")
+    return True
+
+
+async def apply_response_event(event: Event) -> str:
+    """Store a response; return "stored", "duplicate" or "conflict"."""
+    session = await session_manager.get_or_create(event["session_id"])
+    async with session.lock:
+        outcome, assistant_message = apply_response_locked(
+            session, event, event["strict"], event_bus.persists
+        )
+    if assistant_message is not None:
+        broadcast_response(session, assistant_message)
+    return outcome
+
+
+async def apply_prompt_batch_event(event: Event) -> List[bool]:
+    """Store many prompts under one lock; return whether each was newly stored."""
+    session = await session_manager.get_or_create(event["session_id"])
+    stored: List[PromptRecord] = []
+    results: List[bool] = []
+    async with session.lock:
+        for item in event["items"]:
+            record = apply_prompt_locked(session, item, event_bus.persists)
+            results.append(record is not None)
+            if record is not None:
+                stored.append(record)
+        if stored:
+            session.condition.notify_all()
+            wake_claimer(session)
+    PROMPTS_STORED.inc(len(stored))
+    broadcast_frames(session, [prompt_frame(record) for record in stored])
+    return results
+
+
+async def apply_response_batch_event(event: Event) -> List[str]:
+    """Store many responses under one lock; return each item's outcome."""
+    session = await session_manager.get_or_create(event["session_id"])
+    stored: List[AssistantRecord] = []
+    results: List[str] = []
+    async with session.lock:
+        for item in event["items"]:
+            outcome, record = apply_response_locked(
+                session, item, event["strict"], event_bus.persists
+            )
+            results.append(outcome)
+            if record is not None:
+                stored.append(record)
+    broadcast_responses(session, stored)
+    return results
+
+
+async def apply_claim_event(event: Event) -> List[Tuple[PromptRecord, int]]:
+    """Lease pending prompts to one poller; see ``claim_prompts_locked``."""
+    session = await session_manager.get_or_load(event["session_id"])
+    if session is None:
+        return []
+    async with session.lock:
+        return claim_prompts_locked(session, event["ts"], event["lease_ms"], event["limit"])
+
+
+async def apply_frame_event(event: Event) -> int:
+    # Ephemeral frames only matter to processes that have the session loaded.
+    session = session_manager.sessions.get(event["session_id"])
+    if session is None:
+        return 0
+    coalesce_key = event.get("coalesce_key")
+    return broadcast_payload(
+        session, event["frame"], tuple(coalesce_key) if coalesce_key else None
+    )
+
+
+async def apply_drain_event(event: Event) -> None:
+    # Bus events are applied one at a time, and a drain waits on deliveries
+    # that need later events, so it runs on its own.
+    start_drain(event["timeout"])
+
+
+EVENT_APPLIERS = {
+    "prompt": apply_prompt_event,
+    "response": apply_response_event,
+    "prompt_batch": apply_prompt_batch_event,
+    "response_batch": apply_response_batch_event,
+    "claim": apply_claim_event,
+    "frame": apply_frame_event,
+    "drain": apply_drain_event,
+}
+
+
+async def apply_event(event: Event) -> Any:
+    return await EVENT_APPLIERS[event["type"]](event)
+
+
+drain_task: Optional[asyncio.Task] = None
+
+
+def start_drain(timeout: float = DRAIN_TIMEOUT_SECONDS) -> asyncio.Task:
+    global drain_task
+    if drain_task is None:
+        drain_task = asyncio.create_task(drain(timeout))
+    return drain_task
+
+
+def drained() -> bool:
+    return not any(
+        session.streams or any(subscriber.depth for subscriber in session.subscribers)
+        for session in all_sessions()
+    )
+
+
+async def drain(timeout: float = DRAIN_TIMEOUT_SECONDS) -> Dict[str, Any]:
+    """Get this process ready to stop without losing frames.
+
+    New subscribers and long-polls are refused from here on; writes are still
+    taken. Subscribers keep receiving until their queues are empty and open
+    response streams have ended, or ``timeout`` passes, then are closed with
+    DRAIN_CLOSE_CODE so they reconnect (to the next relay) and resume from
+    their last seq.
+    """
+    lifecycle_stats["draining"] = True
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    deadline = started + timeout
+    while not drained() and loop.time() < deadline:
+        await asyncio.sleep(DRAIN_POLL_SECONDS)
+    flushed = drained()
+    if flushed:
+        # Let writers finish the frames they already took off their queues.
+        await asyncio.sleep(DRAIN_POLL_SECONDS)
+    connections = {
+        subscriber.connection if isinstance(subscriber, SessionChannel) else subscriber
+        for session in all_sessions()
+        for subscriber in session.subscribers
+    }
+    for connection in connections:
+        connection.close(DRAIN_CLOSE_CODE)
+    result = {
+        "closed": len(connections),
+        "flushed": flushed,
+        "seconds": round(loop.time() - started, 3),
+    }
+    lifecycle_stats["last_drain"] = result
+    if connections or not flushed:
+        print(f"🚰 Drained: closed {len(connections)} subscriber(s), flushed={flushed}")
+    return result
+
+
+def create_event_bus(url: str) -> EventBus:
+    if url == "local":
+        return EventBus()
+    if url.startswith("unix:"):
+        return UnixSocketBus(url[len("unix:") :], encode=dumps_bytes, decode=loads)
+    raise ValueError(f"Unsupported RELAY_EVENT_BUS: {url}")
+
+
+event_bus = create_event_bus(EVENT_BUS_URL)
+
+
+def fanout_metrics() -> Dict[str, Any]:
+    depths = [
+        subscriber.depth
+        for session in session_manager.sessions.values()
+        for subscriber in session.subscribers
+    ]
+    return {
+        **fanout_stats,
+        "subscribers": len(depths),
+        "queued_frames": sum(depths),
+        "max_queue_depth": max(depths, default=0),
+        "queue_size": SUBSCRIBER_QUEUE_SIZE,
+        "overflow_policy": SUBSCRIBER_OVERFLOW_POLICY,
+    }
+
+
+@app.exception_handler(HTTPException)
+async def custom_http_exception_handler(
+    request: Request, exc: HTTPException
+) -> JSONResponse:
+    detail = exc.detail
+    if isinstance(detail, dict):
+        error = detail.get("error") or "Error"
+        details = detail.get("details")
+    else:
+        error = detail or "Error"
+        details = None
+    return JSONResponse(
+        status_code=exc.status_code,
+        content={"error": error, "details": details},
+        headers=exc.headers,
+    )
+
+
+@app.exception_handler(RequestValidationError)
+async def validation_exception_handler(
+    request: Request, exc: RequestValidationError
+) -> JSONResponse:
+    return JSONResponse(
+        status_code=status.HTTP_400_BAD_REQUEST,
+        content={"error": "Invalid request body", "details": exc.errors()},
+    )
+
+@app.get("/")
+async def root() -> Dict[str, Any]:
+    return {"message": "Hello, World!"}
+
+@app.post("/prompt")
+async def create_prompt(payload: PromptPayload, request: Request) -> Dict[str, Any]:
+    session_id = payload.session_id
+    ensure_message_size(payload.prompt, "prompt")
+    admit(session_id, client_address(request))
+    client_msg_id = normalize_optional_id(payload.client_msg_id, "client_msg_id") or str(
+        uuid.uuid4()
+    )
+    # Stored, and sent to all WebSocket subscribers, by apply_prompt_event
+    await publish_event(
+        {
+            "type": "prompt",
+            "session_id": session_id,
+            "client_msg_id": client_msg_id,
+            "prompt": payload.prompt,
+            "metadata": payload.metadata,
+            "ts": current_timestamp_ms(),
+        }
+    )
+    return {"stored": True, "client_msg_id": client_msg_id}
+
+
+@app.post("/prompts:batch")
+async def create_prompts_batch(payload: PromptBatchPayload, request: Request) -> Dict[str, Any]:
+    """Store many prompts for one session with a single event and broadcast."""
+    admit(payload.session_id, client_address(request), len(payload.prompts))
+    ts = current_timestamp_ms()
+    items = []
+    for item in payload.prompts:
+        ensure_message_size(item.prompt, "prompt")
+        items.append(
+            {
+                "client_msg_id": item.client_msg_id or str(uuid.uuid4()),
+                "prompt": item.prompt,
+                "metadata": item.metadata,
+                "ts": ts,
+            }
+        )
+    stored = await publish_event(
+        {"type": "prompt_batch", "session_id": payload.session_id, "items": items}
+    )
+    return {
+        "results": [
+            {"client_msg_id": item["client_msg_id"], "stored": was_stored}
+            for item, was_stored in zip(items, stored)
+        ]
+    }
+
+
+@app.get("/prompts/{session_id}")
+async def fetch_prompts(
+    session_id: str,
+    timeout: int = Query(DEFAULT_PROMPT_TIMEOUT, ge=0, le=MAX_PROMPT_TIMEOUT),
+    wait: bool = Query(True),
+    lease: Optional[int] = Query(None, ge=1, le=MAX_LEASE_SECONDS),
+    limit: Optional[int] = Query(None, ge=1, le=MAX_BATCH_ITEMS),
+    changes_since: Optional[int] = Query(None, ge=0),
+    if_none_match: Optional[str] = Header(None),
+) -> Response:
+    session = await get_session(session_id)
+    if wait and timeout > 0:
+        ensure_accepting()
+        ensure_capacity("pollers", session.active_pollers, MAX_POLLERS_PER_SESSION, session_id)
+    if lease is not None:
+        return await claim_prompts(session, lease, limit, timeout if wait else 0)
+    if changes_since is not None or etag_matches(if_none_match, session.history.etag):
+        return await poll_prompt_changes(session, changes_since, timeout if wait else 0)
+    loop = asyncio.get_running_loop()
+    async with session.condition:
+        pending = pending_prompts_locked(session)
+        if pending or not wait or timeout == 0:
+            return prompts_response(pending, session.history.etag)
+        started = loop.time()
+        deadline = started + timeout
+        session.active_pollers += 1
+        try:
+            while True:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    return prompts_response([], session.history.etag)
+                try:
+                    await asyncio.wait_for(session.condition.wait(), timeout=remaining)
+                except asyncio.TimeoutError:
+                    return prompts_response([], session.history.etag)
+                pending = pending_prompts_locked(session)
+                if pending:
+                    return prompts_response(pending, session.history.etag)
+        finally:
+            session.active_pollers -= 1
+            session_manager.touch(session)
+            LONG_POLL_WAIT.observe(loop.time() - started)
+
+
+async def poll_prompt_changes(
+    session: SessionState, changes_since: Optional[int], timeout: int
+) -> Response:
+    """Wait up to ``timeout`` for the pending prompts to change.
+
+    With ``changes_since`` the answer is a delta against that version; without
+    it (the client's ``If-None-Match`` matched) it is the full list, or a 304
+    if nothing changed in time.
+    """
+    loop = asyncio.get_running_loop()
+    history = session.history
+    async with session.condition:
+        baseline = history.last_seq if changes_since is None else changes_since
+        if history.last_seq == baseline and timeout > 0:
+            started = loop.time()
+            session.active_pollers += 1
+            try:
+                await asyncio.wait_for(
+                    session.condition.wait_for(lambda: history.last_seq != baseline), timeout
+                )
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                session.active_pollers -= 1
+                session_manager.touch(session)
+                LONG_POLL_WAIT.observe(loop.time() - started)
+        etag = history.etag
+        if changes_since is None:
+            if history.last_seq == baseline:
+                return not_modified(etag)
+            return prompts_response(pending_prompts_locked(session), etag)
+        return json_bytes_response(prompt_changes_locked(session, changes_since), etag)
+
+
+def prompt_changes_locked(session: SessionState, since: int) -> bytes:
+    """The pending-prompt changes after version ``since``, encoded.
+
+    ``prompts`` are the pending prompts stored since then and ``answered`` the
+    ids answered since then. When history no longer reaches back to ``since``
+    (or the relay restarted), ``reset`` is true and ``prompts`` is the full list.
+    """
+    history = session.history
+    oldest = history.seqs[0] if len(history) else history.next_seq
+    reset = since > history.last_seq or since + 1 < oldest
+    prompts = [p for p in session.pending.values() if reset or p.seq > since]
+    answered = (
+        []
+        if reset
+        else [
+            record.client_msg_id
+            for record in history.records[history.index_after_seq(since) :]
+            if isinstance(record, AssistantRecord)
+        ]
+    )
+    head = dumps_bytes({"version": history.last_seq, "reset": reset, "answered": answered})
+    return head[:-1] + b',"prompts":[' + b",".join(p.encoded for p in prompts) + b"]}"
+
+
+async def claim_prompts(
+    session: SessionState, lease_seconds: int, limit: Optional[int], timeout: int
+) -> Response:
+    """Long-poll for prompts and lease them to this caller.
+
+    Leased prompts are hidden from other lease-mode pollers until the lease
+    expires or a response is stored for them. Waiters queue in FIFO order and
+    are woken one at a time, only when there is something to claim.
+    """
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    deadline = started + timeout
+    session.active_pollers += 1
+    try:
+        while True:
+            claimed = await publish_event(
+                {
+                    "type": "claim",
+                    "session_id": session.session_id,
+                    "lease_ms": lease_seconds * 1000,
+                    "limit": limit,
+                    "ts": current_timestamp_ms(),
+                }
+            )
+            remaining = deadline - loop.time()
+            if claimed or remaining <= 0:
+                return leased_prompts_response(claimed)
+            waiter = loop.create_future()
+            async with session.lock:
+                if has_claimable_locked(session, current_timestamp_ms()):
+                    continue
+                while session.claim_waiters and session.claim_waiters[0].done():
+                    session.claim_waiters.popleft()
+                session.claim_waiters.append(waiter)
+            try:
+                await asyncio.wait_for(waiter, timeout=remaining)
+            except asyncio.TimeoutError:
+                return leased_prompts_response([])
+    finally:
+        session.active_pollers -= 1
+        session_manager.touch(session)
+        LONG_POLL_WAIT.observe(loop.time() - started)
+
+
+@app.post("/response")
+async def create_response(payload: ResponsePayload, request: Request) -> Dict[str, Any]:
+    print(f"\n{'='*60}")
+    print(f"📨 RECEIVED MESSAGE")
+    print(f"{'='*60}")
+    print(f"Session ID: {payload.session_id}")
+    print(f"Client Msg ID: {payload.client_msg_id}")
+    print(f"Text: {payload.text[:200]}{'...' if len(payload.text) > 200 else ''}")
+    if payload.metadata:
+        print(f"Metadata: {payload.metadata}")
+    print(f"{'='*60}\n")
+    
+    ensure_message_size(payload.text, "text")
+    admit(payload.session_id, client_address(request))
+    assistant_msg_id = normalize_optional_id(
+        payload.assistant_msg_id, "assistant_msg_id"
+    ) or str(uuid.uuid4())
+    
+    # Auto-create session if it doesn't exist (for standalone messages)
+    session = await get_session(payload.session_id, create=True)
+    
+    # Allow messages without prompts (for monitoring/connection messages)
+    if payload.client_msg_id not in session.prompts:
+        print(f"⚠️  No matching prompt found for client_msg_id: {payload.client_msg_id}")
+        print(f"   Creating standalone message entry...")
+    
+    outcome = await publish_event(
+        {
+            "type": "response",
+            "session_id": payload.session_id,
+            "client_msg_id": payload.client_msg_id,
+            "assistant_msg_id": assistant_msg_id,
+            "text": payload.text,
+            "metadata": payload.metadata,
+            "ts": payload.ts or current_timestamp_ms(),
+            "strict": True,
+        }
+    )
+    if outcome == "conflict":
+        raise_http_error(
+            status.HTTP_409_CONFLICT,
+            "Response already exists for client_msg_id",
+            payload.client_msg_id,
+        )
+    return {"ok": True, "assistant_msg_id": assistant_msg_id, "delivered": True}
+
+
+def response_batch_item(item: Any, ts: int) -> Dict[str, Any]:
+    """Validate one batched response into an event item; raises ``ValueError``."""
+    if not isinstance(item, dict):
+        raise ValueError("each response must be an object")
+    try:
+        response = ResponseBatchItem(**item)
+    except ValidationError as exc:
+        raise ValueError("; ".join(error["msg"] for error in exc.errors())) from None
+    if exceeds_bytes(response.text, MAX_MESSAGE_BYTES):
+        raise ValueError(f"text exceeds {MAX_MESSAGE_BYTES} bytes")
+    assistant_msg_id = response.assistant_msg_id.strip() if response.assistant_msg_id else ""
+    return {
+        "client_msg_id": response.client_msg_id,
+        "assistant_msg_id": assistant_msg_id or str(uuid.uuid4()),
+        "text": response.text,
+        "metadata": response.metadata,
+        "ts": response.ts or ts,
+    }
+
+
+async def publish_response_batch(
+    session_id: str, items: List[Dict[str, Any]], strict: bool
+) -> List[Dict[str, Any]]:
+    outcomes = await publish_event(
+        {"type": "response_batch", "session_id": session_id, "items": items, "strict": strict}
+    )
+    return [
+        {
+            "client_msg_id": item["client_msg_id"],
+            "assistant_msg_id": item["assistant_msg_id"],
+            "status": outcome,
+        }
+        for item, outcome in zip(items, outcomes)
+    ]
+
+
+@app.post("/responses:batch")
+async def create_responses_batch(
+    payload: ResponseBatchPayload, request: Request
+) -> Dict[str, Any]:
+    """Store many responses for one session with a single event and broadcast.
+
+    Each item reports "stored", "duplicate" (assistant_msg_id already stored) or
+    "conflict" (the prompt already has a response), as ``/response`` would.
+    """
+    admit(payload.session_id, client_address(request), len(payload.responses))
+    ts = current_timestamp_ms()
+    items = []
+    for response in payload.responses:
+        ensure_message_size(response.text, "text")
+        items.append(
+            {
+                "client_msg_id": response.client_msg_id,
+                "assistant_msg_id": normalize_optional_id(
+                    response.assistant_msg_id, "assistant_msg_id"
+                )
+                or str(uuid.uuid4()),
+                "text": response.text,
+                "metadata": response.metadata,
+                "ts": response.ts or ts,
+            }
+        )
+    results = await publish_response_batch(payload.session_id, items, strict=True)
+    print(f"📨 Stored batch of {len(items)} response(s) for session {payload.session_id}")
+    return {"results": results}
+
+
+# Uploads this process is appending to; a second writer is refused rather
+# than interleaved.
+active_uploads: Set[str] = set()
+
+
+@app.post("/uploads/{session_id}")
+async def create_upload(session_id: str, request: Request) -> Dict[str, Any]:
+    """Start a response too large for ``/response``; see spill.py.
+
+    The body is appended with ``POST /uploads/{session_id}/{upload_id}`` and
+    stored with ``.../complete``. The upload is charged to the rate limiter
+    here, like a ``/response``.
+    """
+    admit(session_id, client_address(request))
+    try:
+        upload_id = await asyncio.to_thread(session_manager.spill.create_upload, session_id)
+    except OSError as exc:
+        raise_http_error(
+            status.HTTP_503_SERVICE_UNAVAILABLE, "Spill directory unavailable", str(exc)
+        )
+    return {"upload_id": upload_id, "offset": 0, "max_bytes": MAX_UPLOAD_BYTES}
+
+
+@app.post("/uploads/{session_id}/{upload_id}")
+async def append_upload(
+    session_id: str,
+    upload_id: str,
+    request: Request,
+    offset: int = Query(..., ge=0),
+) -> Dict[str, Any]:
+    """Append the request body to an upload that is ``offset`` bytes long.
+
+    A chunk is appended whole or not at all, so a client that lost the
+    response can retry it (409 tells it the actual offset).
+    """
+    if upload_id in active_uploads:
+        raise_http_error(status.HTTP_409_CONFLICT, "Upload busy", upload_id)
+    try:
+        part = session_manager.spill.open_upload(session_id, upload_id, offset)
+    except FileNotFoundError:
+        raise_http_error(status.HTTP_404_NOT_FOUND, "Upload not found", upload_id)
+    except UploadOffsetMismatch as exc:
+        raise_http_error(
+            status.HTTP_409_CONFLICT,
+            "Upload offset mismatch",
+            f"upload {upload_id} is at offset {exc.size}",
+        )
+    active_uploads.add(upload_id)
+    try:
+        async for chunk in request.stream():
+            await asyncio.to_thread(part.write, chunk)
+    except UploadTooLarge as exc:
+        part.truncate(offset)
+        raise_http_error(413, "Upload exceeds size limit", str(exc))
+    except BaseException:
+        part.truncate(offset)
+        raise
+    finally:
+        part.close()
+        active_uploads.discard(upload_id)
+    return {"upload_id": upload_id, "offset": part.size}
+
+
+@app.post("/uploads/{session_id}/{upload_id}/complete")
+async def complete_upload(
+    session_id: str, upload_id: str, payload: UploadCompletePayload
+) -> Dict[str, Any]:
+    """Store an upload as the response to ``client_msg_id``.
+
+    The stored message carries a preview as ``text`` and a ``body`` reference
+    to the full upload, served by ``GET /bodies/{session_id}/{digest}``.
+    """
+    if upload_id in active_uploads:
+        raise_http_error(status.HTTP_409_CONFLICT, "Upload busy", upload_id)
+    assistant_msg_id = normalize_optional_id(
+        payload.assistant_msg_id, "assistant_msg_id"
+    ) or str(uuid.uuid4())
+    session = await get_session(session_id, create=True)
+    try:
+        fields = await finish_upload(session.session_id, upload_id)
+    except FileNotFoundError:
+        raise_http_error(status.HTTP_404_NOT_FOUND, "Upload not found", upload_id)
+    if not fields["text"]:
+        await release_unused_body(session, fields)
+        raise_http_error(status.HTTP_400_BAD_REQUEST, "Missing required field", "upload is empty")
+    outcome = await publish_event(
+        {
+            "type": "response",
+            "session_id": session.session_id,
+            "client_msg_id": payload.client_msg_id,
+            "assistant_msg_id": assistant_msg_id,
+            **fields,
+            "metadata": payload.metadata,
+            "ts": payload.ts or current_timestamp_ms(),
+            "strict": True,
+        }
+    )
+    await release_unused_body(session, fields)
+    if outcome == "conflict":
+        raise_http_error(
+            status.HTTP_409_CONFLICT,
+            "Response already exists for client_msg_id",
+            payload.client_msg_id,
+        )
+    print(f"📦 Stored {fields['body']['size']}-byte response upload for session {session_id}")
+    return {
+        "ok": True,
+        "assistant_msg_id": assistant_msg_id,
+        "delivered": True,
+        "body": fields["body"],
+    }
+
+
+def prompt_frame(prompt: PromptRecord) -> Frame:
+    # Prompt frames are the prompt's own fields plus ``type`` and ``seq``.
+    return Frame.from_bytes(
+        b'{"type":"prompt","seq":%d,' % prompt.seq + prompt.encoded[1:], prompt.seq
+    )
+
+
+def message_frame(message: AssistantRecord, encoded: Optional[bytes] = None) -> Frame:
+    head = b'"type":"message","seq":%d' % message.seq
+    return Frame.splice(head, message.encoded if encoded is None else encoded, message.seq)
+
+
+def history_frame(session: SessionState, record: StoredRecord, blob_refs: bool) -> Frame:
+    if isinstance(record, PromptRecord):
+        return prompt_frame(record)
+    if record.blobs and not blob_refs:
+        return message_frame(record, inline_encoded(session, record))
+    return message_frame(record)
+
+
+def replay_history_locked(
+    session: SessionState, subscriber: Union[Subscriber, SessionChannel], last_seq: int
+) -> int:
+    """Queue the history entries after ``last_seq`` for a resuming subscriber.
+
+    Called under the session lock while subscribing, so no entry can be
+    broadcast in between: the client sees every later entry exactly once.
+    When the gap is too large, or history no longer reaches back to it, the
+    client gets a ``resync`` frame instead and catches up via ``/messages``.
+    """
+    history = session.history
+    start = history.index_after_seq(last_seq)
+    missed = len(history) - start
+    oldest = history.seqs[0] if len(history) else history.next_seq
+    if last_seq > history.last_seq:
+        # The client saw seqs this history never had (e.g. an in-memory
+        # relay restarted); everything here is new to it.
+        subscriber.send({"type": "resync", "after_seq": 0, "last_seq": history.last_seq})
+        return 0
+    if missed > REPLAY_LIMIT or last_seq + 1 < oldest:
+        subscriber.send(
+            {"type": "resync", "after_seq": last_seq, "last_seq": history.last_seq}
+        )
+        return 0
+    subscriber.send({"type": "resumed", "last_seq": history.last_seq, "replayed": missed})
+    for record in history.records[start:]:
+        subscriber.send(history_frame(session, record, subscriber.blob_refs))
+    return missed
+
+
+def prompts_response(prompts: List[PromptRecord], etag: Optional[str] = None) -> Response:
+    return json_bytes_response(b"[" + b",".join(p.encoded for p in prompts) + b"]", etag)
+
+
+def leased_prompts_response(claimed: List[Tuple[PromptRecord, int]]) -> Response:
+    return json_bytes_response(
+        b"["
+        + b",".join(b'{"lease_expires_at":%d,' % expires + p.encoded[1:] for p, expires in claimed)
+        + b"]"
+    )
+
+
+async def websocket_pinger(subscriber: Subscriber) -> None:
+    while not subscriber.closed:
+        await asyncio.sleep(PING_INTERVAL_SECONDS)
+        subscriber.send({"type": "ping", "ts": current_timestamp_ms()})
+
+
+async def receive_ws_payload(
+    websocket: WebSocket, protocol: Optional[str]
+) -> Optional[Dict[str, Any]]:
+    """Read and decode one client frame; ``None`` if it was empty.
+
+    Raises ``WebSocketDisconnect`` when the client goes away and ``ValueError``
+    when the frame cannot be decoded or is not an object.
+    """
+    message = await websocket.receive()
+    if message["type"] == "websocket.disconnect":
+        raise WebSocketDisconnect(message.get("code", 1000))
+    text = message.get("text")
+    if text is not None:
+        if not text:
+            return None
+        payload = loads(text)
+    else:
+        data = message.get("bytes")
+        if not data:
+            return None
+        if protocol is None:
+            raise ValueError("Binary frames require a negotiated subprotocol")
+        payload = wire.decode(protocol, data)
+    if not isinstance(payload, dict):
+        raise ValueError("WebSocket payload must be an object")
+    return payload
+
+
+def parse_last_seq(value: Any) -> Optional[int]:
+    if value is None:
+        return None
+    try:
+        return max(int(value), 0)
+    except (TypeError, ValueError):
+        return None
+
+
+async def attach_subscriber(
+    session: SessionState,
+    subscriber: Union[Subscriber, SessionChannel],
+    resume_from: Optional[int],
+) -> None:
+    """Start broadcasting to ``subscriber`` and queue what it missed.
+
+    A resuming subscriber gets the history after ``resume_from``; a fresh one
+    gets the pending prompts.
+    """
+    async with session.lock:
+        session.subscribers.add(subscriber)
+        if resume_from is not None:
+            replay_history_locked(session, subscriber, resume_from)
+    if resume_from is None:
+        await send_prompts_to_websocket(session, subscriber)
+
+
+async def send_prompts_to_websocket(
+    session: SessionState, subscriber: Union[Subscriber, SessionChannel]
+) -> None:
+    """Send pending prompts to a newly connected subscriber."""
+    async with session.lock:
+        pending = pending_prompts_locked(session)
+    for prompt in pending:
+        if not subscriber.send(prompt_frame(prompt)):
+            break
+        print(f"📤 Sent prompt to WebSocket: {prompt.client_msg_id}")
+
+
+def send_ws_error(subscriber: Subscriber, error: str, details: Optional[str] = None) -> None:
+    subscriber.send({"type": "error", "error": error, "details": details})
+
+
+async def flush_stream(session: SessionState, stream: ResponseStream) -> None:
+    """Broadcast the deltas buffered for ``stream`` as a single frame."""
+    if not stream.pending:
+        return
+    delta = "".join(stream.pending)
+    offset = stream.flushed_chars
+    stream.pending.clear()
+    stream.pending_bytes = 0
+    stream.flushed_chars += len(delta)
+    await publish_frame(
+        session,
+        {
+            "type": "message_delta",
+            "session_id": session.session_id,
+            "client_msg_id": stream.client_msg_id,
+            "assistant_msg_id": stream.assistant_msg_id,
+            "offset": offset,
+            "delta": delta,
+        },
+        coalesce_key=("delta", stream.client_msg_id),
+    )
+
+
+async def delayed_stream_flush(session: SessionState, stream: ResponseStream) -> None:
+    await asyncio.sleep(STREAM_FLUSH_INTERVAL_MS / 1000)
+    stream.flush_task = None
+    await flush_stream(session, stream)
+
+
+def cancel_stream_flush(stream: ResponseStream) -> None:
+    if stream.flush_task is not None:
+        stream.flush_task.cancel()
+        stream.flush_task = None
+
+
+def spill_stream(session_id: str, stream: ResponseStream) -> None:
+    """Move a stream that outgrew MAX_MESSAGE_BYTES into an upload.
+
+    Blocking; run it in a thread.
+    """
+    spill = session_manager.spill
+    stream.upload_id = spill.create_upload(session_id)
+    stream.part = spill.open_upload(session_id, stream.upload_id)
+    stream.part.write("".join(stream.chunks).encode("utf-8"))
+    stream.chunks.clear()
+
+
+def discard_stream_upload(session_id: str, stream: ResponseStream) -> None:
+    if stream.part is None or stream.upload_id is None:
+        return
+    stream.part.close()
+    stream.part = None
+    session_manager.spill.discard_upload(session_id, stream.upload_id)
+
+
+async def finish_upload(session_id: str, upload_id: str) -> Dict[str, Any]:
+    """Move a finished upload into place; returns the ``response`` event fields."""
+    spilled = await asyncio.to_thread(session_manager.spill.finish, session_id, upload_id)
+    SPILLED_BYTES.inc(spilled.size)
+    return {"text": spilled.preview, "body": {"digest": spilled.digest, "size": spilled.size}}
+
+
+async def release_unused_body(session: SessionState, fields: Dict[str, Any]) -> None:
+    """Delete a spilled body no stored response ended up referring to."""
+    digest = fields["body"]["digest"]
+    async with session.lock:
+        if digest not in session.spilled:
+            session_manager.spill.delete(session.session_id, digest)
+
+
+async def abort_stream(session: SessionState, stream: ResponseStream, reason: str) -> None:
+    cancel_stream_flush(stream)
+    discard_stream_upload(session.session_id, stream)
+    async with session.lock:
+        if session.streams.get(stream.client_msg_id) is stream:
+            del session.streams[stream.client_msg_id]
+    await publish_frame(
+        session,
+        {
+            "type": "message_abort",
+            "session_id": session.session_id,
+            "client_msg_id": stream.client_msg_id,
+            "assistant_msg_id": stream.assistant_msg_id,
+            "reason": reason,
+        },
+    )
+
+
+async def handle_response_start(
+    session: SessionState, subscriber: Subscriber, payload: Dict[str, Any]
+) -> None:
+    client_msg_id = payload.get("client_msg_id")
+    if not client_msg_id:
+        send_ws_error(
+            subscriber, "Missing required fields", "response_start requires client_msg_id"
+        )
+        return
+    assistant_msg_id = payload.get("assistant_msg_id") or str(uuid.uuid4())
+    metadata = payload.get("metadata")
+    async with session.lock:
+        already_open = client_msg_id in session.streams
+        if not already_open:
+            session.streams[client_msg_id] = ResponseStream(
+                client_msg_id=client_msg_id,
+                assistant_msg_id=assistant_msg_id,
+                owner=subscriber,
+                metadata=metadata,
+            )
+    if already_open:
+        send_ws_error(subscriber, "Stream already open", client_msg_id)
+        return
+    await publish_frame(
+        session,
+        {
+            "type": "message_start",
+            "session_id": session.session_id,
+            "client_msg_id": client_msg_id,
+            "assistant_msg_id": assistant_msg_id,
+            "metadata": metadata,
+            "ts": current_timestamp_ms(),
+        },
+    )
+
+
+async def handle_response_delta(
+    session: SessionState, subscriber: Subscriber, payload: Dict[str, Any]
+) -> None:
+    client_msg_id = payload.get("client_msg_id")
+    stream = session.streams.get(client_msg_id) if client_msg_id else None
+    if stream is None or stream.owner is not subscriber:
+        send_ws_error(subscriber, "Unknown stream", client_msg_id)
+        return
+    delta = payload.get("delta")
+    if not isinstance(delta, str) or not delta:
+        send_ws_error(
+            subscriber, "Missing required fields", "response_delta requires delta"
+        )
+        return
+    data = delta.encode("utf-8")
+    delta_bytes = len(data)
+    if stream.part is None and stream.size_bytes + delta_bytes > MAX_MESSAGE_BYTES:
+        # Subscribers keep what was streamed so far as a preview; the rest
+        # goes to disk and arrives with the final message as a body reference.
+        cancel_stream_flush(stream)
+        await flush_stream(session, stream)
+        try:
+            await asyncio.to_thread(spill_stream, session.session_id, stream)
+        except OSError as exc:
+            await abort_stream(session, stream, "Spill failed")
+            send_ws_error(subscriber, "Spill failed", str(exc))
+            return
+    if stream.part is not None:
+        try:
+            await asyncio.to_thread(stream.part.write, data)
+        except (UploadTooLarge, OSError) as exc:
+            await abort_stream(session, stream, "Message exceeds size limit")
+            send_ws_error(subscriber, "Message exceeds size limit", str(exc))
+            return
+        stream.size_bytes += delta_bytes
+        return
+    stream.chunks.append(delta)
+    stream.size_bytes += delta_bytes
+    stream.pending.append(delta)
+    stream.pending_bytes += delta_bytes
+    if stream.pending_bytes >= STREAM_FLUSH_BYTES:
+        cancel_stream_flush(stream)
+        await flush_stream(session, stream)
+    elif stream.flush_task is None:
+        stream.flush_task = asyncio.create_task(delayed_stream_flush(session, stream))
+
+
+async def handle_response_end(
+    session: SessionState, subscriber: Subscriber, payload: Dict[str, Any]
+) -> None:
+    client_msg_id = payload.get("client_msg_id")
+    async with session.lock:
+        stream = session.streams.get(client_msg_id) if client_msg_id else None
+        if stream is not None and stream.owner is subscriber:
+            del session.streams[client_msg_id]
+        else:
+            stream = None
+    if stream is None:
+        send_ws_error(subscriber, "Unknown stream", client_msg_id)
+        return
+    cancel_stream_flush(stream)
+    await flush_stream(session, stream)
+    # A final ``text`` replaces the assembled deltas, e.g. after the agent
+    # rewrote part of its answer.
+    fields: Dict[str, Any]
+    if payload.get("text") or stream.part is None:
+        discard_stream_upload(session.session_id, stream)
+        fields = {"text": payload.get("text") or "".join(stream.chunks)}
+    else:
+        stream.part.close()
+        try:
+            fields = await finish_upload(session.session_id, stream.upload_id)
+        except OSError as exc:
+            session_manager.spill.discard_upload(session.session_id, stream.upload_id)
+            send_ws_error(subscriber, "Spill failed", str(exc))
+            return
+    if not fields["text"]:
+        send_ws_error(subscriber, "Missing required fields", "response has no text")
+        return
+    if exceeds_bytes(fields["text"], MAX_MESSAGE_BYTES):
+        send_ws_error(
+            subscriber,
+            "Message exceeds size limit",
+            f"text exceeds {MAX_MESSAGE_BYTES} bytes",
+        )
+        return
+    await publish_event(
+        {
+            "type": "response",
+            "session_id": session.session_id,
+            "client_msg_id": client_msg_id,
+            "assistant_msg_id": stream.assistant_msg_id,
+            **fields,
+            "metadata": payload.get("metadata", stream.metadata),
+            "ts": current_timestamp_ms(),
+            "strict": False,
+        }
+    )
+    if "body" in fields:
+        await release_unused_body(session, fields)
+    subscriber.send(
+        {
+            "type": "ack",
+            "client_msg_id": client_msg_id,
+            "assistant_msg_id": stream.assistant_msg_id,
+        }
+    )
+
+
+def ws_write_cost(msg_type: Any, payload: Dict[str, Any]) -> int:
+    """Rate-limit tokens charged for a client frame; 0 for frames that are free.
+
+    A streamed response is charged once, at ``response_start``.
+    """
+    if msg_type in ("response", "response_start"):
+        return 1
+    if msg_type == "response_batch" and isinstance(payload.get("responses"), list):
+        return len(payload["responses"])
+    return 0
+
+
+async def reject_websocket(
+    websocket: WebSocket, protocol: Optional[str], exc: HTTPException
+) -> None:
+    """Tell an accepted WebSocket why it is refused, then close it.
+
+    A relay that is draining closes with DRAIN_CLOSE_CODE, which tells
+    clients to reconnect shortly rather than back off.
+    """
+    frame = Frame({"type": "error", **exc.detail})
+    with contextlib.suppress(RuntimeError, WebSocketDisconnect, OSError):
+        if protocol is None:
+            await websocket.send_text(frame.text)
+        else:
+            await websocket.send_bytes(frame.binary(protocol))
+        draining = exc.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+        await websocket.close(code=DRAIN_CLOSE_CODE if draining else ADMISSION_CLOSE_CODE)
+
+
+STREAM_HANDLERS = {
+    "response_start": handle_response_start,
+    "response_delta": handle_response_delta,
+    "response_end": handle_response_end,
+}
+
+
+@app.websocket("/ws/{session_id}")
+async def session_websocket(websocket: WebSocket, session_id: str) -> None:
+    # Auto-create session if it doesn't exist
+    session = await get_session(session_id, create=True)
+    
+    protocol = wire.negotiate(websocket.scope.get("subprotocols", []))
+    await websocket.accept(subprotocol=protocol)
+    try:
+        ensure_accepting()
+        ensure_capacity(
+            "subscribers", len(session.subscribers), MAX_SUBSCRIBERS_PER_SESSION, session_id
+        )
+    except HTTPException as exc:
+        await reject_websocket(websocket, protocol, exc)
+        return
+    print(f"\n🔌 WebSocket connected for session: {session_id} ({protocol or 'json'})")
+    client = client_address(websocket)
+    
+    subscriber = Subscriber(websocket, protocol=protocol)
+    subscriber.blob_refs = websocket.query_params.get("blobs") == "ref"
+    subscriber.start()
+    resume_from = parse_last_seq(websocket.query_params.get("last_seq"))
+    await attach_subscriber(session, subscriber, resume_from)
+    
+    ping_task = asyncio.create_task(websocket_pinger(subscriber))
+    try:
+        while True:
+            try:
+                payload = await receive_ws_payload(websocket, protocol)
+            except WebSocketDisconnect:
+                break
+            except json.JSONDecodeError:
+                subscriber.send(
+                    {
+                        "type": "error",
+                        "error": "Invalid JSON",
+                        "details": "WebSocket payload must be valid JSON",
+                    }
+                )
+                continue
+            except ValueError as exc:
+                send_ws_error(subscriber, "Invalid frame", str(exc))
+                continue
+            if payload is None:
+                continue
+            
             msg_type = payload.get("type")
             
             if msg_type == "pong":
                 continue
             
+            cost = ws_write_cost(msg_type, payload)
+            if cost:
+                try:
+                    admit(session_id, client, cost)
+                except HTTPException as exc:
+                    send_ws_error(subscriber, exc.detail["error"], exc.detail["details"])
+                    continue
+            
+            stream_handler = STREAM_HANDLERS.get(msg_type)
+            if stream_handler is not None:
+                try:
+                    await stream_handler(session, subscriber, payload)
+                except HTTPException as exc:
+                    send_ws_error(subscriber, exc.detail["error"], exc.detail["details"])
+                continue
+            
+            if msg_type == "response_batch":
+                responses = payload.get("responses")
+                if not isinstance(responses, list) or not responses:
+                    send_ws_error(
+                        subscriber,
+                        "Missing required fields",
+                        "response_batch requires a non-empty responses array",
+                    )
+                    continue
+                if len(responses) > MAX_BATCH_ITEMS:
+                    send_ws_error(
+                        subscriber,
+                        "Batch too large",
+                        f"response_batch accepts at most {MAX_BATCH_ITEMS} responses",
+                    )
+                    continue
+                ts = current_timestamp_ms()
+                results: List[Optional[Dict[str, Any]]] = []
+                items = []
+                for item in responses:
+                    try:
+                        items.append(response_batch_item(item, ts))
+                        results.append(None)
+                    except ValueError as exc:
+                        results.append({"status": "invalid", "error": str(exc)})
+                try:
+                    stored = iter(
+                        await publish_response_batch(session_id, items, strict=False)
+                        if items
+                        else []
+                    )
+                except HTTPException as exc:
+                    send_ws_error(subscriber, exc.detail["error"], exc.detail["details"])
+                    continue
+                subscriber.send(
+                    {
+                        "type": "batch_ack",
+                        "results": [result or next(stored) for result in results],
+                    }
+                )
+                continue
+            
             if msg_type == "response":
                 # Received a response from Cursor via WebSocket
                 print(f"\n{'='*60}")
@@ -457,7 +2971,7 @@ async def session_websocket(websocket: WebSocket, session_id: str) -> None:
                     metadata = payload.get('metadata')
                     
                     if not client_msg_id or not text:
-                        await websocket.send_json({
+                        subscriber.send({
                             "type": "error",
                             "error": "Missing required fields",
                             "details": "response requires client_msg_id and text"
@@ -466,31 +2980,21 @@ async def session_websocket(websocket: WebSocket, session_id: str) -> None:
                     
                     assistant_msg_id = str(uuid.uuid4())
                     
-                    async with session.lock:
-                        # Check if already exists
-                        if assistant_msg_id in session.responses_by_assistant:
-                            continue
-                        
-                        ts = current_timestamp_ms()
-                        assistant_message = AssistantMessage(
-                            session_id=session_id,
-                            assistant_msg_id=assistant_msg_id,
-                            client_msg_id=client_msg_id,
-                            text=text,
-                            metadata=metadata,
-                            ts=ts,
-                        )
-                        session.responses_by_client[client_msg_id] = assistant_message
-                        session.responses_by_assistant[assistant_msg_id] = assistant_message
-                        session.history.append(HistoryEntry(type="assistant", data=assistant_message))
-                        
-                        # Notify anyone waiting for prompts
-                        session.condition.notify_all()
+                    # Stored and broadcast to all subscribers by apply_response_event
+                    await publish_event(
+                        {
+                            "type": "response",
+                            "session_id": session_id,
+                            "client_msg_id": client_msg_id,
+                            "assistant_msg_id": assistant_msg_id,
+                            "text": text,
+                            "metadata": metadata,
+                            "ts": current_timestamp_ms(),
+                            "strict": False,
+                        }
+                    )
                     
-                    # Broadcast to other subscribers
-                    await broadcast_response(session, assistant_message)
-                    
-                    await websocket.send_json({
+                    subscriber.send({
                         "type": "ack",
                         "client_msg_id": client_msg_id,
                         "assistant_msg_id": assistant_msg_id
@@ -498,7 +3002,7 @@ async def session_websocket(websocket: WebSocket, session_id: str) -> None:
                     
                 except Exception as e:
                     print(f"❌ Error storing response: {e}")
-                    await websocket.send_json({
+                    subscriber.send({
                         "type": "error",
                         "error": "Failed to store response",
                         "details": str(e)
@@ -507,7 +3011,7 @@ async def session_websocket(websocket: WebSocket, session_id: str) -> None:
                 continue
             
             # Unknown message type
-            await websocket.send_json(
+            subscriber.send(
                 {
                     "type": "error",
                     "error": "Unsupported message type",
@@ -518,43 +3022,437 @@ async def session_websocket(websocket: WebSocket, session_id: str) -> None:
         ping_task.cancel()
         with contextlib.suppress(asyncio.CancelledError):
             await ping_task
+        await subscriber.aclose()
         async with session.lock:
-            session.subscribers.discard(websocket)
+            session.subscribers.discard(subscriber)
+            orphaned = [
+                stream for stream in session.streams.values() if stream.owner is subscriber
+            ]
+        for stream in orphaned:
+            await abort_stream(session, stream, "Producer disconnected")
         print(f"🔌 WebSocket disconnected for session: {session_id}")
 
 
+@app.websocket("/ws")
+async def multiplexed_websocket(websocket: WebSocket) -> None:
+    """One receive-only connection for many sessions.
+
+    The client sends ``subscribe`` (with ``session_id`` and an optional
+    ``last_seq`` to resume) and ``unsubscribe`` frames. Every session frame
+    arrives wrapped as ``{"type":"event","session_id":...,"event":<frame>}``.
+    """
+    protocol = wire.negotiate(websocket.scope.get("subprotocols", []))
+    await websocket.accept(subprotocol=protocol)
+    try:
+        ensure_accepting()
+    except HTTPException as exc:
+        await reject_websocket(websocket, protocol, exc)
+        return
+    subscriber = Subscriber(websocket, protocol=protocol)
+    subscriber.blob_refs = websocket.query_params.get("blobs") == "ref"
+    subscriber.start()
+    channels: Dict[str, Tuple[SessionState, SessionChannel]] = {}
+    ping_task = asyncio.create_task(websocket_pinger(subscriber))
+    try:
+        while True:
+            try:
+                payload = await receive_ws_payload(websocket, protocol)
+            except WebSocketDisconnect:
+                break
+            except ValueError as exc:
+                send_ws_error(subscriber, "Invalid frame", str(exc))
+                continue
+            if payload is None:
+                continue
+            msg_type = payload.get("type")
+            if msg_type == "pong":
+                continue
+            if msg_type not in ("subscribe", "unsubscribe"):
+                send_ws_error(
+                    subscriber,
+                    "Unsupported message type",
+                    f"Unsupported type: {msg_type}; /ws only takes subscribe and unsubscribe",
+                )
+                continue
+            session_id = payload.get("session_id")
+            # Stripped like the session_id of /prompt and /response bodies, so
+            # " s" and "s" are the same session here too.
+            if isinstance(session_id, str):
+                session_id = session_id.strip()
+            if not isinstance(session_id, str) or not session_id:
+                send_ws_error(
+                    subscriber, "Missing required fields", f"{msg_type} requires session_id"
+                )
+                continue
+            if msg_type == "unsubscribe":
+                entry = channels.pop(session_id, None)
+                if entry is not None:
+                    session, channel = entry
+                    channel.closed = True
+                    session.subscribers.discard(channel)
+                subscriber.send({"type": "unsubscribed", "session_id": session_id})
+                continue
+            if session_id in channels:
+                subscriber.send({"type": "subscribed", "session_id": session_id})
+                continue
+            if len(channels) >= MAX_MULTIPLEXED_SESSIONS:
+                send_ws_error(
+                    subscriber,
+                    "Too many subscriptions",
+                    f"a connection may subscribe to at most {MAX_MULTIPLEXED_SESSIONS} sessions",
+                )
+                continue
+            session = await get_session(session_id, create=True)
+            try:
+                ensure_capacity(
+                    "subscribers", len(session.subscribers), MAX_SUBSCRIBERS_PER_SESSION, session_id
+                )
+            except HTTPException as exc:
+                send_ws_error(subscriber, exc.detail["error"], exc.detail["details"])
+                continue
+            channel = SessionChannel(session_id, subscriber)
+            channels[session_id] = (session, channel)
+            subscriber.send({"type": "subscribed", "session_id": session_id})
+            await attach_subscriber(session, channel, parse_last_seq(payload.get("last_seq")))
+    finally:
+        ping_task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await ping_task
+        await subscriber.aclose()
+        for session, channel in channels.values():
+            channel.closed = True
+            session.subscribers.discard(channel)
+
+
+@app.get("/events/{session_id}")
+async def session_events(
+    request: Request,
+    session_id: str,
+    last_seq: Optional[int] = Query(None, ge=0),
+    blobs: Literal["inline", "ref"] = Query("inline"),
+) -> StreamingResponse:
+    """Receive-only Server-Sent Events version of ``/ws/{session_id}``.
+
+    Browsers resume by sending ``Last-Event-ID`` on reconnect; it takes
+    precedence over ``last_seq``, which serves the first connection.
+    """
+    session = await get_session(session_id, create=True)
+    ensure_accepting()
+    ensure_capacity(
+        "subscribers", len(session.subscribers), MAX_SUBSCRIBERS_PER_SESSION, session_id
+    )
+    resume_from = parse_last_seq(request.headers.get("last-event-id"))
+    if resume_from is None:
+        resume_from = last_seq
+
+    async def stream() -> AsyncIterator[bytes]:
+        subscriber = EventStreamSubscriber()
+        subscriber.blob_refs = blobs == "ref"
+        await attach_subscriber(session, subscriber, resume_from)
+        try:
+            async for chunk in subscriber.events():
+                yield chunk
+        finally:
+            subscriber.close()
+            session.subscribers.discard(subscriber)
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        # Keep reverse proxies from buffering the stream.
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @app.get("/messages/{session_id}")
 async def get_messages(
     session_id: str,
     limit: int = Query(DEFAULT_HISTORY_LIMIT, ge=1, le=MAX_HISTORY_LIMIT),
     offset: int = Query(0, ge=0),
     since: Optional[int] = Query(None, ge=0),
+    after_seq: Optional[int] = Query(None, ge=0),
+    before_seq: Optional[int] = Query(None, ge=1),
+    order: Literal["asc", "desc"] = Query("asc"),
+    # Reference form is the stored encoding, so it costs no re-encode.
+    blobs: Literal["inline", "ref"] = Query("ref"),
+    changes_since: Optional[int] = Query(None, ge=0),
+    if_none_match: Optional[str] = Header(None),
+) -> Response:
+    session = await get_session(session_id)
+    # Checked before taking the lock: an unchanged history costs no snapshot.
+    if etag_matches(if_none_match, session.history.etag):
+        return not_modified(session.history.etag)
+    reset = None
+    async with session.lock:
+        history = session.history
+        etag = history.etag
+        if changes_since is not None:
+            # Entries never change once stored, so the changes since a
+            # version are the entries after it.
+            oldest = history.seqs[0] if len(history) else history.next_seq
+            reset = changes_since > history.last_seq or changes_since + 1 < oldest
+            if changes_since <= history.last_seq:
+                after_seq = max(after_seq or 0, changes_since)
+        sliced, total = session.history.page(
+            after_seq=after_seq,
+            before_seq=before_seq,
+            since=since,
+            offset=offset,
+            limit=limit,
+            newest_first=order == "desc",
+        )
+        last_seq = session.history.last_seq
+        if blobs == "ref":
+            bodies = [record.encoded for _, record in sliced]
+        else:
+            bodies = [inline_encoded(session, record) for _, record in sliced]
+    meta = {
+        "session_id": session_id,
+        "total": total,
+        "limit": limit,
+        "offset": offset,
+        "last_seq": last_seq,
+        "has_more": offset + len(sliced) < total,
+    }
+    if reset is not None:
+        meta["reset"] = reset
+    head = dumps_bytes(meta)
+    messages = b",".join(
+        b'{"type":"%s","seq":%d,"data":%s}' % (record.kind.encode(), seq, body)
+        for (seq, record), body in zip(sliced, bodies)
+    )
+    return json_bytes_response(head[:-1] + b',"messages":[' + messages + b"]}", etag)
+
+
+@app.get("/search/{session_id}")
+async def search_messages(
+    session_id: str,
+    q: str = Query(..., min_length=1, max_length=MAX_SEARCH_QUERY_CHARS),
+    limit: int = Query(DEFAULT_SEARCH_LIMIT, ge=1, le=MAX_HISTORY_LIMIT),
+    offset: int = Query(0, ge=0),
 ) -> Dict[str, Any]:
-    session = sessions.get(session_id)
-    if not session:
-        raise_http_error(status.HTTP_404_NOT_FOUND, "Session not found", session_id)
+    """Ranked full-text search over a session's prompts and responses."""
+    terms = tokenize(q)
+    if not terms:
+        raise_http_error(status.HTTP_400_BAD_REQUEST, "Invalid query", "q has no searchable words")
+    session = await get_session(session_id)
     async with session.lock:
-        history_snapshot = list(session.history)
-    if since is not None:
-        history_snapshot = [h for h in history_snapshot if h.data.ts > since]
-    total = len(history_snapshot)
-    sliced = history_snapshot[offset : offset + limit]
-    messages = [
-        {
-            "type": entry.type,
-            "data": entry.data.dict(),
+        if session.search is None:
+            session.search = build_search_index(session.history)
+        total, ranked = session.search.search(q, limit, offset)
+        found = [(session.history.get(seq), score) for seq, score in ranked]
+    hits = []
+    for record, score in found:
+        if record is None:
+            continue
+        data = loads(record.encoded)
+        hit = {
+            "type": record.kind,
+            "seq": record.seq,
+            "score": round(score, 4),
+            "client_msg_id": record.client_msg_id,
+            "ts": record.ts,
+            "snippet": snippet(search_text(record, data), terms),
         }
-        for entry in sliced
-    ]
+        if isinstance(record, AssistantRecord):
+            hit["assistant_msg_id"] = record.assistant_msg_id
+        hits.append(hit)
     return {
         "session_id": session_id,
-        "messages": messages,
+        "query": q,
         "total": total,
         "limit": limit,
         "offset": offset,
+        "has_more": offset + len(ranked) < total,
+        "hits": hits,
+    }
+
+
+def search_text(record: StoredRecord, data: Dict[str, Any]) -> str:
+    text = data.get("prompt") if isinstance(record, PromptRecord) else data.get("text")
+    return text if isinstance(text, str) else ""
+
+
+def build_search_index(history: SessionHistory) -> SearchIndex:
+    index = SearchIndex()
+    for record in history.records:
+        data = loads(record.encoded)
+        index.add(record.seq, document_text(search_text(record, data), data.get("metadata")))
+    return index
+
+
+def all_sessions() -> List[SessionState]:
+    return list(session_manager.sessions.values())
+
+
+metrics.gauge("relay_sessions_active", "Sessions held in memory.", lambda: len(session_manager))
+metrics.gauge(
+    "relay_session_memory_bytes",
+    "Estimated bytes of stored messages across sessions.",
+    lambda: session_manager.total_bytes,
+)
+metrics.gauge(
+    "relay_subscribers",
+    "Connected WebSocket and event stream subscribers.",
+    lambda: sum(len(session.subscribers) for session in all_sessions()),
+)
+metrics.gauge(
+    "relay_history_entries",
+    "History entries held in memory.",
+    lambda: sum(len(session.history) for session in all_sessions()),
+)
+metrics.distribution(
+    "relay_session_subscribers",
+    "WebSocket subscribers per session.",
+    SIZE_BUCKETS,
+    lambda: (len(session.subscribers) for session in all_sessions()),
+)
+metrics.distribution(
+    "relay_session_history_entries",
+    "History entries per session.",
+    SIZE_BUCKETS,
+    lambda: (len(session.history) for session in all_sessions()),
+)
+metrics.gauge(
+    "relay_subscriber_queued_frames",
+    "Frames waiting in subscriber send queues.",
+    lambda: sum(sub.depth for session in all_sessions() for sub in session.subscribers),
+)
+for _name in fanout_stats:
+    metrics.gauge(
+        f"relay_fanout_{_name}_total",
+        f"Subscriber queue {_name.replace('_', ' ')}.",
+        lambda name=_name: fanout_stats[name],
+        kind="counter",
+    )
+for _reason in session_manager.evictions:
+    metrics.gauge(
+        f"relay_session_evictions_{_reason}_total",
+        f"Sessions evicted ({_reason}).",
+        lambda reason=_reason: session_manager.evictions[reason],
+        kind="counter",
+    )
+metrics.gauge(
+    "relay_startup_seconds",
+    "Time from process start to serving traffic.",
+    lambda: lifecycle_stats["startup_seconds"] or 0,
+)
+metrics.gauge(
+    "relay_draining",
+    "1 while the relay is draining for a restart.",
+    lambda: int(lifecycle_stats["draining"]),
+)
+metrics.gauge(
+    "relay_history_entries_trimmed_total",
+    "History entries trimmed by the per-session cap.",
+    lambda: session_manager.trimmed_entries,
+    kind="counter",
+)
+
+
+@app.get("/blobs/{session_id}/{digest}")
+async def get_blob(session_id: str, digest: str, request: Request) -> Response:
+    session = await get_session(session_id)
+    body = session.blobs.get(digest)
+    if body is None:
+        raise_http_error(404, "Blob not found", f"No blob {digest} in session {session_id}")
+    # Content-addressed: a digest always names the same body.
+    headers = {"ETag": f'"{digest}"', "Cache-Control": "public, max-age=31536000, immutable"}
+    if request.headers.get("if-none-match") == headers["ETag"]:
+        return Response(status_code=304, headers=headers)
+    return Response(body, media_type="text/plain; charset=utf-8", headers=headers)
+
+
+def parse_byte_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """The ``[start, end)`` a single-range ``Range`` header asks for.
+
+    Returns None to send the whole body: no header, or one we do not support,
+    which RFC 9110 allows ignoring. Raises ``ValueError`` when unsatisfiable.
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    first, _, last = header[len("bytes=") :].strip().partition("-")
+    try:
+        start = int(first) if first else None
+        end = int(last) if last else None
+    except ValueError:
+        return None
+    if start is None:
+        if end is None:
+            return None
+        if end == 0 or size == 0:
+            raise ValueError("empty suffix range")
+        return max(size - end, 0), size
+    if end is not None and end < start:
+        return None
+    if start >= size:
+        raise ValueError("range starts past the end")
+    return start, size if end is None else min(end + 1, size)
+
+
+@app.get("/bodies/{session_id}/{digest}")
+async def get_body(session_id: str, digest: str, request: Request) -> Response:
+    """A spilled response body, whole or one byte range of it."""
+    session = await get_session(session_id)
+    size = session_manager.spill.size(session_id, digest) if digest in session.spilled else None
+    if size is None:
+        raise_http_error(404, "Body not found", f"No body {digest} in session {session_id}")
+    headers = {
+        "ETag": f'"{digest}"',
+        "Cache-Control": "public, max-age=31536000, immutable",
+        "Accept-Ranges": "bytes",
     }
+    if etag_matches(request.headers.get("if-none-match"), headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+    try:
+        byte_range = parse_byte_range(request.headers.get("range"), size)
+    except ValueError:
+        headers["Content-Range"] = f"bytes */{size}"
+        return Response(status_code=status.HTTP_416_RANGE_NOT_SATISFIABLE, headers=headers)
+    start, end = byte_range or (0, size)
+    if byte_range is not None:
+        headers["Content-Range"] = f"bytes {start}-{end - 1}/{size}"
+    headers["Content-Length"] = str(end - start)
+    # A sync iterator, so Starlette reads the mapped file in its threadpool.
+    return StreamingResponse(
+        session_manager.spill.iter_range(session_id, digest, start, end),
+        status_code=status.HTTP_206_PARTIAL_CONTENT if byte_range else status.HTTP_200_OK,
+        media_type="text/plain; charset=utf-8",
+        headers=headers,
+    )
+
+
+@app.post("/admin/drain")
+async def drain_relay(
+    request: Request, timeout: float = Query(DRAIN_TIMEOUT_SECONDS, ge=0, le=300)
+) -> Dict[str, Any]:
+    """Drain every relay process ahead of a restart; see ``drain``.
+
+    Enabled by RELAY_ADMIN_TOKEN, sent as ``Authorization: Bearer <token>``.
+    Answers once this process has drained.
+    """
+    authorization = request.headers.get("authorization", "")
+    if not ADMIN_TOKEN or not hmac.compare_digest(
+        authorization.encode("utf-8"), f"Bearer {ADMIN_TOKEN}".encode("utf-8")
+    ):
+        raise_http_error(status.HTTP_403_FORBIDDEN, "Forbidden", "admin token required")
+    await publish_event({"type": "drain", "timeout": timeout})
+    result = await start_drain(timeout)
+    return {"ok": True, **result}
+
+
+@app.get("/metrics")
+async def metrics_endpoint() -> PlainTextResponse:
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
 
 
 @app.get("/healthz")
 async def healthz() -> Dict[str, Any]:
-    return {"ok": True, "timestamp": current_timestamp_ms()}
+    return {
+        "ok": True,
+        "timestamp": current_timestamp_ms(),
+        "sessions": session_manager.stats(),
+        "fanout": fanout_metrics(),
+        "bus": event_bus.stats(),
+        "lifecycle": lifecycle_stats,
+    }
@@ -0,0 +1,192 @@
+"""Binary snapshots of in-memory sessions, for restarts that keep state.
+
+At shutdown the relay can write every session's history, the prompts still
+pending beyond it and its blob bodies to one file. At startup the file is
+memory-mapped and only its index is read, so the relay serves traffic at
+once; a session is decoded the first time it is accessed, exactly as if it
+were reloaded from a ``SessionStore``.
+
+Layout, little-endian::
+
+    session block* | index | footer
+
+- A session block is ``BLOCK`` (row and blob counts), then each row as
+  ``ROW`` followed by its client_msg_id, assistant_msg_id and encoded
+  record, then each blob as its 32-byte digest, ``LENGTH`` and body.
+- The index has one entry per session: ``LENGTH``, the session id, then
+  ``SPAN`` (the block's offset and length).
+- The footer is ``FOOTER`` (index offset and session count) and ``MAGIC``.
+
+Blocks hold no file offsets, so a session nobody touched since the last
+restart is copied into the next snapshot verbatim.
+
+A snapshot is restored once. At startup it is renamed aside for the
+running server (``claim_snapshot``), so if the relay crashes instead of writing a
+new one, the next start is empty rather than rolled back to stale state.
+"""
+from __future__ import annotations
+
+import glob
+import mmap
+import multiprocessing
+import os
+import struct
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from storage import StoredRow
+
+MAGIC = b"RELAYSN1"
+BLOCK = struct.Struct("<II")
+# seq, ts, kind, then the byte lengths of client_msg_id, assistant_msg_id
+# (NO_ID for a prompt) and the encoded record.
+ROW = struct.Struct("<qqBIII")
+LENGTH = struct.Struct("<I")
+SPAN = struct.Struct("<QQ")
+FOOTER = struct.Struct("<QI")
+NO_ID = 0xFFFFFFFF
+KIND_CODES = {"prompt": 0, "assistant": 1}
+KINDS = {code: kind for kind, code in KIND_CODES.items()}
+
+
+def encode_session(rows: Iterable[StoredRow], blobs: Dict[str, bytes]) -> bytes:
+    parts: List[bytes] = []
+    count = 0
+    for seq, kind, client_msg_id, assistant_msg_id, ts, body in rows:
+        client_id = client_msg_id.encode("utf-8")
+        assistant_id = b"" if assistant_msg_id is None else assistant_msg_id.encode("utf-8")
+        parts.append(
+            ROW.pack(
+                seq,
+                ts,
+                KIND_CODES[kind],
+                len(client_id),
+                NO_ID if assistant_msg_id is None else len(assistant_id),
+                len(body),
+            )
+        )
+        parts += (client_id, assistant_id, body)
+        count += 1
+    for digest, body in blobs.items():
+        parts += (bytes.fromhex(digest), LENGTH.pack(len(body)), body)
+    return BLOCK.pack(count, len(blobs)) + b"".join(parts)
+
+
+def decode_session(data: "mmap.mmap", offset: int) -> Tuple[List[StoredRow], Dict[str, bytes]]:
+    row_count, blob_count = BLOCK.unpack_from(data, offset)
+    offset += BLOCK.size
+    rows: List[StoredRow] = []
+    for _ in range(row_count):
+        seq, ts, kind, client_len, assistant_len, body_len = ROW.unpack_from(data, offset)
+        offset += ROW.size
+        client_msg_id = data[offset : offset + client_len].decode("utf-8")
+        offset += client_len
+        assistant_msg_id = None
+        if assistant_len != NO_ID:
+            assistant_msg_id = data[offset : offset + assistant_len].decode("utf-8")
+            offset += assistant_len
+        body = data[offset : offset + body_len]
+        offset += body_len
+        rows.append((seq, KINDS[kind], client_msg_id, assistant_msg_id, ts, body))
+    blobs: Dict[str, bytes] = {}
+    for _ in range(blob_count):
+        digest = data[offset : offset + 32].hex()
+        (length,) = LENGTH.unpack_from(data, offset + 32)
+        offset += 32 + LENGTH.size
+        blobs[digest] = data[offset : offset + length]
+        offset += length
+    return rows, blobs
+
+
+def write_snapshot(path: str, blocks: Iterable[Tuple[str, bytes]]) -> Tuple[int, int]:
+    """Write encoded session blocks to ``path`` atomically.
+
+    Returns the number of sessions and bytes written. Blocking; run it in a
+    thread.
+    """
+    temp = f"{path}.{os.getpid()}.tmp"
+    index: List[bytes] = []
+    with open(temp, "wb") as f:
+        offset = 0
+        for session_id, block in blocks:
+            f.write(block)
+            name = session_id.encode("utf-8")
+            index.append(LENGTH.pack(len(name)) + name + SPAN.pack(offset, len(block)))
+            offset += len(block)
+        f.write(b"".join(index))
+        f.write(FOOTER.pack(offset, len(index)) + MAGIC)
+        size = f.tell()
+        f.flush()
+        os.fsync(f.fileno())
+    # Every relay process writes its own copy; they hold the same sessions.
+    os.replace(temp, path)
+    return len(index), size
+
+
+def claim_snapshot(path: str) -> Optional[str]:
+    """Take the snapshot at ``path`` for this server; return where it now is.
+
+    The first process of a server renames it to a name keyed by the server's
+    pid (the supervisor's, for uvicorn workers), and its other workers open it
+    from there. Claims left behind by a server that crashed are deleted.
+    """
+    parent = multiprocessing.parent_process()
+    claimed = f"{path}.{parent.pid if parent is not None else os.getpid()}.restoring"
+    for stale in glob.glob(f"{glob.escape(path)}.*.restoring"):
+        if stale != claimed:
+            release_snapshot(stale)
+    try:
+        os.rename(path, claimed)
+    except FileNotFoundError:
+        pass
+    return claimed if os.path.exists(claimed) else None
+
+
+def release_snapshot(path: str) -> None:
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+class SnapshotReader:
+    """A memory-mapped snapshot whose sessions are decoded on demand."""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        with open(path, "rb") as f:
+            self.size = os.fstat(f.fileno()).st_size
+            if self.size < FOOTER.size + len(MAGIC):
+                raise ValueError(f"{path} is not a relay snapshot")
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.data[-len(MAGIC) :] != MAGIC:
+            self.data.close()
+            raise ValueError(f"{path} is not a relay snapshot")
+        index_offset, count = FOOTER.unpack_from(self.data, self.size - len(MAGIC) - FOOTER.size)
+        self.index: Dict[str, Tuple[int, int]] = {}
+        offset = index_offset
+        for _ in range(count):
+            (length,) = LENGTH.unpack_from(self.data, offset)
+            offset += LENGTH.size
+            session_id = self.data[offset : offset + length].decode("utf-8")
+            offset += length
+            self.index[session_id] = SPAN.unpack_from(self.data, offset)
+            offset += SPAN.size
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def pop(self, session_id: str) -> Optional[Tuple[List[StoredRow], Dict[str, bytes]]]:
+        """Decode a session and forget it, so it is restored at most once."""
+        span = self.index.pop(session_id, None)
+        if span is None:
+            return None
+        return decode_session(self.data, span[0])
+
+    def remaining(self, exclude: Set[str]) -> Iterator[Tuple[str, bytes]]:
+        """The raw blocks of sessions not yet restored, except ``exclude``."""
+        for session_id, (offset, length) in self.index.items():
+            if session_id not in exclude:
+                yield session_id, self.data[offset : offset + length]
+
+    def close(self) -> None:
+        self.data.close()
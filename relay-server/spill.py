@@ -0,0 +1,203 @@
+"""Disk-backed bodies for responses too large to keep inline.
+
+A large body arrives in pieces, as ``/uploads`` chunks over HTTP or as the
+``response_delta`` frames of a long WebSocket stream. Each piece is appended
+to a part file as it comes, so the relay never holds the whole body in one
+string. On completion the part file is hashed and renamed to its SHA-256
+digest under the session's directory. The stored response keeps a preview as
+``text`` plus a ``body`` reference, and ``GET /bodies/...`` serves any byte
+range of the body through ``mmap``.
+
+The spill directory is shared by every relay process on the machine, so an
+upload may continue, and a body be read, on any worker. An upload's part
+file is named after its session as well as its id, so it can only be
+continued or completed through the session that started it.
+"""
+from __future__ import annotations
+
+import hashlib
+import mmap
+import os
+import re
+import time
+import uuid
+from typing import BinaryIO, Iterator, NamedTuple, Optional
+
+READ_CHUNK_BYTES = 64 * 1024
+UPLOAD_ID_RE = re.compile(r"[0-9a-f]{32}")
+DIGEST_RE = re.compile(r"[0-9a-f]{64}")
+# Finds the body reference, always the last field, in an encoded record
+# without decoding it.
+BODY_REF_RE = re.compile(rb',"body":\{"digest":"([0-9a-f]{64})","size":\d+\}\}$')
+
+
+def body_ref(encoded: bytes) -> Optional[str]:
+    """Digest of the spilled body an encoded record refers to, if any."""
+    if not encoded.endswith(b"}}"):
+        return None
+    match = BODY_REF_RE.search(encoded)
+    return match.group(1).decode("ascii") if match else None
+
+
+def utf8_preview(data: bytes, limit: int) -> str:
+    """At most ``limit`` bytes of ``data``, cut on a character boundary."""
+    return data[:limit].decode("utf-8", "ignore")
+
+
+class UploadTooLarge(ValueError):
+    pass
+
+
+class UploadOffsetMismatch(ValueError):
+    def __init__(self, size: int) -> None:
+        super().__init__(f"upload is at offset {size}")
+        self.size = size
+
+
+class SpilledBody(NamedTuple):
+    digest: str
+    size: int
+    preview: str
+
+
+class PartFile:
+    """An upload in progress, appended to in place."""
+
+    def __init__(self, path: str, max_bytes: int) -> None:
+        self.path = path
+        self.max_bytes = max_bytes
+        self.file: BinaryIO = open(path, "r+b")
+        self.size = self.file.seek(0, os.SEEK_END)
+
+    def write(self, data: bytes) -> None:
+        if self.size + len(data) > self.max_bytes:
+            raise UploadTooLarge(f"body exceeds {self.max_bytes} bytes")
+        self.file.write(data)
+        self.size += len(data)
+
+    def truncate(self, size: int) -> None:
+        self.file.truncate(size)
+        self.file.seek(size)
+        self.size = size
+
+    def close(self) -> None:
+        self.file.close()
+
+
+class SpillStore:
+    def __init__(self, directory: str, max_bytes: int, preview_bytes: int) -> None:
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.preview_bytes = preview_bytes
+        self.uploads = os.path.join(directory, "uploads")
+
+    @staticmethod
+    def session_name(session_id: str) -> str:
+        # Session ids are arbitrary strings; hash them into safe names.
+        return hashlib.sha256(session_id.encode("utf-8")).hexdigest()[:32]
+
+    def session_dir(self, session_id: str) -> str:
+        return os.path.join(self.directory, self.session_name(session_id))
+
+    def body_path(self, session_id: str, digest: str) -> str:
+        return os.path.join(self.session_dir(session_id), digest)
+
+    def part_path(self, session_id: str, upload_id: str) -> str:
+        if not UPLOAD_ID_RE.fullmatch(upload_id):
+            raise FileNotFoundError(upload_id)
+        return os.path.join(self.uploads, f"{self.session_name(session_id)}.{upload_id}.part")
+
+    def create_upload(self, session_id: str) -> str:
+        os.makedirs(self.uploads, exist_ok=True)
+        upload_id = uuid.uuid4().hex
+        open(self.part_path(session_id, upload_id), "xb").close()
+        return upload_id
+
+    def open_upload(
+        self, session_id: str, upload_id: str, offset: Optional[int] = None
+    ) -> PartFile:
+        """Open an upload for appending; ``FileNotFoundError`` if the session
+        has no such upload.
+
+        With ``offset``, raises ``UploadOffsetMismatch`` unless the upload is
+        exactly that long, so a retried chunk is never appended twice.
+        """
+        part = PartFile(self.part_path(session_id, upload_id), self.max_bytes)
+        if offset is not None and offset != part.size:
+            part.close()
+            raise UploadOffsetMismatch(part.size)
+        return part
+
+    def discard_upload(self, session_id: str, upload_id: str) -> None:
+        try:
+            os.unlink(self.part_path(session_id, upload_id))
+        except FileNotFoundError:
+            pass
+
+    def finish(self, session_id: str, upload_id: str) -> SpilledBody:
+        """Hash a finished upload of ``session_id`` and move it into place.
+
+        Blocking; run it in a thread.
+        """
+        path = self.part_path(session_id, upload_id)
+        digest = hashlib.sha256()
+        size = 0
+        head = b""
+        with open(path, "rb") as f:
+            while True:
+                chunk = f.read(READ_CHUNK_BYTES)
+                if not chunk:
+                    break
+                if len(head) < self.preview_bytes:
+                    head += chunk[: self.preview_bytes - len(head)]
+                digest.update(chunk)
+                size += len(chunk)
+        hexdigest = digest.hexdigest()
+        os.makedirs(self.session_dir(session_id), exist_ok=True)
+        # Identical bodies share a name, so replacing one is harmless.
+        os.replace(path, self.body_path(session_id, hexdigest))
+        return SpilledBody(hexdigest, size, utf8_preview(head, self.preview_bytes))
+
+    def size(self, session_id: str, digest: str) -> Optional[int]:
+        if not DIGEST_RE.fullmatch(digest):
+            return None
+        try:
+            return os.stat(self.body_path(session_id, digest)).st_size
+        except FileNotFoundError:
+            return None
+
+    def iter_range(self, session_id: str, digest: str, start: int, end: int) -> Iterator[bytes]:
+        """Yield bytes ``start`` to ``end`` (exclusive) of a body.
+
+        Only the pages read are touched, and no slice is larger than
+        ``READ_CHUNK_BYTES``.
+        """
+        if end <= start:
+            return
+        with open(self.body_path(session_id, digest), "rb") as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                for offset in range(start, end, READ_CHUNK_BYTES):
+                    yield mapped[offset : min(offset + READ_CHUNK_BYTES, end)]
+
+    def delete(self, session_id: str, digest: str) -> None:
+        try:
+            os.unlink(self.body_path(session_id, digest))
+        except FileNotFoundError:
+            pass
+
+    def sweep_uploads(self, max_age_seconds: float) -> int:
+        """Delete uploads nobody has touched for ``max_age_seconds``."""
+        cutoff = time.time() - max_age_seconds
+        removed = 0
+        try:
+            entries = list(os.scandir(self.uploads))
+        except FileNotFoundError:
+            return 0
+        for entry in entries:
+            try:
+                if entry.stat().st_mtime < cutoff:
+                    os.unlink(entry.path)
+                    removed += 1
+            except FileNotFoundError:
+                continue
+        return removed
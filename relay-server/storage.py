@@ -0,0 +1,261 @@
+"""Session persistence backends for the relay server.
+
+``server.py`` always serves from memory; a ``SessionStore`` only mirrors
+appended history so sessions survive restarts and can be reloaded after
+eviction. Writes are handed over without blocking the request and the SQLite
+backend group-commits them from a background task.
+"""
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+# (seq, kind, client_msg_id, assistant_msg_id, ts, encoded JSON)
+StoredRow = Tuple[int, str, str, Optional[str], int, bytes]
+
+SQLITE_FLUSH_INTERVAL_MS = 20
+SQLITE_MAX_BATCH = 1000
+# A failed batch stays queued and is retried after this long.
+SQLITE_RETRY_SECONDS = 1.0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    session_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    client_msg_id TEXT NOT NULL,
+    assistant_msg_id TEXT,
+    ts INTEGER NOT NULL,
+    body BLOB NOT NULL,
+    PRIMARY KEY (session_id, seq)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS messages_by_client
+    ON messages (session_id, client_msg_id, kind);
+CREATE TABLE IF NOT EXISTS blobs (
+    session_id TEXT NOT NULL,
+    digest TEXT NOT NULL,
+    body BLOB NOT NULL,
+    PRIMARY KEY (session_id, digest)
+) WITHOUT ROWID;
+"""
+
+# Trimming keeps prompts that never got a response, so pending work survives.
+TRIM_SQL = """
+DELETE FROM messages
+WHERE session_id = ? AND seq < ?
+  AND NOT (
+    kind = 'prompt' AND NOT EXISTS (
+      SELECT 1 FROM messages AS r
+      WHERE r.session_id = messages.session_id
+        AND r.client_msg_id = messages.client_msg_id
+        AND r.kind = 'assistant'
+    )
+  )
+"""
+
+
+class SessionStore:
+    """In-memory default: nothing is persisted and nothing can be reloaded."""
+
+    name = "memory"
+
+    async def start(self) -> None:
+        return None
+
+    async def close(self) -> None:
+        return None
+
+    def append(self, session_id: str, seq: int, record: Any) -> None:
+        return None
+
+    def trim(self, session_id: str, before_seq: int) -> None:
+        return None
+
+    def put_blob(self, session_id: str, digest: str, body: bytes) -> None:
+        return None
+
+    async def load(self, session_id: str) -> Optional[List[StoredRow]]:
+        return None
+
+    async def load_blobs(self, session_id: str) -> Dict[str, bytes]:
+        return {}
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": self.name}
+
+
+class SQLiteStore(SessionStore):
+    """SQLite (WAL) store with write-behind batching.
+
+    ``append`` and ``trim`` only queue work. A background task commits the
+    queue in one transaction every ``flush_interval_ms`` (or as soon as
+    ``max_batch`` operations are waiting) on a dedicated thread, so request
+    latency never includes a disk sync.
+    """
+
+    name = "sqlite"
+
+    def __init__(
+        self,
+        path: str,
+        flush_interval_ms: int = SQLITE_FLUSH_INTERVAL_MS,
+        max_batch: int = SQLITE_MAX_BATCH,
+    ) -> None:
+        self.path = path
+        self.flush_interval_ms = flush_interval_ms
+        self.max_batch = max_batch
+        # One thread owns the connection; sqlite3 objects are not thread-safe.
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="relay-sqlite")
+        self.conn: Optional[sqlite3.Connection] = None
+        self.queue: List[Tuple[str, tuple]] = []
+        self.wakeup = asyncio.Event()
+        self.flush_lock = asyncio.Lock()
+        self.writer_task: Optional[asyncio.Task] = None
+        self.batches = 0
+        self.rows_written = 0
+        self.write_errors = 0
+        self.last_batch_ms = 0.0
+
+    async def _run(self, fn: Any, *args: Any) -> Any:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, fn, *args)
+
+    def _open(self) -> None:
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        # WAL + NORMAL only syncs at checkpoints; a crash loses at most the
+        # last few batches, never corrupts the database.
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(SCHEMA)
+        self.conn = conn
+
+    async def start(self) -> None:
+        await self._run(self._open)
+        self.writer_task = asyncio.create_task(self._writer())
+
+    async def close(self) -> None:
+        if self.writer_task is not None:
+            self.writer_task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self.writer_task
+        await self.flush()
+        if self.conn is not None:
+            await self._run(self.conn.close)
+            self.conn = None
+        self.executor.shutdown(wait=True)
+
+    def append(self, session_id: str, seq: int, record: Any) -> None:
+        self.queue.append(
+            (
+                "append",
+                (
+                    session_id,
+                    seq,
+                    record.kind,
+                    record.client_msg_id,
+                    getattr(record, "assistant_msg_id", None),
+                    record.ts,
+                    record.encoded,
+                ),
+            )
+        )
+        self._wake()
+
+    def trim(self, session_id: str, before_seq: int) -> None:
+        self.queue.append(("trim", (session_id, before_seq)))
+        self._wake()
+
+    def put_blob(self, session_id: str, digest: str, body: bytes) -> None:
+        # Blobs are content-addressed and kept for the session's lifetime;
+        # a restored session keeps only the ones its history references.
+        self.queue.append(("blob", (session_id, digest, body)))
+        self._wake()
+
+    def _wake(self) -> None:
+        if len(self.queue) >= self.max_batch or len(self.queue) == 1:
+            self.wakeup.set()
+
+    async def _writer(self) -> None:
+        while True:
+            await self.wakeup.wait()
+            self.wakeup.clear()
+            if len(self.queue) < self.max_batch:
+                # Let more writes join the batch before committing.
+                await asyncio.sleep(self.flush_interval_ms / 1000)
+            try:
+                await self.flush()
+            except sqlite3.Error as exc:
+                self.write_errors += 1
+                print(
+                    f"❌ SQLite write failed, retrying {len(self.queue)} queued writes"
+                    f" in {SQLITE_RETRY_SECONDS:g}s: {exc}"
+                )
+                await asyncio.sleep(SQLITE_RETRY_SECONDS)
+                self.wakeup.set()
+
+    async def flush(self) -> None:
+        async with self.flush_lock:
+            while self.queue:
+                # Only dequeue once committed; the transaction rolls back on
+                # error and every operation is safe to repeat.
+                batch = self.queue[: self.max_batch]
+                started = time.perf_counter()
+                await self._run(self._write_batch, batch)
+                del self.queue[: len(batch)]
+                self.last_batch_ms = (time.perf_counter() - started) * 1000
+                self.batches += 1
+                self.rows_written += len(batch)
+
+    def _write_batch(self, batch: List[Tuple[str, tuple]]) -> None:
+        assert self.conn is not None
+        with self.conn:
+            for op, args in batch:
+                if op == "append":
+                    self.conn.execute(
+                        "INSERT OR REPLACE INTO messages VALUES (?, ?, ?, ?, ?, ?, ?)", args
+                    )
+                elif op == "blob":
+                    self.conn.execute("INSERT OR IGNORE INTO blobs VALUES (?, ?, ?)", args)
+                else:
+                    self.conn.execute(TRIM_SQL, args)
+
+    async def load(self, session_id: str) -> Optional[List[StoredRow]]:
+        # Writes queued before an eviction must land before we read back.
+        await self.flush()
+        rows = await self._run(self._load_rows, session_id)
+        return rows or None
+
+    def _load_rows(self, session_id: str) -> List[StoredRow]:
+        assert self.conn is not None
+        cursor = self.conn.execute(
+            "SELECT seq, kind, client_msg_id, assistant_msg_id, ts, body"
+            " FROM messages WHERE session_id = ? ORDER BY seq",
+            (session_id,),
+        )
+        return cursor.fetchall()
+
+    async def load_blobs(self, session_id: str) -> Dict[str, bytes]:
+        await self.flush()
+        return await self._run(self._load_blobs, session_id)
+
+    def _load_blobs(self, session_id: str) -> Dict[str, bytes]:
+        assert self.conn is not None
+        cursor = self.conn.execute(
+            "SELECT digest, body FROM blobs WHERE session_id = ?", (session_id,)
+        )
+        return dict(cursor.fetchall())
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": self.name,
+            "path": self.path,
+            "queued_writes": len(self.queue),
+            "batches": self.batches,
+            "rows_written": self.rows_written,
+            "write_errors": self.write_errors,
+            "last_batch_ms": round(self.last_batch_ms, 3),
+        }
@@ -0,0 +1,75 @@
+import asyncio
+
+import pytest
+
+import server
+from server import Frame, Subscriber
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.close_code = None
+
+    async def close(self, code=1000):
+        self.close_code = code
+
+
+def message_frame(seq):
+    return Frame({"type": "message", "data": {"text": f"m{seq}"}, "seq": seq}, seq=seq)
+
+
+def delta_frame(client_msg_id):
+    return Frame({"type": "response_delta", "client_msg_id": client_msg_id, "delta": "x"})
+
+
+@pytest.mark.parametrize("policy", ["coalesce", "drop_oldest"])
+def test_full_queue_of_messages_closes_instead_of_dropping(policy):
+    async def run():
+        websocket = FakeWebSocket()
+        subscriber = Subscriber(websocket, max_queue=4, overflow_policy=policy)
+        for seq in range(1, 5):
+            assert subscriber.send(message_frame(seq))
+        disconnects = server.fanout_stats["slow_consumer_disconnects"]
+        dropped = server.fanout_stats["frames_dropped"]
+
+        assert not subscriber.send(message_frame(5))
+        await asyncio.sleep(0)
+
+        assert subscriber.closed
+        assert websocket.close_code == server.SLOW_CONSUMER_CLOSE_CODE
+        assert server.fanout_stats["slow_consumer_disconnects"] == disconnects + 1
+        assert server.fanout_stats["frames_dropped"] == dropped
+
+    asyncio.run(run())
+
+
+@pytest.mark.parametrize("policy", ["coalesce", "drop_oldest"])
+def test_overflow_drops_stream_frames_before_messages(policy):
+    async def run():
+        subscriber = Subscriber(FakeWebSocket(), max_queue=4, overflow_policy=policy)
+        subscriber.send(message_frame(1))
+        subscriber.send(delta_frame("a"), ("stream", "a"))
+        subscriber.send(message_frame(2))
+        subscriber.send(message_frame(3))
+
+        assert subscriber.send(message_frame(4))
+
+        assert not subscriber.closed
+        assert [item[1].seq for item in subscriber.queue] == [1, 2, 3, 4]
+        assert not subscriber.keyed
+
+    asyncio.run(run())
+
+
+def test_stream_frame_is_dropped_when_only_messages_are_queued():
+    async def run():
+        subscriber = Subscriber(FakeWebSocket(), max_queue=2)
+        subscriber.send(message_frame(1))
+        subscriber.send(message_frame(2))
+
+        assert subscriber.send(delta_frame("a"), ("stream", "a"))
+
+        assert not subscriber.closed
+        assert [item[1].seq for item in subscriber.queue] == [1, 2]
+
+    asyncio.run(run())
@@ -0,0 +1,31 @@
+from server import PromptRecord, SessionHistory
+
+
+def make_history(*timestamps):
+    history = SessionHistory()
+    for i, ts in enumerate(timestamps):
+        history.append(PromptRecord.create("s", f"c{i}", f"p{i}", None, ts))
+    return history
+
+
+def page_ts(history, **kwargs):
+    page, total = history.page(**kwargs)
+    return [record.ts for _, record in page], total
+
+
+def test_since_with_ordered_ts():
+    history = make_history(10, 20, 30, 40)
+    assert page_ts(history, since=20) == ([30, 40], 2)
+    assert page_ts(history, since=20, newest_first=True, limit=1) == ([40], 2)
+
+
+def test_since_with_out_of_order_ts():
+    # An agent-supplied ts older than an earlier record's must not match.
+    history = make_history(10, 30, 15, 40, 20, 50)
+    assert page_ts(history, since=25) == ([30, 40, 50], 3)
+    assert page_ts(history, since=25, offset=1, limit=1) == ([40], 3)
+    assert page_ts(history, since=25, newest_first=True, limit=2) == ([50, 40], 3)
+    assert page_ts(history, since=5, limit=2) == ([10, 30], 6)
+    assert page_ts(history, since=50) == ([], 0)
+    seqs = [seq for seq, _ in history.page(since=25, after_seq=2)[0]]
+    assert seqs == [4, 6]
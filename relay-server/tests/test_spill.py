@@ -0,0 +1,21 @@
+import pytest
+
+from spill import SpillStore
+
+
+def test_upload_belongs_to_its_session(tmp_path):
+    spill = SpillStore(str(tmp_path), max_bytes=1 << 20, preview_bytes=4)
+    upload_id = spill.create_upload("a")
+
+    with pytest.raises(FileNotFoundError):
+        spill.open_upload("b", upload_id, 0)
+    with pytest.raises(FileNotFoundError):
+        spill.finish("b", upload_id)
+    spill.discard_upload("b", upload_id)
+
+    part = spill.open_upload("a", upload_id, 0)
+    part.write(b"hello world")
+    part.close()
+    body = spill.finish("a", upload_id)
+    assert body.size == 11
+    assert body.preview == "hell"
@@ -0,0 +1,44 @@
+import sqlite3
+import sys
+from pathlib import Path
+
+import httpx
+
+from storage import SCHEMA
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "benchmarks"))
+from harness import run_relay  # noqa: E402
+
+
+def test_two_workers_write_each_row_once(tmp_path):
+    path = tmp_path / "relay.db"
+    conn = sqlite3.connect(path)
+    conn.executescript(SCHEMA)
+    # Count every insert, including INSERT OR REPLACE of a row already there.
+    conn.executescript(
+        """
+        CREATE TABLE writes (session_id TEXT, seq INTEGER);
+        CREATE TRIGGER count_writes AFTER INSERT ON messages
+        BEGIN INSERT INTO writes VALUES (NEW.session_id, NEW.seq); END;
+        """
+    )
+    conn.close()
+
+    with run_relay(workers=2, env={"RELAY_SQLITE_PATH": str(path)}) as relay:
+        with httpx.Client(base_url=relay.base_url, timeout=10) as client:
+            for i in range(20):
+                client.post(
+                    "/prompt", json={"session_id": "s", "prompt": f"p{i}", "client_msg_id": f"c{i}"}
+                ).raise_for_status()
+                client.post(
+                    "/response", json={"session_id": "s", "client_msg_id": f"c{i}", "text": f"r{i}"}
+                ).raise_for_status()
+
+    conn = sqlite3.connect(path)
+    try:
+        assert conn.execute("SELECT COUNT(*) FROM messages").fetchone()[0] == 40
+        writes = conn.execute("SELECT seq, COUNT(*) FROM writes GROUP BY seq").fetchall()
+        assert len(writes) == 40
+        assert all(count == 1 for _, count in writes)
+    finally:
+        conn.close()
@@ -0,0 +1,83 @@
+"""Binary WebSocket subprotocols for ``/ws/{session_id}``.
+
+Clients opt in by offering one or more of these in ``Sec-WebSocket-Protocol``;
+the relay accepts the first one it supports and otherwise falls back to plain
+JSON text frames.
+
+- ``relay.v1.msgpack``: MessagePack bodies (needs the ``msgpack`` package)
+- ``relay.v1.json``: UTF-8 JSON bodies
+
+Every binary message is one flag byte followed by the body. Bit 0 of the flag
+means the body is zlib-compressed; the relay compresses outbound bodies of at
+least ``WIRE_COMPRESS_MIN_BYTES``, once per frame for all subscribers. Clients
+may send either compressed or plain bodies.
+"""
+from __future__ import annotations
+
+import json
+import zlib
+from typing import Any, List, Optional, Sequence
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - optional dependency
+    msgpack = None
+
+MSGPACK_PROTOCOL = "relay.v1.msgpack"
+JSON_PROTOCOL = "relay.v1.json"
+
+FLAG_ZLIB = 0x01
+WIRE_COMPRESS_MIN_BYTES = 1024
+WIRE_COMPRESS_LEVEL = 6
+
+
+def supported_protocols() -> List[str]:
+    protocols = [JSON_PROTOCOL]
+    if msgpack is not None:
+        protocols.insert(0, MSGPACK_PROTOCOL)
+    return protocols
+
+
+def negotiate(offered: Sequence[str]) -> Optional[str]:
+    """Pick the client's most preferred protocol we support, if any."""
+    supported = supported_protocols()
+    for protocol in offered:
+        if protocol in supported:
+            return protocol
+    return None
+
+
+def encode_body(protocol: str, value: Any) -> bytes:
+    if protocol == MSGPACK_PROTOCOL:
+        return msgpack.packb(value, use_bin_type=True)
+    return json.dumps(value, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+def pack(body: bytes, compress_min_bytes: int = WIRE_COMPRESS_MIN_BYTES) -> bytes:
+    """Prefix ``body`` with its flag byte, compressing it when large enough."""
+    if len(body) >= compress_min_bytes:
+        compressed = zlib.compress(body, WIRE_COMPRESS_LEVEL)
+        if len(compressed) < len(body):
+            return bytes((FLAG_ZLIB,)) + compressed
+    return b"\x00" + body
+
+
+def encode(protocol: str, value: Any, compress_min_bytes: int = WIRE_COMPRESS_MIN_BYTES) -> bytes:
+    return pack(encode_body(protocol, value), compress_min_bytes)
+
+
+def decode(protocol: str, data: bytes) -> Any:
+    """Decode one binary message; raises ``ValueError`` if it is malformed."""
+    if not data:
+        raise ValueError("empty frame")
+    body = data[1:]
+    try:
+        if data[0] & FLAG_ZLIB:
+            body = zlib.decompress(body)
+        if protocol == MSGPACK_PROTOCOL:
+            return msgpack.unpackb(body, raw=False)
+        return json.loads(body)
+    except ValueError:
+        raise
+    except Exception as exc:  # zlib.error, msgpack's exceptions
+        raise ValueError(str(exc)) from exc